@@ -0,0 +1,368 @@
+"""
+Batched growth-curve fitting for YFP intensity time series.
+
+All curves are fitted together: the data is held as (n_curves, n_timepoints) arrays
+(NaN for missing points) and every Levenberg-Marquardt iteration updates all curves
+with one batched linear solve, instead of calling curve_fit once per curve.
+
+Models (Zwietering et al., 1990 parametrization, time in hours):
+    logistic     y = y0 + A / (1 + exp(4 mu / A (lag - t) + 2))
+    gompertz     y = y0 + A exp(-exp(mu e / A (lag - t) + 1))
+    exponential  log-linear fit over the window of fastest growth
+
+Each fit reports lag time, maximum growth rate and plateau (y0 + A) with Wald 95%
+confidence intervals.
+
+Usage:
+    python growth_fit.py intensity_25um.csv intensity_30um.csv --model gompertz -o growth_parameters.csv
+    python growth_fit.py --benchmark 10000
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'data-acquisition-analysis'))
+from results_store import ResultsStore
+
+EXPERIMENT = 'single_bac'
+Z_95 = 1.959964
+PARAMS = ['y0', 'A', 'mu', 'lag']
+
+def logistic(t, p):
+    """Zwietering logistic model; p has shape (n_curves, 4), t (n_curves, n_times)."""
+    y0, A, mu, lag = (p[:, i:i + 1] for i in range(4))
+    return y0 + A / (1 + np.exp(np.clip(4 * mu / A * (lag - t) + 2, -50, 50)))
+
+def gompertz(t, p):
+    """Zwietering Gompertz model; p has shape (n_curves, 4), t (n_curves, n_times)."""
+    y0, A, mu, lag = (p[:, i:i + 1] for i in range(4))
+    return y0 + A * np.exp(-np.exp(np.clip(mu * np.e / A * (lag - t) + 1, -50, 50)))
+
+MODELS = {'logistic': logistic, 'gompertz': gompertz}
+
+def initial_guess(t, y):
+    """Vectorized starting values from baseline, range and steepest finite-difference slope (NaN for empty curves)."""
+    empty = ~(np.isfinite(y) & np.isfinite(t)).any(axis=1)
+    t = np.where(empty[:, None], np.arange(t.shape[1], dtype=float), t)  # placeholders, reset to NaN below
+    y = np.where(empty[:, None], 0.0, y)
+    y0 = np.nanmin(y, axis=1)
+    A = np.maximum(np.nanmax(y, axis=1) - y0, 1e-9)
+    slope = np.diff(y, axis=1) / np.diff(t, axis=1)
+    slope = np.where(np.isfinite(slope), slope, -np.inf)
+    k = np.argmax(slope, axis=1)
+    rows = np.arange(len(y))
+    mu = np.maximum(slope[rows, k], A / np.nanmax(t, axis=1) * 1e-3)
+    t_mid = (t[rows, k] + t[rows, k + 1]) / 2
+    y_mid = (np.nan_to_num(y[rows, k]) + np.nan_to_num(y[rows, k + 1])) / 2
+    lag = np.maximum(t_mid - (y_mid - y0) / mu, 0)
+    guess = np.column_stack([y0, A, mu, lag])
+    guess[empty] = np.nan
+    return guess
+
+def _jacobian(model, t, p, f0):
+    """Forward-difference Jacobian for all curves at once, shape (n_curves, n_times, 4)."""
+    J = np.empty(f0.shape + (p.shape[1],))
+    for i in range(p.shape[1]):
+        h = 1e-6 * np.maximum(np.abs(p[:, i]), 1e-3)
+        dp = p.copy()
+        dp[:, i] += h
+        J[:, :, i] = (model(t, dp) - f0) / h[:, None]
+    return J
+
+def fit_curves(t, y, model='gompertz', max_iter=100, tol=1e-8):
+    """
+    Fit a sigmoid growth model to many curves with a batched Levenberg-Marquardt solver.
+
+    Args:
+        t (np.ndarray): Times in hours, shape (n_curves, n_times) or (n_times,)
+        y (np.ndarray): Intensities, shape (n_curves, n_times); NaN marks missing points
+        model (str): 'logistic' or 'gompertz'
+        max_iter (int): Maximum number of iterations
+        tol (float): Relative change of the residual sum of squares to stop a curve
+
+    Returns:
+        pd.DataFrame: One row per curve with lag, rate and plateau, their 95% CIs,
+            rss, n_points and converged
+    """
+    f = MODELS[model]
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    t = np.broadcast_to(np.asarray(t, dtype=float), y.shape)
+    mask = np.isfinite(y) & np.isfinite(t)
+    y_filled = np.where(mask, y, 0.0)
+    t = np.where(mask, t, 0.0)
+    n_points = mask.sum(axis=1)
+
+    # Scale each curve to unit range so damping and tolerances are comparable
+    scale = np.maximum(np.max(np.where(mask, np.abs(y), 0.0), axis=1), 1e-12)
+    ys = y_filled / scale[:, None]
+
+    p = initial_guess(np.where(mask, t, np.nan), np.where(mask, ys, np.nan))
+    damping = np.full(len(p), 1e-3)
+    active = n_points > len(PARAMS)
+    fitted = f(t, p)
+    rss = np.sum(np.where(mask, ys - fitted, 0) ** 2, axis=1)
+    converged = np.zeros(len(p), dtype=bool)
+    eye = np.eye(len(PARAMS))
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active & ~converged)
+        if idx.size == 0:
+            break
+        ta, pa, ma = t[idx], p[idx], mask[idx]
+        fa = fitted[idx]
+        r = np.where(ma, ys[idx] - fa, 0.0)
+        J = _jacobian(f, ta, pa, fa) * ma[:, :, None]
+        JTJ = np.einsum('nti,ntj->nij', J, J)
+        g = np.einsum('nti,nt->ni', J, r)
+        diag = np.einsum('nii->ni', JTJ)[:, :, None] * eye
+        step = np.linalg.solve(JTJ + damping[idx, None, None] * (diag + 1e-12 * eye), g[:, :, None])[:, :, 0]
+
+        trial = pa + step
+        trial[:, 1:3] = np.maximum(trial[:, 1:3], 1e-9)  # A, mu > 0
+        trial_fit = f(ta, trial)
+        trial_rss = np.sum(np.where(ma, ys[idx] - trial_fit, 0) ** 2, axis=1)
+        better = np.isfinite(trial_rss) & (trial_rss < rss[idx])
+
+        acc = idx[better]
+        converged[acc] = (rss[acc] - trial_rss[better]) <= tol * np.maximum(rss[acc], 1e-30)
+        p[acc], fitted[acc], rss[acc] = trial[better], trial_fit[better], trial_rss[better]
+        damping[acc] = np.maximum(damping[acc] / 3, 1e-12)
+        rej = idx[~better]
+        damping[rej] *= 4
+        converged[rej] |= damping[rej] > 1e10  # no further progress possible
+
+    # Wald intervals from s^2 (J^T J)^-1 at the solution, only for the fitted curves
+    # (curves with too few points keep their NaN starting values)
+    fit_idx = np.flatnonzero(active)
+    cov = np.full((len(p), len(PARAMS), len(PARAMS)), np.nan)
+    if fit_idx.size:
+        J = _jacobian(f, t[fit_idx], p[fit_idx], fitted[fit_idx]) * mask[fit_idx, :, None]
+        JTJ = np.einsum('nti,ntj->nij', J, J)
+        dof = np.maximum(n_points[fit_idx] - len(PARAMS), 1)
+        cov[fit_idx] = np.linalg.pinv(JTJ) * (rss[fit_idx] / dof)[:, None, None]
+    se = np.sqrt(np.maximum(np.einsum('nii->ni', cov), 0))
+
+    # Back to the original intensity scale
+    p[:, :2] *= scale[:, None]
+    p[:, 2] *= scale
+    se[:, :2] *= scale[:, None]
+    se[:, 2] *= scale
+    plateau = p[:, 0] + p[:, 1]
+    se_plateau = np.sqrt(np.maximum(cov[:, 0, 0] + cov[:, 1, 1] + 2 * cov[:, 0, 1], 0)) * scale
+
+    result = pd.DataFrame({
+        'model': model,
+        'lag': p[:, 3],
+        'lag_lo': p[:, 3] - Z_95 * se[:, 3],
+        'lag_hi': p[:, 3] + Z_95 * se[:, 3],
+        'rate': p[:, 2],
+        'rate_lo': p[:, 2] - Z_95 * se[:, 2],
+        'rate_hi': p[:, 2] + Z_95 * se[:, 2],
+        'plateau': plateau,
+        'plateau_lo': plateau - Z_95 * se_plateau,
+        'plateau_hi': plateau + Z_95 * se_plateau,
+        'y0': p[:, 0],
+        'rss': rss * scale ** 2,
+        'n_points': n_points,
+        'converged': converged & active,
+    })
+    result.loc[~active, ['lag', 'rate', 'plateau']] = np.nan
+    return result
+
+def fit_exponential_phase(t, y, window=4):
+    """
+    Exponential-phase fit: log-linear regression over the window of fastest growth.
+
+    Every window of `window` consecutive points of every curve is regressed at once;
+    the window with the largest slope gives the specific growth rate (per hour). The
+    lag is where that tangent crosses the initial log-intensity, and the plateau is
+    the largest observed intensity.
+
+    Args:
+        t (np.ndarray): Times in hours, shape (n_curves, n_times) or (n_times,)
+        y (np.ndarray): Intensities, shape (n_curves, n_times); NaN or <= 0 are ignored
+        window (int): Number of points per regression window
+
+    Returns:
+        pd.DataFrame: One row per curve with lag, rate and plateau and their 95% CIs
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    t = np.broadcast_to(np.asarray(t, dtype=float), y.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logy = np.where(y > 0, np.log(y), np.nan)
+
+    tw = np.lib.stride_tricks.sliding_window_view(t, window, axis=1)
+    lw = np.lib.stride_tricks.sliding_window_view(logy, window, axis=1)
+    valid = np.isfinite(lw).all(axis=2)
+    t_mean = tw.mean(axis=2, keepdims=True)
+    l_mean = lw.mean(axis=2, keepdims=True)  # only used for complete (valid) windows
+    sxx = np.sum((tw - t_mean) ** 2, axis=2)
+    slope = np.sum((tw - t_mean) * (lw - l_mean), axis=2) / sxx
+    slope = np.where(valid, slope, -np.inf)
+    best = np.argmax(slope, axis=1)
+    rows = np.arange(len(y))
+
+    rate = slope[rows, best]
+    rate = np.where(np.isfinite(rate), rate, np.nan)  # no complete window
+    intercept = l_mean[rows, best, 0] - rate * t_mean[rows, best, 0]
+    resid = lw[rows, best] - (intercept[:, None] + rate[:, None] * tw[rows, best])
+    se_rate = np.sqrt(np.sum(resid ** 2, axis=1) / max(window - 2, 1) / sxx[rows, best])
+
+    first = np.argmax(np.isfinite(logy), axis=1)
+    log_y0 = logy[rows, first]
+    has_fit = np.isfinite(rate) & (rate > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lag = np.where(has_fit, (log_y0 - intercept) / rate, np.nan)
+        se_lag = np.abs(lag - t_mean[rows, best, 0]) * se_rate / rate
+    rate = np.where(has_fit, rate, np.nan)
+    plateau = np.max(np.where(np.isfinite(y), y, -np.inf), axis=1)
+    plateau = np.where(np.isfinite(plateau), plateau, np.nan)
+
+    return pd.DataFrame({
+        'model': 'exponential',
+        'lag': lag,
+        'lag_lo': lag - Z_95 * se_lag,
+        'lag_hi': lag + Z_95 * se_lag,
+        'rate': rate,
+        'rate_lo': rate - Z_95 * se_rate,
+        'rate_hi': rate + Z_95 * se_rate,
+        'plateau': plateau,
+        'plateau_lo': np.nan,
+        'plateau_hi': np.nan,
+        'n_points': np.isfinite(logy).sum(axis=1),
+        'converged': has_fit,
+    })
+
+def fit(t, y, model='gompertz'):
+    """Fit any of 'logistic', 'gompertz' or 'exponential' to a batch of curves."""
+    if model == 'exponential':
+        return fit_exponential_phase(t, y)
+    return fit_curves(t, y, model)
+
+# ─────────────────────────────────────────────
+# Loading curves
+# ─────────────────────────────────────────────
+def load_condition_curves(csv_paths, experiment=EXPERIMENT, store=None):
+    """
+    Load aggregate intensity curves (MeanIntensity per timepoint), one per condition.
+
+    Returns:
+        tuple: (ids DataFrame with a condition column, t in hours, y), padded with NaN
+    """
+    store = store or ResultsStore()
+    series = {}
+    for csv_path in csv_paths:
+        condition = Path(csv_path).stem.replace('intensity_', '')
+        if not store.has('intensity', source=csv_path, experiment=experiment, condition=condition):
+            store.ingest_intensity_csv(csv_path, experiment, condition)
+        df = store.read('intensity', columns=['ElapsedMinutes', 'MeanIntensity'],
+                        filters=[('experiment', '==', experiment), ('condition', '==', condition)])
+        series[condition] = df.sort_values('ElapsedMinutes')
+    return _pad(series, 'ElapsedMinutes', 'MeanIntensity', ['condition'])
+
+def load_droplet_trajectories(experiment=EXPERIMENT, value='IntDen', store=None, interval=20):
+    """
+    Load per-droplet fluorescence trajectories from the results store.
+
+    Droplets are identified by (condition, fov, DropletID) across timepoints, which
+    holds when Macro_YF_analysis.ijm measures every timepoint with the same ROI set.
+    Times come from the acquisition timestamps; conditions imported without them
+    (results_store.py without --timestamp) use timepoint * interval instead.
+
+    Args:
+        interval (float): Minutes between timepoints, for conditions without timestamps
+
+    Returns:
+        tuple: (ids DataFrame, t in hours, y), padded with NaN
+    """
+    store = store or ResultsStore()
+    df = store.read('fluorescence', columns=['condition', 'fov', 'timepoint', 'DropletID', 'Timestamp', value],
+                    filters=[('experiment', '==', experiment)])
+    if df.empty:
+        return pd.DataFrame(columns=['condition', 'fov', 'DropletID']), np.empty((0, 0)), np.empty((0, 0))
+    start = df.groupby('condition')['Timestamp'].transform('min')
+    df['ElapsedMinutes'] = (df['Timestamp'] - start).dt.total_seconds() / 60
+    untimed = df['Timestamp'].isna().groupby(df['condition']).transform('any')
+    if untimed.any():
+        print(f"No timestamps for {', '.join(map(str, df.loc[untimed, 'condition'].unique()))}: "
+              f"using timepoint x {interval:g} min")
+        df.loc[untimed, 'ElapsedMinutes'] = df.loc[untimed, 'timepoint'].astype(float) * interval
+    keys = ['condition', 'fov', 'DropletID']
+    series = {key: group.sort_values('ElapsedMinutes') for key, group in df.groupby(keys)}
+    return _pad(series, 'ElapsedMinutes', value, keys)
+
+def _pad(series, time_column, value_column, key_names):
+    n_times = max((len(s) for s in series.values()), default=0)
+    t = np.full((len(series), n_times), np.nan)
+    y = np.full((len(series), n_times), np.nan)
+    for i, s in enumerate(series.values()):
+        t[i, :len(s)] = s[time_column].to_numpy() / 60
+        y[i, :len(s)] = s[value_column].to_numpy()
+    keys = [k if isinstance(k, tuple) else (k,) for k in series]
+    return pd.DataFrame(keys, columns=key_names), t, y
+
+# ─────────────────────────────────────────────
+# Benchmark
+# ─────────────────────────────────────────────
+def synthetic_curves(n_curves, n_times=24, interval_h=3.33, noise=0.03, seed=0):
+    """Random Gompertz curves with known lag/rate/plateau for benchmarking and checks."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_times) * interval_h
+    truth = np.column_stack([
+        rng.uniform(50, 200, n_curves),         # y0
+        rng.uniform(5000, 25000, n_curves),     # A
+        rng.uniform(300, 1500, n_curves),       # mu (intensity per hour)
+        rng.uniform(2, 20, n_curves),           # lag (hours)
+    ])
+    y = gompertz(np.broadcast_to(t, (n_curves, n_times)), truth)
+    y = y * (1 + noise * rng.standard_normal(y.shape))
+    return t, y, pd.DataFrame(truth, columns=PARAMS)
+
+def benchmark(n_curves=10000, models=('gompertz', 'logistic', 'exponential')):
+    """Print curves per second and median relative error on synthetic Gompertz curves."""
+    t, y, truth = synthetic_curves(n_curves)
+    for model in models:
+        start = time.perf_counter()
+        result = fit(t, y, model)
+        elapsed = time.perf_counter() - start
+        line = f"{model:12s} {n_curves} curves in {elapsed:.2f} s ({n_curves / elapsed:,.0f} curves/s)"
+        if model == 'gompertz':
+            lag_err = np.nanmedian(np.abs(result['lag'] - truth['lag']) / truth['lag'])
+            rate_err = np.nanmedian(np.abs(result['rate'] - truth['mu']) / truth['mu'])
+            line += (f", converged {result['converged'].mean():.1%}, "
+                     f"median error lag {lag_err:.1%} rate {rate_err:.1%}")
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fit growth models to YFP intensity curves')
+    parser.add_argument('csv_files', nargs='*', help='intensity_*.csv files (one curve per condition)')
+    parser.add_argument('--droplets', action='store_true',
+                        help='Fit per-droplet trajectories from the fluorescence table of the results store')
+    parser.add_argument('--experiment', default=EXPERIMENT, help='Experiment name in the results store')
+    parser.add_argument('--interval', type=float, default=20,
+                        help='Minutes between timepoints, for droplets imported without timestamps (default: 20)')
+    parser.add_argument('--model', choices=['gompertz', 'logistic', 'exponential'], default='gompertz')
+    parser.add_argument('-o', '--output', help='Path to save the parameter table (CSV)')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='Fit N synthetic curves and report curves/s')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        sys.exit(0)
+
+    if args.droplets:
+        ids, t, y = load_droplet_trajectories(args.experiment, interval=args.interval)
+    else:
+        ids, t, y = load_condition_curves(args.csv_files or ['intensity_25um.csv', 'intensity_30um.csv'],
+                                          args.experiment)
+    result = pd.concat([ids, fit(t, y, args.model)], axis=1)
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"Parameters saved to {args.output}")
+    else:
+        with pd.option_context('display.max_columns', None, 'display.width', 200):
+            print(result)
@@ -1,33 +1,90 @@
-import pandas as pd
+import sys
+import argparse
+import matplotlib
 import matplotlib.pyplot as plt
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 
-def load_intensity_data(csv_path):
-    """Load and process intensity data from a CSV file."""
-    df = pd.read_csv(csv_path)
-    # Add time points in minutes (0, 20, 40, ...)
-    df['TimePoint'] = df.index * 20
-    return df
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'data-acquisition-analysis'))
+from results_store import ResultsStore
 
-def plot_multiple_intensity(csv_paths, labels=None, output_file=None, time_interval=20, show_median=True, 
-                         start_time=None, end_time=None, time_unit='minutes', show_sd=True, colors=None):
+EXPERIMENT = 'single_bac'
+PLOT_COLUMNS = ['ElapsedMinutes', 'MeanIntensity', 'MedianIntensity', 'StdDev']
+
+# Figure variants rendered from the same loaded data. 'scale' converts minutes to the axis unit.
+VARIANTS = {
+    'minutes': {'scale': 1, 'suffix': '', 'figsize': (12, 6), 'label_size': 16, 'tick_size': None, 'tick': None},
+    'hours': {'scale': 60, 'suffix': '_hours', 'figsize': (12, 8), 'label_size': 18, 'tick_size': 12, 'tick': 1},
+}
+
+# Shared in-memory cache: one query per (experiment, CSV, time range) per process
+_DATA_CACHE = {}
+
+def load_intensity_data(csv_path, experiment=EXPERIMENT, store=None, start_min=None, end_min=None):
+    """
+    Load the intensity series of one condition, with elapsed time taken from its timestamps.
+
+    The CSV is imported into the results store the first time it is used (and again when
+    it changes). The time range is passed to the store query, so only matching rows are
+    read, and the result is cached in memory so every figure variant reuses the same load.
+
+    Args:
+        csv_path (str or Path): intensity_<condition>.csv
+        experiment (str): Experiment name in the results store
+        store (ResultsStore, optional): Store to read from (default: the repository store)
+        start_min (float, optional): Earliest ElapsedMinutes to load
+        end_min (float, optional): Latest ElapsedMinutes to load
+
+    Returns:
+        DataFrame: ElapsedMinutes, MeanIntensity, MedianIntensity and StdDev, sorted by time
+    """
+    key = (experiment, str(Path(csv_path).resolve()), start_min, end_min)
+    if key not in _DATA_CACHE:
+        store = store or ResultsStore()
+        condition = Path(csv_path).stem.replace('intensity_', '')
+        if not store.has('intensity', source=csv_path, experiment=experiment, condition=condition):
+            store.ingest_intensity_csv(csv_path, experiment, condition)
+        filters = [('experiment', '==', experiment), ('condition', '==', condition)]
+        if start_min is not None:
+            filters.append(('ElapsedMinutes', '>=', start_min))
+        if end_min is not None:
+            filters.append(('ElapsedMinutes', '<=', end_min))
+        df = store.read('intensity', columns=PLOT_COLUMNS, filters=filters)
+        _DATA_CACHE[key] = df.sort_values('ElapsedMinutes').reset_index(drop=True)
+    return _DATA_CACHE[key]
+
+def _tick_step(span, base, max_ticks=25):
+    """Smallest multiple of base that keeps the number of ticks at or below max_ticks."""
+    if span <= 0:
+        return base
+    return base * max(1, int(np.ceil(span / base / max_ticks)))
+
+def plot_multiple_intensity(csv_paths, labels=None, output_file=None, time_interval=20, show_median=True,
+                         start_time=None, end_time=None, time_unit='minutes', show_sd=True, colors=None,
+                         variants=('minutes', 'hours'), experiment=EXPERIMENT):
     """
     Plot intensity over time from multiple CSV files on the same plot.
-    
+
+    Each CSV is loaded once; the minutes and hours figures (and any other entry of
+    VARIANTS) are drawn from that single load.
+
     Args:
         csv_paths (list): List of paths to CSV files
         labels (list, optional): List of labels for the legend. If None, filenames will be used.
-        output_file (str or Path, optional): Path to save the plot.
-        time_interval (int): Time interval in minutes between data points (default: 20)
+        output_file (str or Path, optional): Path to save the plot. Other variants are saved
+            next to it with their suffix (e.g. intensity_plot_hours.png).
+        time_interval (int): Acquisition interval in minutes, used as the base x-tick spacing (default: 20)
         show_median (bool): Whether to plot median intensity (default: True)
         start_time (float, optional): Start time in the specified time_unit
         end_time (float, optional): End time in the specified time_unit
         time_unit (str): Unit for start/end times ('minutes' or 'hours')
+        variants (tuple): Names of the VARIANTS to render
+        experiment (str): Experiment name in the results store
     """
     if not labels:
         labels = [Path(path).stem for path in csv_paths]
-    
+
     # Set up colors
     if colors is None:
         colors = plt.cm.tab10(np.linspace(0, 1, len(csv_paths)))
@@ -36,326 +93,234 @@ def plot_multiple_intensity(csv_paths, labels=None, output_file=None, time_inter
         colors = [colors[i % len(colors)] for i in range(len(csv_paths))]
 
     # Convert time range to minutes if needed
-    if start_time is not None and time_unit == 'hours':
-        start_time *= 60
-    if end_time is not None and time_unit == 'hours':
-        end_time *= 60
-    
-    # Create figure and axis
-    plt.figure(figsize=(12, 6))
-    
-    # Color cycle for multiple plots
-    # colors = plt.cm.tab10(np.linspace(0, 1, len(csv_paths)))
-    
-    # Track min/max time for x-axis
-    min_time = float('inf')
-    max_time = -float('inf')
-    
-    # Plot each dataset
-    for i, (csv_path, label, color) in enumerate(zip(csv_paths, labels, colors)):
+    unit_scale = VARIANTS[time_unit]['scale']
+    start_min = start_time * unit_scale if start_time is not None else None
+    end_min = end_time * unit_scale if end_time is not None else None
+
+    # Load every dataset once, restricted to the time range by the store query
+    series = []
+    for csv_path, label, color in zip(csv_paths, labels, colors):
         try:
-            df = load_intensity_data(csv_path)
-            
-            # Filter data by time range
-            if start_time is not None:
-                df = df[df['TimePoint'] >= start_time]
-            if end_time is not None:
-                df = df[df['TimePoint'] <= end_time]
-            
-            if len(df) == 0:
-                print(f"Warning: No data in range for {csv_path}")
-                continue
-                
-            # Update time range
-            min_time = min(min_time, df['TimePoint'].min())
-            max_time = max(max_time, df['TimePoint'].max())
-            
-            # Plot mean intensity with error bars
-            if 'MeanIntensity' in df.columns:
-                if show_sd and 'StdDev' in df.columns:
-                    plt.errorbar(
-                        df['TimePoint'],
-                        df['MeanIntensity'],
-                        yerr=df['StdDev'].fillna(0),
-                        marker='o',
-                        linestyle='-',
-                        capsize=3,
-                        label=f'{label} (Mean ± SD)',
-                        color=color,
-                        alpha=0.9,
-                        markersize=5,
-                        linewidth=1.2,
-                        markeredgecolor='white',
-                        markeredgewidth=0.5,
-                        elinewidth=1
-                    )
-                else:
-                    plt.plot(
-                        df['TimePoint'],
-                        df['MeanIntensity'],
-                        marker='o',
-                        linestyle='-',
-                        label=f'{label} (Mean)',
-                        color=color,
-                        alpha=0.9,
-                        markersize=5,
-                        linewidth=1.2,
-                        markeredgecolor='white',
-                        markeredgewidth=0.5
-                    )
-            
-            # Plot median intensity
-            if show_median and 'MedianIntensity' in df.columns:
-                plt.plot(
-                    df['TimePoint'],
-                    df['MedianIntensity'],
-                    marker='s',
-                    linestyle='--',
-                    label=f'{label} (Median)',
-                    color=color,
-                    alpha=0.8,
-                    markersize=4,
-                    linewidth=1,
-                    markeredgecolor='white',
-                    markeredgewidth=0.5
-                )
-                
+            df = load_intensity_data(csv_path, experiment, start_min=start_min, end_min=end_min)
         except Exception as e:
             print(f"Error processing {csv_path}: {str(e)}")
-    
-    # Set plot title and labels
-    plt.title('Fluorescence Intensity Over Time', fontsize=18, fontweight='bold')
-    plt.xlabel('Time (minutes)', fontsize=16)
-    plt.ylabel('Integrated Density (IntDen)', fontsize=16)
-    
-    # Set x-ticks
-    if min_time != float('inf') and max_time != -float('inf'):
-        plt.xlim(left=start_time, right=end_time)
-        plt.xticks(np.arange(
-            max(0, (min_time // time_interval) * time_interval),
-            max_time + time_interval,
-            time_interval
-        ))
-    
-    # Add grid for better readability
-    plt.grid(True, linestyle='--', alpha=0.5)
-    
-    # Add legend outside the plot
-    plt.legend(loc='upper left')
-    
-    # Adjust layout to prevent label cutoff
-    plt.tight_layout()
-    
-    # Save or show the plot
-    if output_file:
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
-        print(f"Plot saved to {output_file}")
-        
-        # Create and save hours plot
-        hours_output = str(Path(output_file).with_stem(f"{Path(output_file).stem}_hours"))
-        convert_to_hours_plot(csv_paths, labels, hours_output, time_interval, show_median, 
-                            start_time, end_time, time_unit, show_sd, colors)
-    else:
-        plt.show()
-        plt.figure()
-        convert_to_hours_plot(csv_paths, labels, None, time_interval, show_median,
-                            start_time, end_time, time_unit, show_sd, colors)
+            continue
+        if len(df) == 0:
+            print(f"Warning: No data in range for {csv_path}")
+            continue
+        series.append((df, label, color))
 
-def convert_to_hours_plot(csv_paths, labels, output_file, time_interval, show_median=True, 
-                        start_time=None, end_time=None, time_unit='minutes', show_sd=True, colors=None):
+    outputs = []
+    for name in variants:
+        variant_output = None
+        if output_file:
+            variant_output = str(Path(output_file).with_stem(f"{Path(output_file).stem}{VARIANTS[name]['suffix']}"))
+        render_intensity_variant(series, name, variant_output, time_interval, show_median, show_sd,
+                                 start_min, end_min)
+        outputs.append(variant_output)
+    return outputs
+
+def render_intensity_variant(series, variant, output_file, time_interval, show_median=True, show_sd=True,
+                             start_min=None, end_min=None):
     """
-    Create a plot with time in hours.
-    
+    Draw one figure variant from already loaded series.
+
     Args:
-        csv_paths (list): List of paths to CSV files
-        labels (list): List of labels for the legend.
-        output_file (str or None): Path to save the plot.
-        time_interval (int): Time interval in minutes between data points.
-        show_median (bool): Whether to plot median intensity (default: True)
-        start_time (float, optional): Start time in the specified time_unit
-        end_time (float, optional): End time in the specified time_unit
-        time_unit (str): Unit for start/end times ('minutes' or 'hours')
+        series (list): (DataFrame, label, color) tuples as prepared by plot_multiple_intensity
+        variant (str): Key of VARIANTS
+        output_file (str or None): Path to save the plot. If None, the plot is shown.
+        time_interval (int): Acquisition interval in minutes
+        show_median (bool): Whether to plot median intensity
+        show_sd (bool): Whether to draw SD error bars
+        start_min (float, optional): Start of the x-axis in minutes
+        end_min (float, optional): End of the x-axis in minutes
     """
+    style = VARIANTS[variant]
+    scale = style['scale']
+
     # Create figure and axis
-    plt.figure(figsize=(12, 8))
+    fig = plt.figure(figsize=style['figsize'])
+
+    # Track min/max time for x-axis
+    min_time = float('inf')
+    max_time = -float('inf')
+
+    for df, label, color in series:
+        time = df['ElapsedMinutes'] / scale
+        min_time = min(min_time, time.min())
+        max_time = max(max_time, time.max())
+
+        # Plot mean intensity with error bars
+        if show_sd:
+            plt.errorbar(
+                time,
+                df['MeanIntensity'],
+                yerr=df['StdDev'].fillna(0),
+                marker='o',
+                linestyle='-',
+                capsize=3,
+                label=f'{label} (Mean ± SD)',
+                color=color,
+                alpha=0.9,
+                markersize=5,
+                linewidth=1.2,
+                markeredgecolor='white',
+                markeredgewidth=0.5,
+                elinewidth=1
+            )
+        else:
+            plt.plot(
+                time,
+                df['MeanIntensity'],
+                marker='o',
+                linestyle='-',
+                label=f'{label} (Mean)',
+                color=color,
+                alpha=0.9,
+                markersize=5,
+                linewidth=1.2,
+                markeredgecolor='white',
+                markeredgewidth=0.5
+            )
+
+        # Plot median intensity
+        if show_median:
+            plt.plot(
+                time,
+                df['MedianIntensity'],
+                marker='s',
+                linestyle='--',
+                label=f'{label} (Median)',
+                color=color,
+                alpha=0.8,
+                markersize=4,
+                linewidth=1,
+                markeredgecolor='white',
+                markeredgewidth=0.5
+            )
 
-    # Set up colors if not provided
-    if colors is None:
-        colors = plt.cm.tab10(np.linspace(0, 1, len(csv_paths)))
-    elif len(colors) < len(csv_paths):
-        # If not enough colors provided, cycle through the given colors
-        colors = [colors[i % len(colors)] for i in range(len(csv_paths))]
-        
-    # Color cycle for multiple plots
-    # colors = plt.cm.tab10(np.linspace(0, 1, len(csv_paths)))
-    
-    # Track time range for x-axis
-    min_hours = float('inf')
-    max_hours = -float('inf')
-    
-    # Convert time range to hours if needed
-    plot_start = start_time / 60 if (start_time is not None and time_unit == 'minutes') else start_time
-    plot_end = end_time / 60 if (end_time is not None and time_unit == 'minutes') else end_time
-    
-    # Plot each dataset
-    for i, (csv_path, label, color) in enumerate(zip(csv_paths, labels, colors)):
-        try:
-            df = load_intensity_data(csv_path)
-            df['TimePoint'] = df['TimePoint'] / 60  # Convert minutes to hours
-            
-            # Filter data by time range
-            if plot_start is not None:
-                df = df[df['TimePoint'] >= plot_start]
-            if plot_end is not None:
-                df = df[df['TimePoint'] <= plot_end]
-            
-            if len(df) == 0:
-                print(f"Warning: No data in range for {csv_path}")
-                continue
-                
-            # Update time range
-            min_hours = min(min_hours, df['TimePoint'].min())
-            max_hours = max(max_hours, df['TimePoint'].max())
-            
-            # Plot mean intensity with error bars
-            if 'MeanIntensity' in df.columns:
-                if show_sd and 'StdDev' in df.columns:
-                    plt.errorbar(
-                        df['TimePoint'],
-                        df['MeanIntensity'],
-                        yerr=df['StdDev'].fillna(0),
-                        marker='o',
-                        linestyle='-',
-                        capsize=3,
-                        label=f'{label} (Mean ± SD)',
-                        color=color,
-                        alpha=0.9,
-                        markersize=5,
-                        linewidth=1.2,
-                        markeredgecolor='white',
-                        markeredgewidth=0.5,
-                        elinewidth=1
-                    )
-                else:
-                    plt.plot(
-                        df['TimePoint'],
-                        df['MeanIntensity'],
-                        marker='o',
-                        linestyle='-',
-                        label=f'{label} (Mean)',
-                        color=color,
-                        alpha=0.9,
-                        markersize=5,
-                        linewidth=1.2,
-                        markeredgecolor='white',
-                        markeredgewidth=0.5
-                    )
-                
-            # Plot median intensity
-            if show_median and 'MedianIntensity' in df.columns:
-                plt.plot(
-                    df['TimePoint'],
-                    df['MedianIntensity'],
-                    marker='s',
-                    linestyle='--',
-                    label=f'{label} (Median)',
-                    color=color,
-                    alpha=0.8,
-                    markersize=4,
-                    linewidth=1,
-                    markeredgecolor='white',
-                    markeredgewidth=0.5
-                )
-                
-        except Exception as e:
-            print(f"Error processing {csv_path}: {str(e)}")
-    
     # Set plot title and labels
     plt.title('Fluorescence Intensity Over Time', fontsize=18, fontweight='bold')
-    plt.xlabel('Time (hours)', fontsize=18)
-    plt.ylabel('Integrated Density (IntDen)', fontsize=18)
-    plt.xticks(fontsize=12)
-    plt.yticks(fontsize=12)
+    plt.xlabel(f'Time ({variant})', fontsize=style['label_size'])
+    plt.ylabel('Integrated Density (IntDen)', fontsize=style['label_size'])
+    if style['tick_size']:
+        plt.xticks(fontsize=style['tick_size'])
+        plt.yticks(fontsize=style['tick_size'])
+
     # Set x-ticks and limits
-    tick_interval = 1  # 1 hour intervals
-    
-    # Calculate x-axis limits
-    x_min = plot_start if plot_start is not None else 0
-    x_max = plot_end if plot_end is not None else (max_hours if max_hours != -float('inf') else 24)
-    
-    # Ensure we have a reasonable range
-    if x_min == x_max:
-        x_min = max(0, x_min - 1)
-        x_max += 1
-    
-    plt.xlim(left=x_min, right=x_max)
-    plt.xticks(np.arange(
-        np.floor(x_min),
-        np.ceil(x_max) + tick_interval,
-        tick_interval
-    ))
-    
+    if min_time != float('inf') and max_time != -float('inf'):
+        x_min = start_min / scale if start_min is not None else min(0, min_time)
+        x_max = end_min / scale if end_min is not None else max_time
+
+        # Ensure we have a reasonable range
+        if x_min == x_max:
+            x_min = max(0, x_min - 1)
+            x_max += 1
+
+        tick = _tick_step(x_max - x_min, style['tick'] or time_interval / scale)
+        plt.xlim(left=x_min, right=x_max)
+        plt.xticks(np.arange(np.floor(x_min / tick) * tick, x_max + tick, tick))
+
     # Add grid for better readability
     plt.grid(True, linestyle='--', alpha=0.5)
-    
+
     # Add legend inside the plot
     plt.legend(loc='upper left')
-    
+
     # Adjust layout to prevent label cutoff
     plt.tight_layout()
-    
+
     # Save or show the plot
     if output_file:
         plt.savefig(output_file, dpi=300, bbox_inches='tight')
-        print(f"Hours plot saved to {output_file}")
+        plt.close(fig)
+        print(f"Plot saved to {output_file}")
     else:
         plt.show()
 
+def render_experiment(experiment_dir, output_name='intensity_plot.png', **kwargs):
+    """
+    Render all variants for the intensity_*.csv files of one experiment directory.
+
+    Used as the unit of work in batch mode; the directory name is the experiment
+    name in the results store.
+    """
+    experiment_dir = Path(experiment_dir)
+    csv_paths = sorted(experiment_dir.glob('intensity_*.csv'))
+    if not csv_paths:
+        raise FileNotFoundError(f"No intensity_*.csv files in {experiment_dir}")
+    labels = [path.stem.replace('intensity_', '') for path in csv_paths]
+    return plot_multiple_intensity(csv_paths, labels=labels, output_file=experiment_dir / output_name,
+                                   experiment=experiment_dir.resolve().name, **kwargs)
+
+def _init_worker():
+    matplotlib.use('Agg')
+
+def render_batch(experiment_dirs, workers=None, **kwargs):
+    """
+    Render many experiments in parallel worker processes.
+
+    Args:
+        experiment_dirs (list): Directories that each contain intensity_*.csv files
+        workers (int, optional): Number of worker processes (default: one per CPU)
+        **kwargs: Passed on to plot_multiple_intensity
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(render_experiment, d, **kwargs): d for d in experiment_dirs}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error rendering {futures[future]}: {e}")
+
 if __name__ == "__main__":
-    # import argparse
-    
-    # # Set up argument parsing
-    # parser = argparse.ArgumentParser(description='Plot intensity over time from multiple CSV files')
-    # parser.add_argument('csv_files', nargs='+', help='One or more CSV files to plot')
-    # parser.add_argument('--labels', nargs='+', help='Labels for each dataset (optional)')
-    # parser.add_argument('-o', '--output', help='Path to save the output plot (optional)')
-    # parser.add_argument('--interval', type=int, default=20, 
-    #                    help='Time interval in minutes between data points (default: 20)')
-    # parser.add_argument('--no-median', action='store_false', dest='show_median',
-    #                    help='Exclude median intensity from the plot')
-    # parser.add_argument('--start', type=float, help='Start time in the specified time unit')
-    # parser.add_argument('--end', type=float, help='End time in the specified time unit')
-    # parser.add_argument('--time-unit', choices=['minutes', 'hours'], default='minutes',
-    #                    help='Time unit for --start and --end (default: minutes)')
-    
-    # args = parser.parse_args()
-    
-    # if args.labels and len(args.labels) != len(args.csv_files):
-    #     print("Error: Number of labels must match number of CSV files")
-    #     exit(1)
-    
-    # plot_multiple_intensity(
-    #     args.csv_files,
-    #     labels=args.labels,
-    #     output_file=args.output,
-    #     time_interval=args.interval,
-    #     show_median=args.show_median,
-    #     start_time=args.start,
-    #     end_time=args.end,
-    #     time_unit=args.time_unit
-    # )
-
-    # Plot data from two CSV files, save as 'intensity_plot.png'
+    if len(sys.argv) > 1:
+        # Set up argument parsing
+        parser = argparse.ArgumentParser(description='Plot intensity over time from multiple CSV files')
+        parser.add_argument('paths', nargs='+',
+                            help='CSV files to plot, or experiment directories with --batch')
+        parser.add_argument('--batch', action='store_true',
+                            help='Treat paths as experiment directories and render them in parallel')
+        parser.add_argument('--workers', type=int, help='Number of worker processes in batch mode')
+        parser.add_argument('--labels', nargs='+', help='Labels for each dataset (optional)')
+        parser.add_argument('-o', '--output', help='Path to save the output plot (optional)')
+        parser.add_argument('--interval', type=int, default=20,
+                           help='Time interval in minutes between data points (default: 20)')
+        parser.add_argument('--no-median', action='store_false', dest='show_median',
+                           help='Exclude median intensity from the plot')
+        parser.add_argument('--no-sd', action='store_false', dest='show_sd',
+                           help='Plot the mean without SD error bars')
+        parser.add_argument('--start', type=float, help='Start time in the specified time unit')
+        parser.add_argument('--end', type=float, help='End time in the specified time unit')
+        parser.add_argument('--time-unit', choices=list(VARIANTS), default='minutes',
+                           help='Time unit for --start and --end (default: minutes)')
+        parser.add_argument('--variants', nargs='+', choices=list(VARIANTS), default=list(VARIANTS),
+                           help='Figure variants to render (default: all)')
+        args = parser.parse_args()
+
+        options = dict(time_interval=args.interval, show_median=args.show_median, show_sd=args.show_sd,
+                       start_time=args.start, end_time=args.end, time_unit=args.time_unit,
+                       variants=args.variants)
+        if args.batch:
+            render_batch(args.paths, workers=args.workers, **options)
+        else:
+            if args.labels and len(args.labels) != len(args.paths):
+                print("Error: Number of labels must match number of CSV files")
+                exit(1)
+            plot_multiple_intensity(args.paths, labels=args.labels, output_file=args.output, **options)
+        sys.exit(0)
+
+    # Plot data from two CSV files, save as 'intensity_plot.png' and 'intensity_plot_hours.png'
     colors = ['blue', 'orange']
     plot_multiple_intensity(
         csv_paths=['intensity_30um.csv', 'intensity_25um.csv'],
         labels=['30 um', '25 um'],
         output_file='intensity_plot.png',
-        time_interval=20,  # 20 minutes between points
+        time_interval=20,  # 20 minutes between acquisitions
         show_median=False,
         show_sd=True,
         start_time=0,      # Start at 0 minutes
-        end_time=420,     # End at 24 hours (1440 minutes)
+        end_time=None,     # Full run, time axis from the recorded timestamps
         time_unit='minutes',
         colors=colors
     )
@@ -0,0 +1,220 @@
+"""
+Speed and accuracy benchmark for the droplet sizing pipeline.
+
+Synthetic frames from synthetic_droplets.py are run through the segmentation and
+measurement stages of droplet_segmentation.py (the Python port of Macro_ROI.ijm).
+For every scenario the benchmark reports, per stage, images per second and peak
+memory, and against the ground truth: detection recall/precision, the bias and
+mean absolute error of the measured Feret diameter and the error of the CV.
+
+Each scenario images --frames FOVs at --timepoints timepoints; the droplets of a FOV
+stay in place between timepoints, as in the imaging chamber. With --flatfield the
+per-image FFT bandpass is replaced by a flat-field correction (flatfield.py) built
+from one frame per FOV ('fovs'), from blank reference frames ('blank'), or from the
+timepoints of a single FOV ('timepoints', which bakes the static droplets into the
+flat field). The flat field is compared with the true illumination, and the run fails
+when its RMS error exceeds --max-flat-error.
+
+Usage:
+    python benchmark_pipeline.py --frames 5 --diameters 25 30 --noise 0.02 0.05
+    python benchmark_pipeline.py --frames 20 --output benchmark.csv
+    python benchmark_pipeline.py --frames 10 --flatfield
+    python benchmark_pipeline.py --frames 10 --flatfield blank
+"""
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from droplet_segmentation import segment, measure_droplets, PIXEL_SIZE_UM
+from flatfield import build_correction, correction_maps, apply_correction, expand
+from synthetic_droplets import generate_frame, SENSOR_SHAPE
+
+
+def match_droplets(measured, truth):
+    """
+    Match measured droplets to ground truth by nearest centroid.
+
+    A pair matches when the centroids are closer than a quarter of the true diameter.
+
+    Returns:
+        tuple: (truth indices, measured indices) of the matched pairs
+    """
+    if measured.empty or truth.empty:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    d = np.hypot(truth['X'].to_numpy()[:, None] - measured['X'].to_numpy()[None, :],
+                 truth['Y'].to_numpy()[:, None] - measured['Y'].to_numpy()[None, :])
+    nearest = d.argmin(axis=1)
+    ok = d[np.arange(len(truth)), nearest] < truth['Diameter'].to_numpy() / 4
+    return np.flatnonzero(ok), nearest[ok]
+
+
+def _peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+FLATFIELD_SOURCES = ('fovs', 'blank', 'timepoints')
+
+
+def flat_error(correction, shape, frame_kwargs):
+    """
+    RMS and maximum relative error (%) of a flat field against the true illumination.
+
+    The true illumination is rendered as a blank, noise-free frame.
+    """
+    blank = generate_frame(shape=shape, **{**frame_kwargs, 'fill': 0.0, 'noise': 0.0})[0].astype(np.float32)
+    error = expand(correction['flat'], shape) / (blank / blank.mean()) - 1
+    return float(np.sqrt(np.mean(error ** 2)) * 100), float(np.abs(error).max() * 100)
+
+
+def run_scenario(n_frames=5, shape=SENSOR_SHAPE, seed=0, segment_kwargs=None, flatfield=None, timepoints=2,
+                 **frame_kwargs):
+    """
+    Benchmark one scenario (one set of generator parameters).
+
+    Args:
+        n_frames (int): Number of FOVs, each at a different (random) lattice position
+        shape (tuple): Frame size (rows, columns)
+        seed (int): Seed of the first FOV
+        segment_kwargs (dict, optional): Extra arguments for segment()
+        flatfield (str, optional): Correct the frames with a flat field built from one
+            frame per FOV ('fovs'), from blank frames ('blank') or from the timepoints
+            of the first FOV ('timepoints'), and segment without the bandpass
+        timepoints (int): Frames per FOV; the droplets stay in place, only the noise changes
+        **frame_kwargs: Generator parameters (diameter_um, cv, noise, gradient, ...)
+
+    Returns:
+        dict: Throughput, memory and accuracy figures
+    """
+    segment_kwargs = segment_kwargs or {}
+    frames = [generate_frame(shape=shape, seed=seed + fov, noise_seed=(seed + fov, t), shift=True, **frame_kwargs)
+              for fov in range(n_frames) for t in range(timepoints)]
+
+    build_time = 0.0
+    flat_rms = flat_max = np.nan
+    if flatfield:
+        if flatfield == 'fovs':
+            references = (frames[fov * timepoints][0] for fov in range(n_frames))
+        elif flatfield == 'blank':
+            references = (generate_frame(shape=shape, seed=seed + n_frames + i, **{**frame_kwargs, 'fill': 0.0})[0]
+                          for i in range(n_frames))
+        elif flatfield == 'timepoints':
+            references = (bf for bf, _, _ in frames[:timepoints])
+        else:
+            raise ValueError(f'Unknown flat-field source {flatfield!r}, expected one of {FLATFIELD_SOURCES}')
+        start = time.perf_counter()
+        correction = build_correction(references)
+        maps = correction_maps(correction)
+        build_time = time.perf_counter() - start
+        flat_rms, flat_max = flat_error(correction, shape, frame_kwargs)
+        corrected = np.empty(shape, dtype=np.float32)
+        segment_frame = lambda bf: segment(apply_correction(bf, maps, corrected), flatfield=True, **segment_kwargs)
+    else:
+        segment_frame = lambda bf: segment(bf, **segment_kwargs)
+
+    seg_time = meas_time = 0.0
+    measured_all, truth_all = [], []
+    n_truth = n_found = n_matched = 0
+    for bf, _, truth in frames:
+        start = time.perf_counter()
+        mask = segment_frame(bf)
+        seg_time += time.perf_counter() - start
+        start = time.perf_counter()
+        measured = measure_droplets(mask)
+        meas_time += time.perf_counter() - start
+
+        # Only droplets fully inside the frame can be measured (edge exclusion)
+        r = truth['Diameter'] / 2
+        inside = ((truth['X'] - r > 0) & (truth['Y'] - r > 0) &
+                  (truth['X'] + r < shape[1] * PIXEL_SIZE_UM) & (truth['Y'] + r < shape[0] * PIXEL_SIZE_UM))
+        truth = truth[inside].reset_index(drop=True)
+        ti, mi = match_droplets(measured, truth)
+        n_truth += len(truth)
+        n_found += len(measured)
+        n_matched += len(ti)
+        truth_all.append(truth.iloc[ti]['Diameter'].to_numpy())
+        measured_all.append(measured.iloc[mi]['Feret'].to_numpy())
+
+    _, seg_peak = _peak_memory(segment_frame, frames[0][0])
+    _, meas_peak = _peak_memory(measure_droplets, segment_frame(frames[0][0]))
+
+    true_d = np.concatenate(truth_all)
+    meas_d = np.concatenate(measured_all)
+    rel = (meas_d - true_d) / true_d * 100 if true_d.size else np.array([np.nan])
+    cv = lambda x: np.std(x, ddof=1) / np.mean(x) * 100 if x.size > 1 else np.nan
+
+    n_images = len(frames)
+    return {
+        'frames': n_images,
+        'segment_img_per_s': n_images / seg_time,
+        'measure_img_per_s': n_images / meas_time,
+        'total_img_per_s': n_images / (seg_time + meas_time),
+        'correction_build_s': build_time,
+        'flat_error_rms_pct': flat_rms,
+        'flat_error_max_pct': flat_max,
+        'segment_peak_mb': seg_peak / 2 ** 20,
+        'measure_peak_mb': meas_peak / 2 ** 20,
+        'recall': n_matched / n_truth if n_truth else np.nan,
+        'precision': n_matched / n_found if n_found else np.nan,
+        'diameter_bias_pct': float(np.mean(rel)),
+        'diameter_mae_pct': float(np.mean(np.abs(rel))),
+        'true_cv_pct': cv(true_d),
+        'measured_cv_pct': cv(meas_d),
+        'cv_error_pct': cv(meas_d) - cv(true_d),
+    }
+
+
+def run_benchmark(diameters=(25.0, 30.0), noise_levels=(0.02,), cv=0.03, gradient=0.2, n_frames=5,
+                  shape=SENSOR_SHAPE, segment_kwargs=None, flatfield=None, timepoints=2):
+    """Run every combination of diameter and noise level and return one row per scenario."""
+    rows = []
+    for diameter in diameters:
+        for noise in noise_levels:
+            result = run_scenario(n_frames, shape, diameter_um=diameter, cv=cv, noise=noise, gradient=gradient,
+                                  segment_kwargs=segment_kwargs, flatfield=flatfield, timepoints=timepoints)
+            rows.append({'diameter_um': diameter, 'noise': noise, 'gradient': gradient, **result})
+            flat = f", flat field {result['flat_error_rms_pct']:.2f}% RMS" if flatfield else ''
+            print(f"{diameter:5.1f} µm, noise {noise:.3f}: "
+                  f"{result['total_img_per_s']:.2f} img/s, recall {result['recall']:.1%}, "
+                  f"bias {result['diameter_bias_pct']:+.2f}%, CV error {result['cv_error_pct']:+.2f} pts{flat}")
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark droplet segmentation speed and accuracy')
+    parser.add_argument('--frames', type=int, default=5, help='FOVs per scenario (default: 5)')
+    parser.add_argument('--timepoints', type=int, default=2, help='Frames per FOV (default: 2)')
+    parser.add_argument('--diameters', type=float, nargs='+', default=[25.0, 30.0], help='Droplet diameters in µm')
+    parser.add_argument('--noise', type=float, nargs='+', default=[0.02], help='Noise levels (fraction of full scale)')
+    parser.add_argument('--cv', type=float, default=3.0, help='Polydispersity CV in percent')
+    parser.add_argument('--gradient', type=float, default=0.2, help='Left-to-right illumination change')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Frame size relative to the full sensor, for quick runs')
+    parser.add_argument('--flatfield', nargs='?', const='fovs', choices=FLATFIELD_SOURCES,
+                        help='Replace the per-image bandpass with a flat-field correction built from '
+                             'one frame per FOV (default), blank frames or the timepoints of one FOV')
+    parser.add_argument('--max-flat-error', type=float, default=2.0,
+                        help='Fail when the RMS flat-field error exceeds this, in percent (default: 2)')
+    parser.add_argument('-o', '--output', help='Path to save the results table (CSV)')
+    args = parser.parse_args()
+
+    shape = tuple(int(s * args.scale) for s in SENSOR_SHAPE)
+    results = run_benchmark(args.diameters, args.noise, args.cv / 100, args.gradient, args.frames, shape,
+                            flatfield=args.flatfield, timepoints=args.timepoints)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(results)
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"Results saved to {args.output}")
+    if args.flatfield and (results['flat_error_rms_pct'] > args.max_flat_error).any():
+        sys.exit(f"Flat field off by up to {results['flat_error_rms_pct'].max():.2f}% RMS "
+                 f"(limit {args.max_flat_error}%)")
@@ -0,0 +1,151 @@
+"""
+Python port of the droplet segmentation and measurement steps of Macro_ROI.ijm.
+
+The stages mirror the macro so they can be timed and checked separately:
+
+    to_8bit -> bandpass (filter_large=40, filter_small=3, autoscale)
+            -> Otsu threshold (dark background) -> erode -> fill holes   = segment()
+    label -> size/circularity filter, edge exclusion -> Feret etc.      = measure_droplets()
+
+Measurements use the ImageJ column names (Area, Perim., Circ., Feret, MinFeret, ...)
+in calibrated units, so the output can be written to the results store as-is.
+"""
+import numpy as np
+import pandas as pd
+from scipy import ndimage as ndi
+
+# Scale of the Temika epi setup: 1 px = 0.112 µm (see scale_epi_temika.jpg)
+PIXEL_SIZE_UM = 0.112
+
+# Macro_ROI.ijm defaults
+FILTER_LARGE = 40
+FILTER_SMALL = 3
+MIN_AREA_UM2 = 350
+CIRCULARITY = (0.30, 1.00)
+
+# Directions used for the caliper (Feret) diameters
+_ANGLES = np.deg2rad(np.arange(0, 180, 2))
+_DIRECTIONS = np.stack([np.cos(_ANGLES), np.sin(_ANGLES)])
+
+
+def to_8bit(img):
+    """Scale an image linearly to 0..255 uint8 (ImageJ 8-bit conversion with ScaleConversions)."""
+    img = np.asarray(img, dtype=np.float32)
+    lo, hi = float(img.min()), float(img.max())
+    if hi <= lo:
+        return np.zeros(img.shape, dtype=np.uint8)
+    return ((img - lo) * (255.0 / (hi - lo))).astype(np.uint8)
+
+
+def bandpass(img, filter_large=FILTER_LARGE, filter_small=FILTER_SMALL):
+    """
+    FFT bandpass filter keeping structures between filter_small and filter_large pixels.
+
+    Gaussian high-pass and low-pass in the frequency domain, as ImageJ's
+    "Bandpass Filter..." with autoscale; the result is rescaled to 0..255.
+    """
+    img = np.asarray(img, dtype=np.float32)
+    fy = np.fft.fftfreq(img.shape[0]).astype(np.float32)[:, None]
+    fx = np.fft.rfftfreq(img.shape[1]).astype(np.float32)[None, :]
+    f2 = fy ** 2 + fx ** 2
+    # A structure of size s pixels has its energy around frequency 1/s
+    low_pass = np.exp(-f2 * (filter_small / 2) ** 2 * 2 * np.pi ** 2 / 4)
+    high_pass = 1 - np.exp(-f2 * (filter_large / 2) ** 2 * 2 * np.pi ** 2 / 4)
+    filtered = np.fft.irfft2(np.fft.rfft2(img) * (low_pass * high_pass), s=img.shape)
+    return to_8bit(filtered)
+
+
+def otsu_threshold(img):
+    """Otsu threshold of an 8-bit image."""
+    hist = np.bincount(np.asarray(img, dtype=np.uint8).ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    w0 = np.cumsum(hist)
+    w1 = w0[-1] - w0
+    m0 = np.cumsum(hist * levels)
+    mean0 = m0 / np.maximum(w0, 1)
+    mean1 = (m0[-1] - m0) / np.maximum(w1, 1)
+    between = w0 * w1 * (mean0 - mean1) ** 2
+    return int(np.argmax(between))
+
+
+def segment(img, filter_large=FILTER_LARGE, filter_small=FILTER_SMALL, flatfield=False):
+    """
+    Binary droplet mask of a bright-field frame, following Macro_ROI.ijm.
+
+    Args:
+        img (np.ndarray): Raw or 8-bit frame
+        filter_large (int): Bandpass upper structure size in pixels
+        filter_small (int): Bandpass lower structure size in pixels
+        flatfield (bool): Set when img is already illumination-corrected; the
+            bandpass step is then skipped
+
+    Returns:
+        np.ndarray: Boolean mask
+    """
+    img8 = to_8bit(img)
+    filtered = img8 if flatfield else bandpass(img8, filter_large, filter_small)
+    mask = filtered > otsu_threshold(filtered)
+    mask = ndi.binary_erosion(mask, structure=np.ones((3, 3), dtype=bool))
+    return ndi.binary_fill_holes(mask)
+
+
+def _feret(rows, cols):
+    """Max/min caliper diameters (pixels) and max-caliper angle (degrees) of a pixel set."""
+    projections = np.stack([cols, rows], axis=1).astype(np.float32) @ _DIRECTIONS
+    widths = projections.max(axis=0) - projections.min(axis=0) + 1
+    k = int(np.argmax(widths))
+    return float(widths[k]), float(widths.min()), float(np.rad2deg(_ANGLES[k]))
+
+
+def measure_droplets(mask, pixel_size=PIXEL_SIZE_UM, min_area=MIN_AREA_UM2, circularity=CIRCULARITY,
+                     exclude_edges=True):
+    """
+    Measure droplets in a mask like "Analyze Particles..." with exclude, size and circularity.
+
+    Args:
+        mask (np.ndarray): Boolean droplet mask
+        pixel_size (float): µm per pixel
+        min_area (float): Minimum area in µm²
+        circularity (tuple): Accepted (min, max) circularity
+        exclude_edges (bool): Drop particles touching the image border
+
+    Returns:
+        pd.DataFrame: Area, Perim., Circ., Feret, FeretAngle, MinFeret, AR, Round, X, Y
+            in µm (X, Y are centroids)
+    """
+    labels, n = ndi.label(mask)
+    columns = ['Area', 'Perim.', 'Circ.', 'Feret', 'FeretAngle', 'MinFeret', 'AR', 'Round', 'X', 'Y']
+    if n == 0:
+        return pd.DataFrame(columns=columns)
+
+    index = np.arange(1, n + 1)
+    area_px = ndi.sum_labels(np.ones_like(labels), labels, index)
+    # Perimeter from exposed pixel edges, corrected for the staircase of digital boundaries
+    exposed = np.zeros(labels.shape, dtype=np.int32)
+    fg = labels > 0
+    padded = np.pad(fg, 1)
+    for shifted in (padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:]):
+        exposed += fg & ~shifted
+    perim_px = ndi.sum_labels(exposed, labels, index) * (np.pi / 4)
+    cy, cx = np.array(ndi.center_of_mass(fg, labels, index)).T
+
+    rows = []
+    for i, sl in enumerate(ndi.find_objects(labels)):
+        if exclude_edges and (sl[0].start == 0 or sl[1].start == 0 or
+                              sl[0].stop == labels.shape[0] or sl[1].stop == labels.shape[1]):
+            continue
+        area = area_px[i] * pixel_size ** 2
+        if area < min_area:
+            continue
+        circ = min(4 * np.pi * area_px[i] / perim_px[i] ** 2, 1.0)
+        if not circularity[0] <= circ <= circularity[1]:
+            continue
+        rr, cc = np.nonzero(labels[sl] == i + 1)
+        feret, min_feret, angle = _feret(rr, cc)
+        # Axes of the equivalent ellipse for AR/Round, as ImageJ's shape descriptors
+        cov = np.cov(np.stack([rr, cc])) if rr.size > 1 else np.eye(2)
+        evals = np.sort(np.linalg.eigvalsh(cov))
+        ar = float(np.sqrt(evals[1] / evals[0])) if evals[0] > 0 else float('inf')
+        rows.append((area, perim_px[i] * pixel_size, circ, feret * pixel_size, angle,
+                     min_feret * pixel_size, ar, 1 / ar, cx[i] * pixel_size, cy[i] * pixel_size))
+    return pd.DataFrame(rows, columns=columns)
@@ -0,0 +1,285 @@
+"""
+Flat-field and dark-frame correction with an on-disk cache per run, FOV and channel.
+
+Macro_ROI.ijm evens out the illumination with an FFT bandpass on every image, and
+Macro_YF_analysis.ijm subtracts a constant background (bg_subtract_value = 15), so
+uneven epi illumination still biases IntDen between FOVs. Here the illumination is
+estimated once per run instead:
+
+- flat: streaming median of reference frames (remedian, Rousseeuw & Bassett 1990),
+  computed on block-averaged frames and smoothed, since illumination only varies on
+  large scales; normalised to a mean of 1. The reference frames must not share any
+  structure: blank or out-of-focus frames, or one frame from each of many different
+  FOVs. Droplets in the imaging chamber do not move between timepoints, so a median
+  over the timepoints of one FOV contains the droplets and would divide them out.
+- dark: streaming median of dark frames (full resolution, keeps hot pixels), or a
+  constant camera offset
+- level (optional, for fluorescence): the background left after flat-fielding, which
+  replaces bg_subtract_value
+
+Every frame is then corrected as (raw - dark) / flat - level, applied as a single
+multiply-add with precomputed gain and offset maps. Corrected bright-field frames are
+segmented without the bandpass: segment(img, flatfield=True).
+
+The correction is stored per run and channel, or per FOV when reference frames were
+taken for each FOV.
+
+Usage:
+    python flatfield.py build run_28aug --channel BF "bf-blank/*.tif"
+    python flatfield.py build run_28aug --channel YF "yf-equatorial/fov*_t000.tif" --background
+    python flatfield.py apply run_28aug --channel YF "yf-equatorial/*.tif" -o yf-corrected/
+"""
+import glob
+import argparse
+from pathlib import Path
+
+import numpy as np
+from scipy import ndimage as ndi
+
+DEFAULT_ROOT = Path(__file__).resolve().parent.parent / 'results-store' / 'corrections'
+
+# Block size of the frames the flat field is estimated on, and smoothing in blocks
+# (16 blocks = 128 px, above the droplet-scale leftovers of a median across FOVs)
+BLOCK = 8
+SIGMA = 16.0
+
+
+class Remedian:
+    """
+    Streaming approximate median of a sequence of equally shaped arrays.
+
+    Frames are collected in groups of `base`; each full group is replaced by its
+    per-pixel median one level up. Memory is `base` frames per level, i.e. grows with
+    the logarithm of the number of frames.
+    """
+
+    def __init__(self, base=9):
+        self.base = base
+        self.levels = []
+        self.count = 0
+
+    def update(self, frame):
+        frame = np.asarray(frame, dtype=np.float32)
+        level = 0
+        while True:
+            if level == len(self.levels):
+                self.levels.append([])
+            self.levels[level].append(frame)
+            if len(self.levels[level]) < self.base:
+                break
+            frame = np.median(np.stack(self.levels[level]), axis=0)
+            self.levels[level] = []
+            level += 1
+        self.count += 1
+
+    def result(self):
+        """Weighted median of what is left in the buffers (weight base**level)."""
+        items = [(frame, self.base ** level) for level, frames in enumerate(self.levels) for frame in frames]
+        if not items:
+            raise ValueError('No frames')
+        stack = np.stack([frame for frame, _ in items])
+        weights = np.array([w for _, w in items], dtype=np.float64)
+        if len(items) == 1:
+            return stack[0]
+        order = np.argsort(stack, axis=0)
+        cumulative = np.cumsum(weights[order], axis=0)
+        median_rank = (cumulative >= weights.sum() / 2).argmax(axis=0)
+        return np.take_along_axis(stack, np.take_along_axis(order, median_rank[None], axis=0), axis=0)[0]
+
+
+def block_mean(img, block=BLOCK):
+    """Average over block x block tiles (the edge is padded by reflection)."""
+    img = np.asarray(img, dtype=np.float32)
+    pad = [(0, -s % block) for s in img.shape]
+    img = np.pad(img, pad, mode='reflect') if any(p for _, p in pad) else img
+    h, w = img.shape[0] // block, img.shape[1] // block
+    return img.reshape(h, block, w, block).mean(axis=(1, 3))
+
+
+def expand(small, shape):
+    """Bilinear upsampling of a block-averaged map back to the frame shape."""
+    zoom = (shape[0] / small.shape[0], shape[1] / small.shape[1])
+    return ndi.zoom(small, zoom, order=1, mode='nearest', grid_mode=True)[:shape[0], :shape[1]].astype(np.float32)
+
+
+def build_correction(frames, dark_frames=None, dark_level=0.0, background=False, block=BLOCK, sigma=SIGMA):
+    """
+    Estimate the flat field (and dark frame) of one channel.
+
+    Args:
+        frames (iterable): Reference frames, read one at a time: blank or out-of-focus
+            frames, or one frame per FOV from many different FOVs (not the timepoints
+            of one FOV, whose static droplets would end up in the flat field)
+        dark_frames (iterable, optional): Frames taken with the illumination off
+        dark_level (float): Constant dark offset when there are no dark frames
+        background (bool): Also estimate the background level to subtract (fluorescence)
+        block (int): Block size the flat field is estimated at
+        sigma (float): Smoothing of the flat field, in blocks
+
+    Returns:
+        dict: flat (block-averaged, mean 1), dark (array or scalar), level, shape,
+            block and n_frames; ready for correction_maps()
+    """
+    remedian = Remedian()
+    shape = None
+    for frame in frames:
+        shape = np.shape(frame)
+        remedian.update(block_mean(frame, block))
+    if shape is None:
+        raise ValueError('No frames to build the correction from')
+
+    dark = float(dark_level)
+    if dark_frames is not None:
+        dark_remedian = Remedian()
+        for frame in dark_frames:
+            dark_remedian.update(frame)
+        dark = dark_remedian.result()
+
+    dark_small = block_mean(dark, block) if np.ndim(dark) else dark
+    signal = ndi.gaussian_filter(remedian.result() - dark_small, sigma, mode='nearest')
+    signal = np.maximum(signal, 1e-3 * max(float(signal.max()), 1e-6))
+    mean = float(signal.mean())
+    return {
+        'flat': (signal / mean).astype(np.float32),
+        'dark': dark,
+        # After flat-fielding the background is uniform at about the mean signal
+        'level': mean if background else 0.0,
+        'shape': tuple(shape),
+        'block': block,
+        'n_frames': remedian.count,
+    }
+
+
+def correction_maps(correction):
+    """Full-resolution gain and offset so that corrected = raw * gain + offset."""
+    gain = 1.0 / expand(correction['flat'], correction['shape'])
+    offset = -np.asarray(correction['dark'], dtype=np.float32) * gain - np.float32(correction['level'])
+    return {'gain': gain, 'offset': np.broadcast_to(offset, gain.shape).astype(np.float32)}
+
+
+def apply_correction(img, maps, out=None):
+    """
+    Correct one frame with maps from correction_maps().
+
+    Args:
+        img (np.ndarray): Raw frame
+        maps (dict): gain and offset maps
+        out (np.ndarray, optional): float32 array to write into (avoids an allocation per frame)
+
+    Returns:
+        np.ndarray: Corrected float32 frame
+    """
+    out = np.multiply(img, maps['gain'], out=out, dtype=np.float32)
+    out += maps['offset']
+    return out
+
+
+class CorrectionCache:
+    """
+    Corrections stored as .npz files under root/<run>/<channel>.npz (whole run, fov=None)
+    or root/<run>/fov_<fov>/<channel>.npz.
+
+    Only the block-averaged flat field (and the dark frame, if measured) is stored;
+    the full-resolution maps are rebuilt on load and kept in memory.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = Path(root)
+        self._maps = {}
+
+    def path(self, run, fov, channel):
+        run_dir = self.root / str(run)
+        return run_dir / f'{channel}.npz' if fov is None else run_dir / f'fov_{fov}' / f'{channel}.npz'
+
+    def has(self, run, fov, channel):
+        return self.path(run, fov, channel).exists()
+
+    def save(self, run, fov, channel, correction):
+        path = self.path(run, fov, channel)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, flat=correction['flat'], dark=np.asarray(correction['dark'], dtype=np.float32),
+                            level=correction['level'], shape=correction['shape'], block=correction['block'],
+                            n_frames=correction['n_frames'])
+        self._maps.pop((str(run), fov, channel), None)
+        return path
+
+    def load(self, run, fov, channel):
+        with np.load(self.path(run, fov, channel)) as data:
+            dark = data['dark']
+            return {'flat': data['flat'], 'dark': dark if dark.ndim else float(dark), 'level': float(data['level']),
+                    'shape': tuple(int(s) for s in data['shape']), 'block': int(data['block']),
+                    'n_frames': int(data['n_frames'])}
+
+    def maps(self, run, fov, channel, frames=None, **build_kwargs):
+        """
+        Gain/offset maps of a channel, building and caching them on first use.
+
+        A FOV without its own correction uses the correction of the whole run.
+
+        Args:
+            fov (int or None): FOV index, or None for the whole run
+            frames (callable, optional): Returns an iterable of the frames to build from
+                (only called when the correction is not cached yet)
+            **build_kwargs: Passed to build_correction()
+        """
+        if fov is not None and not self.has(run, fov, channel) and self.has(run, None, channel):
+            fov = None
+        key = (str(run), fov, channel)
+        if key not in self._maps:
+            if not self.has(run, fov, channel):
+                if frames is None:
+                    raise FileNotFoundError(f'No cached correction for {key} and no frames to build it')
+                self.save(run, fov, channel, build_correction(frames(), **build_kwargs))
+            self._maps[key] = correction_maps(self.load(run, fov, channel))
+        return self._maps[key]
+
+
+def read_frames(paths):
+    """Read image files one at a time."""
+    from PIL import Image
+
+    for path in paths:
+        with Image.open(path) as img:
+            yield np.asarray(img)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build or apply flat-field/dark-frame corrections')
+    parser.add_argument('command', choices=['build', 'apply'])
+    parser.add_argument('run', help='Run (experiment) name')
+    parser.add_argument('pattern', help='Glob of the frames: reference frames (build) or frames to correct (apply)')
+    parser.add_argument('--fov', type=int, help='FOV index, for a per-FOV correction (default: whole run)')
+    parser.add_argument('--channel', default='BF', help='Channel name (default: BF)')
+    parser.add_argument('--dark', help='Glob of dark frames')
+    parser.add_argument('--dark-level', type=float, default=0.0, help='Constant dark offset without dark frames')
+    parser.add_argument('--background', action='store_true', help='Also subtract the background level (fluorescence)')
+    parser.add_argument('--root', default=str(DEFAULT_ROOT), help='Cache directory')
+    parser.add_argument('-o', '--output', help='Directory for corrected 32-bit TIFFs (apply)')
+    args = parser.parse_args()
+
+    cache = CorrectionCache(args.root)
+    paths = sorted(glob.glob(args.pattern))
+    if not paths:
+        parser.error(f'No files match {args.pattern}')
+    build_kwargs = {'dark_level': args.dark_level, 'background': args.background}
+    if args.dark:
+        build_kwargs['dark_frames'] = read_frames(sorted(glob.glob(args.dark)))
+
+    if args.command == 'build':
+        path = cache.save(args.run, args.fov, args.channel, build_correction(read_frames(paths), **build_kwargs))
+        correction = cache.load(args.run, args.fov, args.channel)
+        print(f"Built from {correction['n_frames']} frames: flat {correction['flat'].min():.3f}.."
+              f"{correction['flat'].max():.3f}, level {correction['level']:.1f} -> {path}")
+    else:
+        from PIL import Image
+
+        if not args.output:
+            parser.error('apply needs -o/--output')
+        out_dir = Path(args.output)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        maps = cache.maps(args.run, args.fov, args.channel, lambda: read_frames(paths), **build_kwargs)
+        out = None
+        for path, frame in zip(paths, read_frames(paths)):
+            out = apply_correction(frame, maps, out)
+            Image.fromarray(out).save(out_dir / Path(path).with_suffix('.tif').name)
+        print(f"Corrected {len(paths)} frames -> {out_dir}")
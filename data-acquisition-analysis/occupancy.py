@@ -0,0 +1,471 @@
+"""
+Encapsulation occupancy statistics over the droplet and fluorescence tables.
+
+The per-droplet size measurements (Results_*.csv schema, Macro_ROI.ijm) are joined
+with the per-droplet YF measurements (Macro_YF_analysis.ijm) on experiment,
+condition, FOV, timepoint and DropletID. Occupancy comes from these per-droplet
+measurements only: the Count column of intensity_*.csv is the number of droplets
+measured per image, not how many of them hold cells.
+
+Every droplet gets the probability of being empty, single or multiple occupancy from
+a Poisson mixture of its background-subtracted integrated YF intensity, fitted by EM:
+
+- background of the YF Mean per image and its noise per experiment and condition,
+  from the low quantiles of the droplet means of each image, so at least ~15% of
+  droplets must be empty (lambda below ~1.9); the noise of the integrated intensity
+  scales with the droplet area
+- n cells add n cell units with a spread growing as sqrt(n); the cell unit is either
+  given (cell_unit) or fitted per experiment and condition (pooled over timepoints),
+  starting from droplets `k` noise widths above background, and never fainter than
+  `k` noise widths
+
+A fixed threshold on the Mean misses dim single cells in large droplets and biases
+lambda low; the mixture weighs every droplet by how likely each class is instead.
+The Poisson loading lambda is then fitted per run, condition and timepoint by maximum
+likelihood on the expected (empty, single, multiple) counts, and aggregated across
+runs with percentile bootstrap CIs: runs are resampled when there are several
+(cluster bootstrap), droplets otherwise (multinomial draws with the class
+probabilities, so the classification uncertainty is included). All groups and
+bootstrap replicates are fitted together as NumPy arrays.
+
+Usage:
+    python occupancy.py --experiment single_bac -o occupancy.csv
+    python occupancy.py --benchmark 2000000
+"""
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+KEYS = ['experiment', 'condition', 'fov', 'timepoint', 'DropletID']
+CLASSES = ['Empty', 'Single', 'Multiple']
+PROBABILITIES = ['PEmpty', 'PSingle', 'PMultiple']
+
+# Mixture components: 0..MAX_CELLS cells, the last one holding the Poisson tail
+MAX_CELLS = 6
+# Droplets above background needed to fit the cell unit of an experiment and condition
+MIN_OCCUPIED = 20
+
+
+# ─────────────────────────────────────────────
+# Poisson loading
+# ─────────────────────────────────────────────
+def fit_lambda(empty, single, multiple, iterations=60):
+    """
+    Maximum-likelihood Poisson lambda from counts of droplets with 0, 1 and >=2 cells.
+
+    Works element-wise on arrays of any shape (groups, bootstrap replicates), by
+    bisection on the score in log(lambda), which is monotone for these counts.
+
+    Returns:
+        np.ndarray: lambda (0 when all droplets are empty, capped at 50)
+    """
+    a, b, c = (np.asarray(x, dtype=np.float64) for x in (empty, single, multiple))
+    low = np.full(np.broadcast(a, b, c).shape, np.log(1e-6))
+    high = np.full_like(low, np.log(50.0))
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        lam = np.exp(mid)
+        # P(n >= 2) = 1 - e^-lam (1 + lam), written to stay accurate for small lam
+        tail = -np.expm1(-lam) - lam * np.exp(-lam)
+        score = -(a + b) + b / lam + c * lam * np.exp(-lam) / np.maximum(tail, 1e-300)
+        positive = score > 0
+        low = np.where(positive, mid, low)
+        high = np.where(positive, high, mid)
+    lam = np.exp((low + high) / 2)
+    return np.where(b + c == 0, 0.0, lam)
+
+
+def _summaries(counts):
+    """lambda and single-cell efficiency of (..., 3) count arrays."""
+    empty, single, multiple = np.moveaxis(counts, -1, 0)
+    occupied = single + multiple
+    with np.errstate(invalid='ignore', divide='ignore'):
+        efficiency = np.where(occupied > 0, single / occupied, np.nan)
+    return fit_lambda(empty, single, multiple), efficiency
+
+
+def bootstrap(counts, run_counts=None, n_boot=1000, ci=0.95, seed=0):
+    """
+    Percentile CIs of lambda and single-cell efficiency for many groups at once.
+
+    Droplets are resampled with the (expected) class fractions of their group, which is
+    the same as drawing each resampled droplet's class from its class probabilities.
+
+    Args:
+        counts (np.ndarray): (groups, 3) pooled expected (empty, single, multiple) counts
+        run_counts (list, optional): Per group, an (runs, 3) array of the counts of each
+            run; groups with two or more runs are bootstrapped over runs
+        n_boot (int): Bootstrap replicates
+        ci (float): Confidence level
+        seed (int): Random seed
+
+    Returns:
+        dict: LambdaLow/High and EfficiencyLow/High arrays, one value per group
+    """
+    rng = np.random.default_rng(seed)
+    counts = np.asarray(counts, dtype=np.float64)
+    n = np.rint(counts.sum(axis=1)).astype(np.int64)
+    p = counts / np.maximum(counts.sum(axis=1), 1e-12)[:, None]
+    samples = rng.multinomial(n, p, size=(n_boot, len(counts))).astype(np.float64)
+
+    if run_counts is not None:
+        n_runs = np.array([len(r) for r in run_counts])
+        clustered = np.flatnonzero(n_runs >= 2)
+        if clustered.size:
+            # Resample whole runs: (groups, max runs, 3) padded with zeros
+            padded = np.zeros((clustered.size, n_runs.max(), 3))
+            for i, g in enumerate(clustered):
+                padded[i, :n_runs[g]] = run_counts[g]
+            r = n_runs[clustered]
+            draws = (rng.random((n_boot, clustered.size, padded.shape[1])) * r[None, :, None]).astype(np.int64)
+            draws = np.where(np.arange(padded.shape[1])[None, None, :] < r[None, :, None], draws, padded.shape[1])
+            padded = np.concatenate([padded, np.zeros((clustered.size, 1, 3))], axis=1)  # index for unused draws
+            resampled = padded[np.arange(clustered.size)[None, :, None], draws].sum(axis=2)
+            samples[:, clustered] = resampled
+
+    lam, efficiency = _summaries(samples)
+    alpha = (1 - ci) / 2
+    lam_q = np.quantile(lam, [alpha, 1 - alpha], axis=0)
+    # Efficiency is undefined (NaN) in replicates without occupied droplets
+    eff_q = np.full((2, efficiency.shape[1]), np.nan)
+    some = np.isfinite(efficiency).any(axis=0)
+    eff_q[:, some] = np.nanquantile(efficiency[:, some], [alpha, 1 - alpha], axis=0)
+    return {'LambdaLow': lam_q[0], 'LambdaHigh': lam_q[1], 'EfficiencyLow': eff_q[0], 'EfficiencyHigh': eff_q[1]}
+
+
+# ─────────────────────────────────────────────
+# Classification
+# ─────────────────────────────────────────────
+def join_tables(droplets, fluorescence):
+    """Per-droplet size and YF measurements side by side (YF columns prefixed with YF)."""
+    yf = fluorescence[KEYS + ['Mean', 'Area']].rename(columns={'Mean': 'YFMean', 'Area': 'YFArea'})
+    return droplets[KEYS + ['Feret']].merge(yf, on=KEYS, how='inner')
+
+
+def _background(image, mean, k, pool=None, iterations=3):
+    """
+    Background median and noise of each image from the low quantiles of its empty droplets.
+
+    Every image is sorted once; the 10% and 25% quantiles of the empty droplets are the
+    10% and 25% of the lowest p0 * n values, with the empty fraction p0 re-estimated
+    from the classification of the previous iteration. With `pool` (a group index per
+    image), the noise is averaged over the images of each group, weighted by their
+    droplets, since two quantiles of the ~100 droplets of one image are too noisy on their own.
+    """
+    order = np.lexsort((mean, image))
+    values = mean[order]
+    n = np.bincount(image)
+    start = np.concatenate([[0], np.cumsum(n)[:-1]])
+    p0 = np.ones(n.size)
+    for _ in range(iterations):
+        empties = np.maximum(p0 * n, 1)
+        q10, q25 = (values[start + np.minimum((q * empties).astype(np.int64), n - 1)] for q in (0.10, 0.25))
+        # Normal background: q25 - q10 = 0.607 sigma, median = q25 + 0.674 sigma
+        sigma = np.maximum((q25 - q10) / 0.607, 1e-6)
+        if pool is not None:
+            sigma = (np.bincount(pool, weights=sigma * n) / np.bincount(pool, weights=n))[pool]
+        background = q25 + 0.674 * sigma
+        occupied = mean > (background + k * sigma)[image]
+        p0 = np.clip(1 - np.bincount(image, weights=occupied, minlength=n.size) / n, 0.15, 1)
+    return background, sigma, occupied
+
+
+def _poisson_weights(lam, max_cells=MAX_CELLS):
+    """(groups, max_cells + 1) log Poisson probabilities; the last column is P(n >= max_cells)."""
+    n = np.arange(max_cells + 1)
+    log_factorial = np.concatenate([[0.0], np.cumsum(np.log(n[1:]))])
+    lam = np.maximum(lam, 1e-9)[:, None]
+    log_p = n * np.log(lam) - lam - log_factorial
+    tail = 1 - np.exp(log_p[:, :-1]).sum(axis=1)
+    log_p[:, -1] = np.log(np.maximum(tail, 1e-300))
+    return log_p
+
+
+def _start_unit(group, occupied, signal):
+    """Cell unit per group from the mean signal of the occupied droplets and the Poisson cells per occupied droplet."""
+    n = np.bincount(group)
+    n_occupied = np.bincount(group, weights=occupied, minlength=n.size)
+    lam = -np.log(np.clip(1 - n_occupied / n, 1e-6, 1))
+    cells_per_occupied = np.where(lam > 0, lam / -np.expm1(-np.maximum(lam, 1e-12)), 1.0)
+    mean_signal = np.bincount(group, weights=np.where(occupied, signal, 0), minlength=n.size) / np.maximum(n_occupied, 1)
+    return mean_signal / cells_per_occupied, n_occupied
+
+
+def classify(table, k=4.0, cell_unit=None, iterations=50, tolerance=1e-5, min_occupied=MIN_OCCUPIED, verbose=True):
+    """
+    Add class probabilities, Occupied, Cells (0, 1, 2 = multiple) and Signal columns.
+
+    Lambda is fitted per experiment, condition and timepoint, the cell unit and its
+    spread per experiment and condition (pooled over timepoints), since a few hundred
+    droplets per timepoint hold too few cells to calibrate them. The unit is kept at
+    least `k` noise widths of the integrated intensity, the faintest cell that can be
+    told from background. Experiments/conditions with fewer than min_occupied droplets
+    above that use the unit fitted on all droplets (or cell_unit).
+
+    Args:
+        table (pd.DataFrame): Output of join_tables()
+        k (float): Noise widths above background of the droplets the cell unit
+            starts from, and of the faintest cell unit allowed
+        cell_unit (float, optional): Integrated intensity of one cell; fitted when not given
+        iterations (int): Maximum EM iterations of the mixture
+        tolerance (float): Stop once no lambda changes by more than this
+        min_occupied (int): Droplets above k noise widths needed to fit the unit of an
+            experiment and condition
+        verbose (bool): Say which experiments/conditions fall back to the common unit
+
+    Returns:
+        pd.DataFrame: The table with PEmpty, PSingle, PMultiple, Occupied, Signal and
+            Cells (most likely class) columns
+    """
+    if table.empty:
+        return table.assign(**{name: np.empty(0) for name in PROBABILITIES}, Occupied=np.empty(0, dtype=bool),
+                            Signal=np.empty(0, dtype=np.float32), Cells=np.empty(0, dtype=np.int8))
+    image = table.groupby(['experiment', 'condition', 'fov', 'timepoint'], observed=True, sort=False).ngroup().to_numpy()
+    run = table.groupby(['experiment', 'condition', 'timepoint'], observed=True, sort=False).ngroup().to_numpy()
+    calibration_groups = table.groupby(['experiment', 'condition'], observed=True, sort=True)
+    calibration = calibration_groups.ngroup().to_numpy()
+    mean = table['YFMean'].to_numpy()
+    area = table['YFArea'].to_numpy()
+    calibration_of_image = np.zeros(image.max() + 1, dtype=np.int64)
+    calibration_of_image[image] = calibration
+    background, sigma, occupied = _background(image, mean, k, pool=calibration_of_image)
+    signal = ((mean - background[image]) * area).astype(np.float32)
+    noise_var = ((sigma[image] * area) ** 2).astype(np.float32)
+    n_calibration = calibration.max() + 1
+    floor = k * np.bincount(calibration, weights=np.sqrt(noise_var)) / np.bincount(calibration)
+
+    # Start from the droplets clearly above background
+    n = np.bincount(run)
+    lam = -np.log(np.clip(1 - np.bincount(run, weights=occupied) / n, 1e-6, 1))
+    if cell_unit:
+        unit = np.full(n_calibration, float(cell_unit))
+        few = np.zeros(n_calibration, dtype=bool)
+    else:
+        unit, n_occupied = _start_unit(calibration, occupied, signal)
+        few = n_occupied < min_occupied
+        unit[few] = _start_unit(np.zeros_like(calibration), occupied, signal)[0][0]
+        unit = np.maximum(unit, floor)
+        if few.any() and verbose:
+            names = ', '.join('/'.join(map(str, key)) for key in calibration_groups.size().index[few])
+            print(f"Fewer than {min_occupied} occupied droplets in {names}: using the cell unit of all droplets "
+                  f"(set cell_unit / --cell-unit to fix it)")
+    spread = 0.2 * unit
+
+    cells = np.arange(MAX_CELLS + 1, dtype=np.float32)[:, None]
+    for _ in range(iterations):
+        # E step: posterior of the number of cells, (components, droplets) in float32 so
+        # that the reductions over components run along contiguous rows
+        var = noise_var + cells * (spread ** 2).astype(np.float32)[calibration]
+        log_r = (_poisson_weights(lam).T.astype(np.float32)[:, run] - 0.5 * np.log(var)
+                 - 0.5 * (signal - cells * unit.astype(np.float32)[calibration]) ** 2 / var)
+        log_r -= log_r.max(axis=0)
+        r = np.exp(log_r, out=log_r)
+        r /= r.sum(axis=0)
+
+        # M step: lambda from the expected censored counts, the unit from the occupied
+        # droplets, the single-cell spread from the single ones; groups with too few
+        # occupied droplets take the values of all droplets
+        single = r[1]
+        expected = [np.bincount(run, weights=w, minlength=n.size) for w in (r[0], single, r[2:].sum(axis=0))]
+        previous, lam = lam, fit_lambda(*expected)
+        if not cell_unit:
+            total = np.bincount(calibration, weights=(1 - r[0]) * signal, minlength=n_calibration)
+            n_cells = np.bincount(calibration, weights=cells[:, 0] @ r, minlength=n_calibration)
+            unit = np.where(few, total.sum() / max(n_cells.sum(), 1e-12), total / np.maximum(n_cells, 1e-12))
+            unit = np.maximum(unit, floor)
+        residual = np.bincount(calibration, weights=single * ((signal - unit[calibration]) ** 2 - noise_var),
+                               minlength=n_calibration)
+        n_single = np.bincount(calibration, weights=single, minlength=n_calibration)
+        spread_var = np.where(few, residual.sum() / max(n_single.sum(), 1e-12), residual / np.maximum(n_single, 1e-12))
+        spread = np.sqrt(np.maximum(spread_var, (0.05 * unit) ** 2))
+        if np.abs(lam - previous).max() < tolerance:
+            break
+
+    probabilities = np.stack([r[0], r[1], r[2:].sum(axis=0)])
+    return table.assign(**dict(zip(PROBABILITIES, probabilities)), Occupied=probabilities[0] < 0.5,
+                        Signal=signal, Cells=probabilities.argmax(axis=0).astype(np.int8))
+
+
+def occupancy_counts(table, by):
+    """Expected droplet counts per class (sums of class probabilities) and mean diameter for each group of `by`."""
+    grouped = table.groupby(by, observed=True, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    frame = grouped.size().reset_index()[by]
+    size = len(frame)
+    counts = np.stack([np.bincount(codes, weights=table[p].to_numpy(), minlength=size) for p in PROBABILITIES], axis=1)
+    diameter = np.bincount(codes, weights=table['Feret'].to_numpy(), minlength=size) / np.maximum(counts.sum(axis=1), 1)
+    frame[CLASSES] = counts
+    frame['MeanDiameter'] = diameter
+    return frame
+
+
+def _statistics(frame, run_counts=None, n_boot=1000, seed=0):
+    counts = frame[CLASSES].to_numpy()
+    n = counts.sum(axis=1)
+    lam, efficiency = _summaries(counts.astype(np.float64))
+    frame['Droplets'] = np.rint(n).astype(np.int64)
+    for name in CLASSES:
+        frame[f'Fraction{name}'] = frame[name] / n
+    frame['Lambda'] = lam
+    frame['SingleEfficiency'] = efficiency
+    frame['PoissonSingle'] = lam * np.exp(-lam)
+    # Cells per picolitre of dispersed phase (1 pL = 1000 µm³)
+    frame['CellsPerPL'] = lam / (np.pi * frame['MeanDiameter'] ** 3 / 6 / 1000)
+    for name, values in bootstrap(counts, run_counts, n_boot, seed=seed).items():
+        frame[name] = values
+    return frame
+
+
+def occupancy_statistics(table, n_boot=1000, seed=0):
+    """
+    Occupancy statistics per run and aggregated across runs.
+
+    Args:
+        table (pd.DataFrame): Classified table (classify())
+
+    Returns:
+        tuple: (per experiment/condition/timepoint DataFrame,
+                per condition/timepoint DataFrame pooled across experiments)
+    """
+    per_run = _statistics(occupancy_counts(table, ['experiment', 'condition', 'timepoint']), n_boot=n_boot, seed=seed)
+
+    pooled = occupancy_counts(table, ['condition', 'timepoint'])
+    # Same sorted groups as pooled
+    run_counts = [group.to_numpy() for _, group in
+                  per_run.groupby(['condition', 'timepoint'], observed=True, sort=True)[CLASSES]]
+    pooled['Runs'] = [len(r) for r in run_counts]
+    return per_run, _statistics(pooled, run_counts, n_boot, seed)
+
+
+def from_store(store, filters=None):
+    """Joined table read from a ResultsStore (only the needed columns)."""
+    droplets = store.read('droplets', KEYS + ['Feret'], filters)
+    fluorescence = store.read('fluorescence', KEYS + ['Mean', 'Area'], filters)
+    return join_tables(droplets, fluorescence)
+
+
+# ─────────────────────────────────────────────
+# Synthetic data and benchmark
+# ─────────────────────────────────────────────
+def synthetic_tables(n_droplets=1_000_000, lambdas=None, runs=3, timepoints=4, fovs=20, seed=0):
+    """
+    Droplet and fluorescence tables with Poisson loading and known lambda per condition.
+
+    Returns:
+        tuple: (droplets, fluorescence) DataFrames in the results-store schema
+    """
+    rng = np.random.default_rng(seed)
+    lambdas = lambdas or {'25um': 0.3, '30um': 0.5}
+    conditions = list(lambdas)
+    n = n_droplets
+    condition = rng.integers(0, len(conditions), n)
+    keys = pd.DataFrame({
+        'experiment': pd.Categorical.from_codes(rng.integers(0, runs, n), [f'run{i}' for i in range(runs)]),
+        'condition': pd.Categorical.from_codes(condition, conditions),
+        'fov': rng.integers(0, fovs, n).astype(np.int32),
+        'timepoint': rng.integers(0, timepoints, n).astype(np.int32),
+    })
+    keys['DropletID'] = keys.groupby(['experiment', 'condition', 'fov', 'timepoint'], observed=True).cumcount().astype(np.int32) + 1
+    lam = np.array([lambdas[c] for c in conditions])[condition]
+    cells = rng.poisson(lam)
+    diameter = np.where(condition == 0, 25.0, 30.0) * (1 + 0.03 * rng.standard_normal(n))
+    area = np.pi * (diameter / 2) ** 2
+    # Every cell adds 10000 +- 20% intensity units to the droplet integral, spread over its area
+    mean = 20 + 2 * rng.standard_normal(n) + (cells * 10000 + np.sqrt(cells) * 2000 * rng.standard_normal(n)) / area
+    droplets = keys.assign(Feret=diameter, Area=area)
+    fluorescence = keys.assign(Mean=mean, Area=area, IntDen=mean * area)
+    return droplets, fluorescence
+
+
+def _check_coverage(per_run, lambdas, ci, label):
+    """
+    Assert that the true lambda lies inside the CI of about `ci` of the per-run estimates.
+
+    A few groups miss by chance, so this fails only when the coverage is more than three
+    binomial standard errors below the confidence level.
+    """
+    truth = per_run['condition'].map(lambdas).astype(np.float64)
+    covered = (per_run['LambdaLow'] <= truth) & (truth <= per_run['LambdaHigh'])
+    coverage = covered.mean()
+    bias = (per_run['Lambda'] - truth).groupby(per_run['condition'], observed=True).mean()
+    print(f"{label}: true lambda inside the {ci:.0%} CI of {coverage:.1%} of {len(per_run)} runs; mean bias "
+          + ', '.join(f"{c} {b:+.4f}" for c, b in bias.items()))
+    minimum = ci - 3 * np.sqrt(ci * (1 - ci) / len(per_run))
+    assert coverage >= minimum, f'{label}: CI coverage {coverage:.1%} below {minimum:.1%}, lambda is biased'
+
+
+def benchmark(n_droplets=1_000_000, n_boot=1000, lambdas=None, ci=0.95, small_repeats=10, small_group=125):
+    """
+    Time the pipeline on synthetic tables and check the fitted lambda against the truth.
+
+    Besides the large tables, small experiments like the real runs (one FOV of about
+    `small_group` droplets per condition and timepoint), including an empty (lambda 0)
+    condition, are classified `small_repeats` times and checked the same way.
+    """
+    lambdas = lambdas or {'25um': 0.3, '30um': 0.5}
+    droplets, fluorescence = synthetic_tables(n_droplets, lambdas)
+    timings = {}
+    start = time.perf_counter()
+    table = join_tables(droplets, fluorescence)
+    timings['join'] = time.perf_counter() - start
+    start = time.perf_counter()
+    table = classify(table)
+    timings['classify'] = time.perf_counter() - start
+    start = time.perf_counter()
+    per_run, pooled = occupancy_statistics(table, n_boot)
+    timings['fit + bootstrap'] = time.perf_counter() - start
+    print(f"{n_droplets:,} droplets: " + ', '.join(f"{k} {v:.2f} s" for k, v in timings.items()))
+
+    pooled['TrueLambda'] = pooled['condition'].map(lambdas).astype(np.float64)
+    columns = ['condition', 'timepoint', 'Runs', 'Droplets', 'FractionSingle', 'TrueLambda', 'Lambda', 'LambdaLow',
+               'LambdaHigh', 'SingleEfficiency', 'EfficiencyLow', 'EfficiencyHigh']
+    print(pooled[columns].round(4).to_string(index=False))
+    _check_coverage(per_run, lambdas, ci, 'Large groups')
+
+    small_lambdas = {**lambdas, 'empty': 0.0}
+    runs, timepoints = 2, 4
+    small = []
+    for seed in range(small_repeats):
+        droplets, fluorescence = synthetic_tables(small_group * len(small_lambdas) * runs * timepoints, small_lambdas,
+                                                  runs=runs, timepoints=timepoints, fovs=1, seed=seed + 1)
+        table = classify(join_tables(droplets, fluorescence), verbose=False)
+        small.append(occupancy_statistics(table, n_boot, seed=seed)[0])
+    _check_coverage(pd.concat(small, ignore_index=True), small_lambdas, ci, f'~{small_group} droplets per group')
+    return pooled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Poisson occupancy statistics of encapsulated cells')
+    parser.add_argument('--root', help='Results store directory (default: the repository store)')
+    parser.add_argument('--experiment', nargs='+', help='Experiments to include (default: all)')
+    parser.add_argument('--condition', nargs='+', help='Conditions to include (default: all)')
+    parser.add_argument('--k', type=float, default=4.0, help='Noise widths above background for occupied')
+    parser.add_argument('--cell-unit', type=float, help='Integrated YF intensity of one cell')
+    parser.add_argument('--boot', type=int, default=1000, help='Bootstrap replicates (default: 1000)')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='Run on N synthetic droplets instead')
+    parser.add_argument('-o', '--output', help='Path to save the pooled table (CSV); per-run table gets _runs')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.boot)
+    else:
+        from results_store import ResultsStore, DEFAULT_ROOT
+
+        filters = []
+        if args.experiment:
+            filters.append(('experiment', 'in', args.experiment))
+        if args.condition:
+            filters.append(('condition', 'in', args.condition))
+        table = from_store(ResultsStore(args.root or DEFAULT_ROOT), filters or None)
+        if table.empty:
+            parser.error('No droplets with both size and fluorescence measurements in the store')
+        table = classify(table, args.k, args.cell_unit)
+        per_run, pooled = occupancy_statistics(table, args.boot)
+        with pd.option_context('display.max_columns', None, 'display.width', 200):
+            print(pooled.round(4))
+        if args.output:
+            pooled.to_csv(args.output, index=False)
+            per_run.to_csv(args.output.replace('.csv', '_runs.csv'), index=False)
+            print(f"Saved to {args.output}")
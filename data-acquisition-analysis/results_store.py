@@ -0,0 +1,345 @@
+"""
+Columnar results store for droplet and intensity measurements.
+
+The ImageJ macros write one small CSV per image (`*_results.csv`, `*_summary.csv`)
+and the plotting scripts read hand-merged copies of them. This module collects those
+tables into Parquet datasets partitioned the same way the data is acquired:
+
+    <root>/droplets/experiment=<name>/condition=<name>/fov=<n>/timepoint=<n>/part-0.parquet
+    <root>/fluorescence/experiment=<name>/condition=<name>/fov=<n>/timepoint=<n>/part-0.parquet
+    <root>/intensity/experiment=<name>/condition=<name>/part-0.parquet
+
+Every table has a fixed schema, so numeric columns always come back with the same
+dtype and timestamps are always datetime64 regardless of how the source CSV wrote
+them. Queries only read the requested columns and skip partitions and row groups
+that cannot match the filters.
+
+Each partition imported from a CSV records the size, modification time and SHA-256 of
+that file in a `_source.json` next to its Parquet files (ignored by dataset reads), so
+has(..., source=csv_path) is False again once the CSV is edited or re-exported.
+
+Usage:
+    python results_store.py intensity ../YFP-results/intensity_25um.csv --experiment single_bac --condition 25um
+    python results_store.py droplets ../size-results/Results_25um.csv --experiment single_bac --condition 25um
+"""
+import json
+import hashlib
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Default store location, next to the result folders of this repository
+DEFAULT_ROOT = Path(__file__).resolve().parent.parent / 'results-store'
+
+# Timestamp formats written by Temika/ImageJ exports and by spreadsheet re-saves
+TIMESTAMP_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M']
+
+PARTITION_FIELDS = {
+    'experiment': pa.string(),
+    'condition': pa.string(),
+    'fov': pa.int32(),
+    'timepoint': pa.int32(),
+}
+
+# Per-droplet shape measurements from Macro_ROI.ijm ("area mean mode perimeter shape feret's")
+DROPLET_COLUMNS = ['Area', 'Mean', 'Mode', 'Perim.', 'Circ.', 'Feret', 'FeretX', 'FeretY',
+                   'FeretAngle', 'MinFeret', 'AR', 'Round', 'Solidity']
+
+# Per-droplet fluorescence measurements from Macro_YF_analysis.ijm
+FLUORESCENCE_COLUMNS = ['Area', 'Mean', 'StdDev', 'Min', 'Max', 'XM', 'YM', 'Perim.',
+                        'IntDen', 'Median', 'Skew', 'Kurt', 'RawIntDen']
+
+# Per-timepoint aggregates as in YFP-results/intensity_*.csv
+INTENSITY_COLUMNS = ['MeanIntensity', 'MedianIntensity', 'StdDev']
+
+
+def _schema(float_columns, partitions, extra=()):
+    fields = [pa.field(name, pa.float64()) for name in float_columns]
+    fields += list(extra)
+    fields += [pa.field(name, PARTITION_FIELDS[name]) for name in partitions]
+    return pa.schema(fields)
+
+
+TABLES = {
+    'droplets': {
+        'partitions': ['experiment', 'condition', 'fov', 'timepoint'],
+        'schema': _schema(DROPLET_COLUMNS, ['experiment', 'condition', 'fov', 'timepoint'],
+                          [pa.field('DropletID', pa.int32()), pa.field('Timestamp', pa.timestamp('ms'))]),
+    },
+    'fluorescence': {
+        'partitions': ['experiment', 'condition', 'fov', 'timepoint'],
+        'schema': _schema(FLUORESCENCE_COLUMNS, ['experiment', 'condition', 'fov', 'timepoint'],
+                          [pa.field('DropletID', pa.int32()), pa.field('Timestamp', pa.timestamp('ms'))]),
+    },
+    'intensity': {
+        'partitions': ['experiment', 'condition'],
+        'schema': _schema(INTENSITY_COLUMNS, ['experiment', 'condition'],
+                          [pa.field('Count', pa.int32()), pa.field('Timestamp', pa.timestamp('ms')),
+                           pa.field('TimePoint', pa.int32()), pa.field('ElapsedMinutes', pa.float64())]),
+    },
+}
+
+
+def parse_timestamps(values):
+    """
+    Parse a column of timestamps written in any of TIMESTAMP_FORMATS.
+
+    Args:
+        values (pd.Series): Timestamp strings, possibly mixing formats.
+
+    Returns:
+        pd.Series: datetime64 values, NaT where no format matched.
+    """
+    values = pd.Series(values).astype('string').str.strip()
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    for fmt in TIMESTAMP_FORMATS:
+        missing = parsed.isna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(values[missing], format=fmt, errors='coerce')
+    return parsed
+
+
+def file_fingerprint(path):
+    """Resolved path, size, modification time and SHA-256 of a source file."""
+    path = Path(path).resolve()
+    stat = path.stat()
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return {'path': str(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+
+def read_imagej_csv(csv_path):
+    """
+    Read an ImageJ Results table, dropping blank rows and naming the index column.
+
+    Args:
+        csv_path (str or Path): Path to a `*_results.csv` or hand-merged Results file.
+
+    Returns:
+        pd.DataFrame: Measurements with a `DropletID` column.
+    """
+    df = pd.read_csv(csv_path).dropna(how='all')
+    first = df.columns[0]
+    if not str(first).strip() or str(first).startswith('Unnamed:'):
+        df = df.rename(columns={first: 'DropletID'})
+    elif 'DropletID' not in df.columns:
+        df.insert(0, 'DropletID', np.arange(1, len(df) + 1))
+    return df
+
+
+class ResultsStore:
+    """Partitioned Parquet store for droplet, fluorescence and intensity tables."""
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = Path(root)
+
+    def table_path(self, table):
+        if table not in TABLES:
+            raise ValueError(f"Unknown table '{table}', expected one of {sorted(TABLES)}")
+        return self.root / table
+
+    def partition_path(self, table, **partition):
+        """Directory of the given partition values (a prefix of them selects a parent directory)."""
+        path = self.table_path(table)
+        for name in TABLES[table]['partitions']:
+            if name not in partition:
+                break
+            path = path / f'{name}={partition[name]}'
+        return path
+
+    # ─────────────────────────────────────────────
+    # Writing
+    # ─────────────────────────────────────────────
+    def write(self, table, df, source=None, **partition):
+        """
+        Write a DataFrame into one partition of a table, replacing what was there.
+
+        Args:
+            table (str): 'droplets', 'fluorescence' or 'intensity'
+            df (pd.DataFrame): Measurements; missing schema columns are stored as null
+            source (str or Path, optional): CSV the data was read from; its fingerprint is
+                recorded so has() can tell when it changed
+            **partition: Values for every partition field of the table
+                (experiment, condition and, for per-droplet tables, fov and timepoint)
+        """
+        path = self.table_path(table)
+        spec = TABLES[table]
+        schema = spec['schema']
+        missing = [name for name in spec['partitions'] if name not in partition]
+        if missing:
+            raise ValueError(f"Missing partition values for {table}: {missing}")
+
+        df = df.copy()
+        dropped = [c for c in df.columns if c not in schema.names]
+        if dropped:
+            print(f"Warning: ignoring columns not in the {table} schema: {dropped}")
+        for name, value in partition.items():
+            df[name] = value
+        if 'Timestamp' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['Timestamp']):
+            df['Timestamp'] = parse_timestamps(df['Timestamp'])
+
+        arrays = []
+        for field in schema:
+            if field.name in df.columns:
+                column = df[field.name]
+                if pa.types.is_integer(field.type):
+                    column = pd.to_numeric(column, errors='coerce').astype('Int64')
+                elif pa.types.is_floating(field.type):
+                    column = pd.to_numeric(column, errors='coerce')
+                arrays.append(pa.array(column, type=field.type, from_pandas=True))
+            else:
+                arrays.append(pa.nulls(len(df), type=field.type))
+        data = pa.Table.from_arrays(arrays, schema=schema)
+
+        partitioning = ds.partitioning(
+            pa.schema([schema.field(name) for name in spec['partitions']]), flavor='hive')
+        ds.write_dataset(data, path, format='parquet',
+                         partitioning=partitioning,
+                         basename_template='part-{i}.parquet',
+                         existing_data_behavior='delete_matching')
+        if source is not None:
+            manifest = self.partition_path(table, **partition) / '_source.json'
+            manifest.write_text(json.dumps(file_fingerprint(source)))
+
+    def ingest_intensity_csv(self, csv_path, experiment, condition):
+        """
+        Import a per-timepoint intensity CSV (Timestamp, MeanIntensity, ...).
+
+        TimePoint is the acquisition index and ElapsedMinutes is measured from
+        the first timestamp of the series.
+        """
+        df = pd.read_csv(csv_path).dropna(how='all')
+        df['Timestamp'] = parse_timestamps(df['Timestamp'])
+        df = df.dropna(subset=['Timestamp']).sort_values('Timestamp').reset_index(drop=True)
+        df['TimePoint'] = np.arange(len(df))
+        df['ElapsedMinutes'] = (df['Timestamp'] - df['Timestamp'].iloc[0]).dt.total_seconds() / 60
+        self.write('intensity', df, source=csv_path, experiment=experiment, condition=condition)
+        return len(df)
+
+    def ingest_imagej_results(self, csv_path, table, experiment, condition, fov=0, timepoint=0,
+                              timestamp=None):
+        """
+        Import an ImageJ Results table as the droplets of one FOV and timepoint.
+
+        Args:
+            csv_path (str or Path): Results CSV written by Macro_ROI.ijm or Macro_YF_analysis.ijm
+            table (str): 'droplets' or 'fluorescence'
+            experiment (str): Experiment name, e.g. the Temika save basename
+            condition (str): Condition label, e.g. '25um'
+            fov (int): Field of view index
+            timepoint (int): Repetition index within the acquisition
+            timestamp (str or datetime, optional): Acquisition time of the image
+        """
+        df = read_imagej_csv(csv_path)
+        if timestamp is not None:
+            df['Timestamp'] = parse_timestamps(pd.Series([str(timestamp)] * len(df)))
+        self.write(table, df, source=csv_path, experiment=experiment, condition=condition, fov=fov,
+                   timepoint=timepoint)
+        return len(df)
+
+    # ─────────────────────────────────────────────
+    # Reading
+    # ─────────────────────────────────────────────
+    def dataset(self, table):
+        spec = TABLES[table]
+        return ds.dataset(self.table_path(table), format='parquet', schema=spec['schema'],
+                          partitioning='hive')
+
+    def has(self, table, source=None, **partition):
+        """
+        Check whether any data was written for the given partition values.
+
+        Args:
+            table (str): 'droplets', 'fluorescence' or 'intensity'
+            source (str or Path, optional): Also require that this CSV was imported into
+                the partition and has not changed since (same size and mtime, or same hash)
+            **partition: Partition values, or a prefix of them
+        """
+        path = self.partition_path(table, **partition)
+        if not (path.exists() and any(path.rglob('*.parquet'))):
+            return False
+        if source is None:
+            return True
+        source = Path(source).resolve()
+        stat = source.stat()
+        for manifest in path.rglob('_source.json'):
+            recorded = json.loads(manifest.read_text())
+            if recorded.get('path') != str(source):
+                continue
+            if recorded.get('size') == stat.st_size and recorded.get('mtime_ns') == stat.st_mtime_ns:
+                return True
+            # Touched but possibly identical (copied, re-saved): compare contents
+            return recorded.get('sha256') == file_fingerprint(source)['sha256']
+        return False
+
+    def read(self, table, columns=None, filters=None):
+        """
+        Query a table, reading only the requested columns and matching partitions.
+
+        Args:
+            table (str): 'droplets', 'fluorescence' or 'intensity'
+            columns (list, optional): Columns to load. If None, all columns are loaded.
+            filters (list, optional): Predicates as (column, op, value) tuples combined
+                with AND, e.g. [('condition', '==', '25um'), ('ElapsedMinutes', '<=', 420)].
+                Filters on partition fields prune directories; filters on other columns
+                use the Parquet row-group statistics.
+
+        Returns:
+            pd.DataFrame: The matching rows.
+        """
+        schema = TABLES[table]['schema']
+        if not self.table_path(table).exists():
+            return schema.empty_table().to_pandas()[columns or schema.names]
+        expression = pq.filters_to_expression(filters) if filters else None
+        data = self.dataset(table).to_table(columns=columns, filter=expression)
+        return data.to_pandas()
+
+    def iter_batches(self, table, columns, filters=None, batch_size=1_000_000):
+        """
+        Stream a query as pyarrow RecordBatches of at most batch_size rows.
+
+        Same projection and filters as read(), for tables too large to load at once.
+        """
+        if not self.table_path(table).exists():
+            return
+        expression = pq.filters_to_expression(filters) if filters else None
+        yield from self.dataset(table).to_batches(columns=columns, filter=expression,
+                                                  batch_size=batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import measurement CSVs into the results store')
+    parser.add_argument('table', choices=sorted(TABLES), help='Table to import into')
+    parser.add_argument('csv_files', nargs='+', help='One or more CSV files')
+    parser.add_argument('--root', default=str(DEFAULT_ROOT), help='Store directory')
+    parser.add_argument('--experiment', required=True, help='Experiment name')
+    parser.add_argument('--condition', required=True, help='Condition label, e.g. 25um')
+    parser.add_argument('--fov', type=int, default=0, help='Field of view (per-droplet tables)')
+    parser.add_argument('--timepoint', type=int, default=None,
+                        help='Timepoint of the first file; following files get consecutive timepoints')
+    parser.add_argument('--timestamp', help='Acquisition time of the image (per-droplet tables)')
+    args = parser.parse_args()
+    if args.table == 'intensity' and len(args.csv_files) > 1:
+        parser.error('import one intensity CSV per condition')
+
+    store = ResultsStore(args.root)
+    for i, csv_file in enumerate(args.csv_files):
+        if args.table == 'intensity':
+            n = store.ingest_intensity_csv(csv_file, args.experiment, args.condition)
+        else:
+            timepoint = (args.timepoint or 0) + i
+            n = store.ingest_imagej_results(csv_file, args.table, args.experiment, args.condition,
+                                            fov=args.fov, timepoint=timepoint, timestamp=args.timestamp)
+        print(f"Imported {n} rows from {csv_file} into {args.table}")
+
+
+if __name__ == "__main__":
+    main()
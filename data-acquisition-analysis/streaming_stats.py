@@ -0,0 +1,143 @@
+"""
+Streaming statistics for large measurement tables.
+
+The accumulators here consume data chunk by chunk and can be merged, so statistics
+over millions of droplets can be computed per file or per worker and combined
+afterwards without keeping whole tables in memory.
+
+- RunningStats: count/mean/std/min/max with Welford's update, merged with Chan's formula
+- QuantileSketch: log-bucketed quantile sketch (DDSketch) with a fixed relative error
+- iter_column_chunks: chunked reader for a column of CSV or Parquet files
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+class RunningStats:
+    """Mergeable Welford accumulator for count, mean, variance, min and max."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """Add a chunk of values (NaN and inf are ignored)."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self
+        chunk_mean = values.mean()
+        chunk = RunningStats()
+        chunk.count = values.size
+        chunk.mean = chunk_mean
+        chunk.m2 = float(np.square(values - chunk_mean).sum())
+        chunk.min = float(values.min())
+        chunk.max = float(values.max())
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """Combine with another accumulator in place (Chan et al. parallel update)."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def std(self):
+        """Sample standard deviation (ddof=1, as pandas)."""
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else float('nan')
+
+    @property
+    def cv(self):
+        """Coefficient of variation in percent."""
+        return self.std / self.mean * 100 if self.count > 1 and self.mean else float('nan')
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with bounded relative error (DDSketch).
+
+    Positive values are counted in logarithmic buckets, so any quantile is returned
+    within `relative_accuracy` of the exact value while memory only grows with the
+    log of the value range. Non-positive values are counted in a single zero bucket.
+    """
+
+    def __init__(self, relative_accuracy=0.005):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def update(self, values):
+        """Add a chunk of values (NaN and inf are ignored)."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        positive = values[values > 0]
+        self.zero_count += int(values.size - positive.size)
+        self.count += int(values.size)
+        keys, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype(np.int64),
+                                 return_counts=True)
+        for key, n in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        return self
+
+    def merge(self, other):
+        """Combine with another sketch of the same accuracy in place."""
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        """Approximate q-quantile (0 <= q <= 1), NaN if the sketch is empty."""
+        if self.count == 0:
+            return float('nan')
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return float(2 * self.gamma ** key / (self.gamma + 1))
+        return float(2 * self.gamma ** max(self.buckets) / (self.gamma + 1))
+
+
+def iter_column_chunks(path, column, chunksize=1_000_000):
+    """
+    Yield a column of a CSV or Parquet file as NumPy arrays of at most chunksize values.
+
+    Args:
+        path (str or Path): CSV file, or Parquet file/dataset directory
+        column (str): Column to read; no other column is parsed
+        chunksize (int): Rows per chunk
+    """
+    path = Path(path)
+    if path.is_dir() or path.suffix == '.parquet':
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(path, format='parquet', partitioning='hive')
+        for batch in dataset.to_batches(columns=[column], batch_size=chunksize):
+            yield batch.column(0).to_numpy(zero_copy_only=False)
+    else:
+        for chunk in pd.read_csv(path, usecols=[column], chunksize=chunksize):
+            yield chunk[column].to_numpy()
@@ -0,0 +1,165 @@
+"""
+Synthetic BF/YF droplet frames with known ground truth.
+
+Frames are rendered at the resolution of the FLIR BFS-U3-70S7M (Sony IMX428,
+3208 x 2200 px, 12-bit) with the Temika 40x scale of 0.112 µm/px. Droplets are
+packed on a jittered hexagonal lattice (as in the imaging chamber), each with a
+diameter drawn from a normal distribution with the requested polydispersity and
+a Poisson number of cells that only show up in the YF channel.
+
+Usage:
+    python synthetic_droplets.py out_dir --frames 10 --diameter 25 --cv 3 --occupancy 0.3
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from droplet_segmentation import PIXEL_SIZE_UM
+
+SENSOR_SHAPE = (2200, 3208)  # rows, columns
+BIT_DEPTH = 12
+
+
+def _place_droplets(rng, shape, diameter_px, cv, fill, shift=False):
+    """
+    Centers and diameters (px) on a jittered hex lattice with a fraction `fill` occupied.
+
+    With shift, the lattice origin is moved by a random fraction of a pitch and droplets
+    may be cut by the frame edge, so positions are uncorrelated between frames.
+    """
+    d_max = diameter_px * (1 + 4 * cv)
+    pitch = d_max * 1.02
+    row_pitch = pitch * np.sqrt(3) / 2
+    if shift:
+        # Random lattice origin; droplets may be cut by the frame edge
+        y0, x0 = rng.uniform(-row_pitch, 0), rng.uniform(-pitch, 0)
+        y_stop, x_stop = shape[0] + row_pitch, shape[1] + pitch
+    else:
+        y0 = x0 = d_max / 2
+        y_stop, x_stop = shape[0] - d_max / 2, shape[1] - d_max / 2
+    centers = []
+    for row, y in enumerate(np.arange(y0, y_stop, row_pitch)):
+        xs = np.arange(x0 + (pitch / 2) * (row % 2), x_stop, pitch)
+        centers.append(np.column_stack([np.full(xs.size, y), xs]))
+    centers = np.concatenate(centers)
+    centers = centers[rng.random(len(centers)) < fill]
+    diameters = np.clip(rng.normal(diameter_px, cv * diameter_px, len(centers)),
+                        0.5 * diameter_px, d_max)
+    # Jitter within the free space left by the lattice
+    slack = (pitch - diameters)[:, None] / 2
+    centers = centers + rng.uniform(-1, 1, centers.shape) * slack
+    if shift:
+        r = diameters[:, None] / 2
+        inside = ((centers > -r) & (centers < np.array(shape) + r)).all(axis=1)
+        centers, diameters = centers[inside], diameters[inside]
+    return centers, diameters
+
+
+def _illumination(shape, gradient, vignetting):
+    """Multiplicative illumination field: linear gradient along x plus radial fall-off."""
+    yy = np.linspace(-1, 1, shape[0], dtype=np.float32)[:, None]
+    xx = np.linspace(-1, 1, shape[1], dtype=np.float32)[None, :]
+    return (1 + gradient * xx / 2) * (1 - vignetting * (xx ** 2 + yy ** 2) / 2)
+
+
+def generate_frame(shape=SENSOR_SHAPE, pixel_size=PIXEL_SIZE_UM, diameter_um=25.0, cv=0.03, fill=0.8,
+                   occupancy=0.3, noise=0.02, gradient=0.2, vignetting=0.1, seed=None, noise_seed=None,
+                   shift=False):
+    """
+    Render one bright-field and one YF frame with known droplets.
+
+    Args:
+        shape (tuple): Frame size (rows, columns)
+        pixel_size (float): µm per pixel
+        diameter_um (float): Mean droplet diameter in µm
+        cv (float): Polydispersity as a fraction of the mean (0.03 = 3%)
+        fill (float): Fraction of lattice sites holding a droplet
+        occupancy (float): Poisson mean number of cells per droplet
+        noise (float): Gaussian noise, as a fraction of the full scale
+        gradient (float): Relative illumination change from left to right edge
+        vignetting (float): Relative illumination loss in the corners
+        seed (int, optional): Random seed
+        noise_seed (int, optional): Separate seed for the camera noise only, to render
+            the same droplets (same seed) at several timepoints
+        shift (bool): Random lattice origin, so droplet positions are uncorrelated
+            between frames (different FOVs) and droplets can be cut by the edges
+
+    Returns:
+        tuple: (bf uint16, yf uint16, truth DataFrame with X, Y, Diameter in µm and Cells)
+    """
+    rng = np.random.default_rng(seed)
+    full_scale = 2 ** BIT_DEPTH - 1
+    diameter_px = diameter_um / pixel_size
+    centers, diameters = _place_droplets(rng, shape, diameter_px, cv, fill, shift)
+    cells = rng.poisson(occupancy, len(centers))
+
+    bf = np.full(shape, 0.45, dtype=np.float32)
+    yf = np.full(shape, 0.02, dtype=np.float32)
+    rim = max(diameter_px * 0.02, 1.5)
+    cell_sigma = 0.5 / pixel_size  # ~1 µm bacteria
+    for (cy, cx), d, n_cells in zip(centers, diameters, cells):
+        r = d / 2
+        y0, y1 = int(max(cy - r - 3 * rim, 0)), int(min(cy + r + 3 * rim + 1, shape[0]))
+        x0, x1 = int(max(cx - r - 3 * rim, 0)), int(min(cx + r + 3 * rim + 1, shape[1]))
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        dist = np.sqrt((yy - cy) ** 2 + (xx - cx) ** 2, dtype=np.float32)
+        # Dark oil/water interface with a bright refraction halo just inside it
+        bf[y0:y1, x0:x1] += (0.05 * (dist < r) - 0.15 * np.exp(-((dist - r) / rim) ** 2)
+                             + 0.3 * np.exp(-((dist - r + 2 * rim) / (1.5 * rim)) ** 2))
+        for _ in range(n_cells):
+            angle, radius = rng.uniform(0, 2 * np.pi), r * 0.8 * np.sqrt(rng.random())
+            py, px = cy + radius * np.sin(angle), cx + radius * np.cos(angle)
+            yf[y0:y1, x0:x1] += 0.5 * np.exp(-((yy - py) ** 2 + (xx - px) ** 2) / (2 * cell_sigma ** 2))
+
+    light = _illumination(shape, gradient, vignetting)
+    noise_rng = rng if noise_seed is None else np.random.default_rng(noise_seed)
+    frames = []
+    for img in (bf, yf):
+        img = img * light + noise_rng.normal(0, noise, shape).astype(np.float32)
+        frames.append(np.clip(img * full_scale, 0, full_scale).astype(np.uint16))
+
+    truth = pd.DataFrame({
+        'X': centers[:, 1] * pixel_size,
+        'Y': centers[:, 0] * pixel_size,
+        'Diameter': diameters * pixel_size,
+        'Cells': cells,
+    })
+    return frames[0], frames[1], truth
+
+
+def write_frames(out_dir, n_frames=10, seed=0, **kwargs):
+    """Write bf_NNNNNN.tif / yf_NNNNNN.tif pairs and a truth.csv to out_dir."""
+    from PIL import Image
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    truths = []
+    for i in range(n_frames):
+        bf, yf, truth = generate_frame(seed=seed + i, **kwargs)
+        Image.fromarray(bf).save(out_dir / f'bf_{i:06d}.tif')
+        Image.fromarray(yf).save(out_dir / f'yf_{i:06d}.tif')
+        truths.append(truth.assign(Frame=i))
+    truth = pd.concat(truths, ignore_index=True)
+    truth.to_csv(out_dir / 'truth.csv', index=False)
+    return truth
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate synthetic BF/YF droplet frames with ground truth')
+    parser.add_argument('out_dir', help='Output directory')
+    parser.add_argument('--frames', type=int, default=10, help='Number of frame pairs (default: 10)')
+    parser.add_argument('--diameter', type=float, default=25.0, help='Mean droplet diameter in µm')
+    parser.add_argument('--cv', type=float, default=3.0, help='Polydispersity CV in percent')
+    parser.add_argument('--fill', type=float, default=0.8, help='Fraction of lattice sites filled')
+    parser.add_argument('--occupancy', type=float, default=0.3, help='Poisson mean cells per droplet')
+    parser.add_argument('--noise', type=float, default=0.02, help='Noise as fraction of full scale')
+    parser.add_argument('--gradient', type=float, default=0.2, help='Left-to-right illumination change')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the first frame')
+    args = parser.parse_args()
+
+    truth = write_frames(args.out_dir, args.frames, seed=args.seed, diameter_um=args.diameter,
+                         cv=args.cv / 100, fill=args.fill, occupancy=args.occupancy,
+                         noise=args.noise, gradient=args.gradient)
+    print(f"Wrote {args.frames} frame pairs with {len(truth)} droplets to {args.out_dir}")
@@ -0,0 +1,364 @@
+"""
+Acquisition-plan compiler for Temika XML scripts.
+
+Generates scripts like BF-YF-1offset-20FOVs.xml from a list of FOV coordinates and
+channels instead of writing them by hand. The plan is ordered to keep each
+repetition short:
+
+- FOV path: 'serpentine' (column by column, alternating direction), 'nearest'
+  (nearest neighbour + 2-opt) or 'given'
+- channel order: 'fov-major' images every channel at a FOV before moving and
+  alternates the channel order between FOVs, so consecutive FOVs share the filter
+  cube; 'channel-major' images all FOVs in one channel, then all FOVs in the next
+  (two cassette switches per repetition but twice the stage travel); 'auto' keeps
+  whichever is faster under the timing model
+- commands are only emitted when something changes (illumination, gain/exposure,
+  cassette, PFS offset), and the fixed 1 s sleeps are replaced with the settle
+  times of the timing model, rounded up to whole seconds (the only sleep format the
+  existing scripts use; --sleep-resolution allows finer sleeps once Temika is known
+  to accept fractional seconds)
+
+Usage:
+    python temika_plan.py --grid 2 10 --pitch 730 500 --channels BF YFP -o BF-YF-plan.xml
+    python temika_plan.py --fovs fovs.csv --interval 20 --repetitions 72 -o plan.xml
+"""
+import math
+import argparse
+
+import numpy as np
+import pandas as pd
+
+CAMERA = 'Genicam FLIR Blackfly S BFS-U3-70S7M 015602AE'
+SAVE_BASENAME = '/home/lm653/data/Pierre/single_bac'
+
+# Channel presets, as in BF-YF-1offset-*.xml
+CHANNELS = {
+    'BF': {'sequence_step': '0x20', 'led': 5, 'level': 6500, 'cassette': 5,
+           'gain': 1, 'exposure_us': 50000, 'pfs_offset': 20001},
+    'YFP': {'sequence_step': '0x04', 'led': 2, 'level': 65500, 'cassette': 4,
+            'gain': 32, 'exposure_us': 400000, 'pfs_offset': 20001},
+}
+
+# Instrument timing model (seconds, µm/s). Conservative defaults for the Eclipse Ti
+# stage/turret and the BFS-U3-70S7M; calibrate them on the microscope and pass
+# overrides to compile_plan / estimate_cycle_time.
+DEFAULT_TIMING = {
+    'stage_speed_um_s': 2000.0,   # per axis at speed level stage_reference_speed; x and y move one after the other
+    'stage_reference_speed': 4,   # move_absolute speed level of stage_speed_um_s; travel time scales inversely
+    'stage_settle_s': 0.2,        # after the last axis move
+    'cassette_switch_s': 0.8,     # filter_block_cassette turret rotation
+    'pfs_settle_s': 0.3,          # PFS relock after a move or offset change
+    'illumination_s': 0.01,       # LED sequence reprogramming
+    'camera_config_s': 0.02,      # genicam Gain/ExposureTime write
+    'readout_s': 0.05,            # sensor readout and transfer after the exposure
+    'sleep_resolution_s': 1.0,    # granularity of emitted sleeps; the existing scripts only use whole seconds
+}
+
+# move_absolute speed levels of the emitted moves, as in the existing scripts
+MOVE_SPEED = 4
+RETURN_SPEED = 1
+
+# ─────────────────────────────────────────────
+# Ordering
+# ─────────────────────────────────────────────
+def stage_speed(speed, timing=DEFAULT_TIMING):
+    """Stage speed in stage units per second at a move_absolute speed level."""
+    return timing['stage_speed_um_s'] * speed / timing['stage_reference_speed']
+
+def travel_time(a, b, timing=DEFAULT_TIMING, speed=MOVE_SPEED):
+    """Stage time between two FOVs (sequential x and y moves plus settle), 0 if no move."""
+    dx, dy = abs(b[0] - a[0]), abs(b[1] - a[1])
+    if dx == 0 and dy == 0:
+        return 0.0
+    return (dx + dy) / stage_speed(speed, timing) + timing['stage_settle_s']
+
+def move_travel(actions, home=(0, 0)):
+    """Total Manhattan distance of the 'move' actions, starting from home."""
+    here, total = home, 0.0
+    for action in actions:
+        if action[0] == 'move':
+            total += abs(action[1] - here[0]) + abs(action[2] - here[1])
+            here = action[1:]
+    return float(total)
+
+def serpentine(fovs, tolerance=1.0):
+    """Visit FOVs column by column (same x within tolerance), alternating y direction."""
+    fovs = sorted(map(tuple, fovs))
+    columns = []
+    for p in fovs:
+        if columns and abs(p[0] - columns[-1][0][0]) <= tolerance:
+            columns[-1].append(p)
+        else:
+            columns.append([p])
+    ordered = []
+    for i, column in enumerate(columns):
+        column.sort(key=lambda p: p[1], reverse=bool(i % 2))
+        ordered.extend(column)
+    return ordered
+
+def nearest_neighbour(fovs, start=(0, 0)):
+    """Greedy nearest-neighbour path from start, refined with 2-opt (Manhattan metric)."""
+    pts = np.asarray(fovs, dtype=float)
+    remaining = list(range(len(pts)))
+    order = []
+    here = np.asarray(start, dtype=float)
+    while remaining:
+        d = np.abs(pts[remaining] - here).sum(axis=1)
+        k = remaining.pop(int(np.argmin(d)))
+        order.append(k)
+        here = pts[k]
+
+    # 2-opt: reverse segments while that shortens the open path from start
+    route = np.vstack([start, pts[order]])
+    dist = lambda i, j: np.abs(route[i] - route[j]).sum()
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(route) - 2):
+            for j in range(i + 1, len(route) - 1):
+                if dist(i - 1, i) + dist(j, j + 1) > dist(i - 1, j) + dist(i, j + 1) + 1e-9:
+                    route[i:j + 1] = route[i:j + 1][::-1]
+                    improved = True
+    return [tuple(p) for p in route[1:]]
+
+PATHS = {
+    'serpentine': lambda fovs: serpentine(fovs),
+    'nearest': lambda fovs: nearest_neighbour(fovs),
+    'given': lambda fovs: [tuple(p) for p in fovs],
+}
+
+def build_steps(fovs, channels, order='fov-major'):
+    """
+    Sequence of (fov, channel) acquisitions for one repetition.
+
+    Args:
+        fovs (list): Ordered (x, y) stage positions
+        channels (list): Channel names in their preferred order
+        order (str): 'fov-major' or 'channel-major'
+    """
+    if order == 'fov-major':
+        steps = []
+        for i, fov in enumerate(fovs):
+            chans = channels if i % 2 == 0 else channels[::-1]
+            steps.extend((fov, c) for c in chans)
+        return steps
+    if order == 'channel-major':
+        steps = []
+        for i, c in enumerate(channels):
+            path = fovs if i % 2 == 0 else fovs[::-1]
+            steps.extend((fov, c) for fov in path)
+        return steps
+    raise ValueError(f"Unknown channel order '{order}'")
+
+# ─────────────────────────────────────────────
+# Actions and timing
+# ─────────────────────────────────────────────
+def _round_up(seconds, resolution):
+    return math.ceil(seconds / resolution - 1e-9) * resolution
+
+def build_actions(steps, channel_presets=CHANNELS, timing=DEFAULT_TIMING, home=(0, 0)):
+    """
+    Turn acquisition steps into Temika actions with the minimum safe sleeps.
+
+    Actions are tuples: ('illumination', preset), ('move', x, y), ('pfs', offset),
+    ('cassette', position), ('camera', gain, exposure_us), ('sleep', seconds),
+    ('trigger', exposure_us). Each action is only emitted when the state it sets
+    changes; the sleep before a trigger covers the slowest pending settle, and the
+    sleep after it covers exposure plus readout.
+    """
+    actions = []
+    state = {'fov': None, 'channel_step': None, 'cassette': None, 'camera': None, 'pfs': None}
+    res = timing['sleep_resolution_s']
+    for fov, name in steps:
+        ch = channel_presets[name]
+        settle = 0.0
+        if state['channel_step'] != (ch['sequence_step'], ch['led'], ch['level']):
+            actions.append(('illumination', ch))
+            state['channel_step'] = (ch['sequence_step'], ch['led'], ch['level'])
+            settle = max(settle, timing['illumination_s'])
+        moved = fov != state['fov']
+        stage = 0.0
+        if moved:
+            actions.append(('move', fov[0], fov[1]))
+            stage = travel_time(state['fov'] or home, fov, timing)
+            settle = max(settle, stage)
+            state['fov'] = fov
+        if moved or state['pfs'] != ch['pfs_offset']:
+            actions.append(('pfs', ch['pfs_offset']))
+            state['pfs'] = ch['pfs_offset']
+            # PFS can only relock once the stage has arrived
+            settle = max(settle, stage + timing['pfs_settle_s'])
+        if state['cassette'] != ch['cassette']:
+            actions.append(('cassette', ch['cassette']))
+            state['cassette'] = ch['cassette']
+            settle = max(settle, timing['cassette_switch_s'])
+        if state['camera'] != (ch['gain'], ch['exposure_us']):
+            actions.append(('camera', ch['gain'], ch['exposure_us']))
+            state['camera'] = (ch['gain'], ch['exposure_us'])
+            settle = max(settle, timing['camera_config_s'])
+        if settle > 0:
+            actions.append(('sleep', _round_up(settle, res)))
+        actions.append(('trigger', ch['exposure_us']))
+        actions.append(('sleep', _round_up(ch['exposure_us'] / 1e6 + timing['readout_s'], res)))
+    if home is not None:
+        actions.append(('move', home[0], home[1]))
+    return actions
+
+def estimate_cycle_time(actions, timing=DEFAULT_TIMING):
+    """
+    Wall time of one repetition for actions produced by build_actions.
+
+    Temika runs commands back to back and only sleeps block, so the repetition
+    lasts as long as its sleeps plus the final return move (at RETURN_SPEED, timed
+    with the same timing model the actions were built with).
+    """
+    total = sum(a[1] for a in actions if a[0] == 'sleep')
+    if actions and actions[-1][0] == 'move':
+        prev = next((a for a in reversed(actions[:-1]) if a[0] == 'move'), None)
+        if prev is not None:
+            total += travel_time(prev[1:], actions[-1][1:], timing, RETURN_SPEED)
+    return total
+
+def compile_plan(fovs, channels=('BF', 'YFP'), path='serpentine', order='auto',
+                 channel_presets=CHANNELS, timing=None):
+    """
+    Order FOVs and channels and build the actions of one repetition.
+
+    Args:
+        fovs (list): (x, y) stage positions
+        channels (list): Channel names from channel_presets
+        path (str): 'serpentine', 'nearest' or 'given'
+        order (str): 'fov-major', 'channel-major' or 'auto'
+        channel_presets (dict): Illumination/camera/cassette settings per channel
+        timing (dict, optional): Overrides for DEFAULT_TIMING
+
+    Returns:
+        dict: actions, cycle_s, order and the ordered fovs
+    """
+    timing = {**DEFAULT_TIMING, **(timing or {})}
+    ordered = PATHS[path](fovs)
+    candidates = ['fov-major', 'channel-major'] if order == 'auto' else [order]
+    best = None
+    for candidate in candidates:
+        actions = build_actions(build_steps(ordered, list(channels), candidate), channel_presets, timing)
+        cycle = estimate_cycle_time(actions, timing)
+        if best is None or cycle < best['cycle_s']:
+            best = {'actions': actions, 'cycle_s': cycle, 'order': candidate, 'fovs': ordered}
+    return best
+
+# ─────────────────────────────────────────────
+# XML
+# ─────────────────────────────────────────────
+def _format_sleep(seconds):
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    s = f'{s:.3f}'.rstrip('0').rstrip('.') or '0'
+    return f'{int(h)}:{int(m)}:{s}'
+
+def _action_xml(action, speed):
+    kind = action[0]
+    if kind == 'illumination':
+        ch = action[1]
+        return ('\t\t<illumination>\n'
+                '\t\t\t<sequence_reset></sequence_reset>\n'
+                f'\t\t\t<sequence_step number="0">{ch["sequence_step"]}</sequence_step>\n'
+                '\t\t\t<sequence_enable>ON</sequence_enable>\n'
+                f'\t\t\t<set number="{ch["led"]}">{ch["level"]}</set>\n'
+                '\t\t</illumination>\n')
+    if kind == 'move':
+        return ('\t\t<microscope>\n'
+                f'\t\t\t<xystage axis="x">\n\t\t\t\t<move_absolute>{action[1]:g} {speed}</move_absolute>\n\t\t\t</xystage>\n'
+                f'\t\t\t<xystage axis="y">\n\t\t\t\t<move_absolute>{action[2]:g} {speed}</move_absolute>\n\t\t\t</xystage>\n'
+                '\t\t</microscope>\n')
+    if kind == 'pfs':
+        return (f'\t\t<microscope>\n\t\t\t<eclipsetie>\n\t\t\t\t<pfs_offset>{action[1]}</pfs_offset>\n'
+                '\t\t\t</eclipsetie>\n\t\t</microscope>\n')
+    if kind == 'cassette':
+        return ('\t\t<microscope>\n\t\t\t<eclipsetie>\n'
+                f'\t\t\t\t<filter_block_cassette>{action[1]}</filter_block_cassette>\n'
+                '\t\t\t</eclipsetie>\n\t\t</microscope>\n')
+    if kind == 'camera':
+        return (f'\t\t<camera name="{CAMERA}">\n\t\t\t<genicam>\n'
+                f'\t\t\t\t<float feature="Gain">{action[1]}</float>\n'
+                f'\t\t\t\t<float feature="ExposureTime">{action[2]}</float>\n'
+                '\t\t\t</genicam>\n\t\t</camera>\n')
+    if kind == 'trigger':
+        return (f'\t\t<camera name="{CAMERA}">\n\t\t\t<genicam>\n'
+                '\t\t\t\t<command feature="TriggerSoftware"></command>\n'
+                '\t\t\t</genicam>\n\t\t</camera>\n')
+    if kind == 'sleep':
+        return f'\t\t<sleep>{_format_sleep(action[1])}</sleep>\n'
+    raise ValueError(f"Unknown action '{kind}'")
+
+def to_xml(actions, repetitions=72, interval_min=20, speed=MOVE_SPEED, basename=SAVE_BASENAME):
+    """Render one repetition of actions as a complete Temika script (the return move at RETURN_SPEED)."""
+    body = ''.join(_action_xml(a, speed if i < len(actions) - 1 else RETURN_SPEED) for i, a in enumerate(actions))
+    return ('<?xml version="1.0"?>\n'
+            '<!--*- mode: xml -*-->\n'
+            '<!--*- generated by temika_plan.py -*-->\n'
+            '<temika>\n'
+            '\t<save>\n\t\t<append>DATE</append>\n'
+            f'\t\t<basename>{basename}</basename>\n\t</save>\n'
+            f'\t<camera name="{CAMERA}">\n'
+            '\t\t<transmission>ON</transmission>\n\t\t<record>ON</record>\n'
+            '\t\t<genicam>\n\t\t\t<enumeration feature="TriggerMode">On</enumeration>\n\t\t</genicam>\n'
+            '\t</camera>\n\n'
+            f'\t<repeat repetitions="{repetitions}">\n\n'
+            '\t\t<timestamp>0</timestamp>\n\n'
+            f'{body}\n'
+            f'\t\t<sleep timestamp="0">{_format_sleep(interval_min * 60)}</sleep>\n\n'
+            '\t</repeat>\n'
+            '\t<illumination>\n\t\t<record>OFF</record>\n\t</illumination>\n'
+            f'\t<camera name="{CAMERA}">\n\t\t<record>OFF</record>\n\t</camera>\n'
+            '</temika>\n')
+
+def grid_fovs(nx, ny, pitch_x, pitch_y, origin=(0, 0)):
+    """FOV positions on an nx by ny grid."""
+    return [(origin[0] + i * pitch_x, origin[1] + j * pitch_y) for i in range(nx) for j in range(ny)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compile a Temika acquisition script from FOVs and channels')
+    fov_source = parser.add_mutually_exclusive_group(required=True)
+    fov_source.add_argument('--fovs', help='CSV file with x and y columns (stage units)')
+    fov_source.add_argument('--grid', type=int, nargs=2, metavar=('NX', 'NY'), help='FOV grid size')
+    parser.add_argument('--pitch', type=float, nargs=2, default=[730, 500], metavar=('DX', 'DY'),
+                        help='Grid pitch in stage units (default: 730 500)')
+    parser.add_argument('--channels', nargs='+', default=['BF', 'YFP'], choices=list(CHANNELS))
+    parser.add_argument('--exposure', nargs='+', default=[], metavar='CHANNEL=US',
+                        help='Exposure overrides in µs, e.g. YFP=300000')
+    parser.add_argument('--path', choices=list(PATHS), default='serpentine')
+    parser.add_argument('--order', choices=['auto', 'fov-major', 'channel-major'], default='auto')
+    parser.add_argument('--interval', type=float, default=20, help='Repetition interval in minutes')
+    parser.add_argument('--repetitions', type=int, default=72)
+    parser.add_argument('--sleep-resolution', type=float, default=DEFAULT_TIMING['sleep_resolution_s'],
+                        help='Granularity of emitted sleeps in seconds (default: 1). Finer values emit '
+                             'fractional sleeps such as 0:0:0.56, which no existing script uses; '
+                             'check that Temika accepts them first')
+    parser.add_argument('-o', '--output', help='Path to save the XML (printed if omitted)')
+    args = parser.parse_args()
+
+    if args.fovs:
+        fovs = pd.read_csv(args.fovs)[['x', 'y']].itertuples(index=False, name=None)
+    else:
+        fovs = grid_fovs(args.grid[0], args.grid[1], *args.pitch)
+    presets = {name: dict(preset) for name, preset in CHANNELS.items()}
+    for item in args.exposure:
+        name, value = item.split('=')
+        presets[name]['exposure_us'] = int(value)
+    timing = {'sleep_resolution_s': args.sleep_resolution}
+
+    plan = compile_plan(list(fovs), args.channels, args.path, args.order, presets, timing)
+    n_fovs = len(plan['fovs'])
+    per_fov = plan['cycle_s'] / n_fovs
+    print(f"{n_fovs} FOVs, {args.order if args.order != 'auto' else plan['order'] + ' (auto)'} order: "
+          f"cycle {plan['cycle_s']:.1f} s, "
+          f"{sum(a[0] == 'cassette' for a in plan['actions'])} cassette switches, "
+          f"travel {move_travel(plan['actions']):.0f} units; "
+          f"about {int(args.interval * 60 // per_fov)} FOVs fit in {args.interval:g} min")
+    xml = to_xml(plan['actions'], args.repetitions, args.interval)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(xml)
+        print(f"Plan saved to {args.output}")
+    else:
+        print(xml)
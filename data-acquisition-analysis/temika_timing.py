@@ -0,0 +1,241 @@
+"""
+Timing simulator and validator for Temika acquisition scripts.
+
+Temika issues stage, PFS, filter-cassette, illumination and camera commands without
+waiting for the hardware; only <sleep> blocks. This tool replays the <repeat> body
+of a script against a timing model (DEFAULT_TIMING of temika_plan.py) and reports,
+before the run starts:
+
+- the wall time of one repetition and the slack against the <sleep timestamp> interval
+- the critical path: how the repetition time splits into stage travel, PFS settle,
+  cassette switches, exposure/readout and sleep that covers nothing (padding)
+- hazards: triggers fired while the stage, PFS or cassette is still settling, and
+  hardware changes issued while the camera is still exposing
+
+Usage:
+    python temika_timing.py BF-YF-1offset-5FOVs.xml BF-YF-1offset-20FOVs.xml
+    python temika_timing.py plan.xml --timing cassette_switch_s=1.2 stage_speed_um_s=1000
+"""
+import sys
+import argparse
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+from temika_plan import DEFAULT_TIMING, stage_speed
+
+
+def parse_duration(text):
+    """Seconds of a Temika 'h:m:s' duration (seconds may be fractional)."""
+    parts = [float(p) for p in text.strip().split(':')]
+    while len(parts) < 3:
+        parts.insert(0, 0.0)
+    h, m, s = parts
+    return h * 3600 + m * 60 + s
+
+
+def _actions(element, actions):
+    """Flatten an element tree into timing-relevant actions, in document order."""
+    for child in element:
+        tag = child.tag
+        if tag == 'sleep':
+            kind = 'interval' if 'timestamp' in child.attrib else 'sleep'
+            actions.append((kind, parse_duration(child.text or '0')))
+        elif tag == 'move_absolute':
+            # '<position> <speed level>'; without a level the move runs at the reference speed
+            fields = child.text.split()
+            speed = float(fields[1]) if len(fields) > 1 else None
+            actions.append(('move_axis', element.get('axis'), float(fields[0]), speed))
+        elif tag == 'pfs_offset':
+            actions.append(('pfs', int(child.text)))
+        elif tag == 'filter_block_cassette':
+            actions.append(('cassette', int(child.text)))
+        elif tag == 'illumination':
+            actions.append(('illumination',))
+        elif tag == 'float' and child.get('feature') in ('ExposureTime', 'Gain'):
+            actions.append(('camera', child.get('feature'), float(child.text)))
+        elif tag == 'command' and child.get('feature') == 'TriggerSoftware':
+            actions.append(('trigger',))
+        else:
+            _actions(child, actions)
+    return actions
+
+
+def parse_script(source):
+    """
+    Parse a Temika script file (or XML string) into its repeat body.
+
+    Returns:
+        dict: repetitions, interval_s (None without <sleep timestamp>) and actions
+    """
+    root = ET.fromstring(source) if source.lstrip().startswith('<') else ET.parse(source).getroot()
+    repeat = root.find('.//repeat')
+    body = repeat if repeat is not None else root
+    actions = _actions(body, [])
+    intervals = [a[1] for a in actions if a[0] == 'interval']
+    return {
+        'repetitions': int(repeat.get('repetitions', 1)) if repeat is not None else 1,
+        'interval_s': intervals[-1] if intervals else None,
+        'actions': [a for a in actions if a[0] != 'interval'],
+    }
+
+
+def simulate(actions, timing=None):
+    """
+    Replay one repetition and account for where its time goes.
+
+    The body is replayed twice and the second pass is reported, so the stage,
+    cassette and camera start from where the previous repetition left them.
+
+    Returns:
+        dict: cycle_s, required_s (cycle without padding), breakdown (seconds per
+            cause), hazards (list of messages), triggers, cassette_switches and
+            stage_travel (stage units)
+    """
+    timing = {**DEFAULT_TIMING, **(timing or {})}
+    state = {'x': 0.0, 'y': 0.0, 'cassette': None, 'exposure_s': 0.0}
+    for pass_no in range(2):
+        t = 0.0
+        ready = {'stage': 0.0, 'pfs': 0.0, 'cassette': 0.0, 'illumination': 0.0, 'camera config': 0.0}
+        camera_busy = 0.0
+        breakdown = defaultdict(float)
+        hazards = []
+        triggers = switches = 0
+        travel = 0.0
+        for action in actions:
+            kind = action[0]
+            if kind == 'sleep':
+                # Attribute the sleep to whatever is still pending, in the order it settles
+                end = t + action[1]
+                pending = dict(ready, **{'exposure/readout': camera_busy})
+                covered = t
+                for cause, until in sorted(pending.items(), key=lambda kv: kv[1]):
+                    if until > covered:
+                        span = min(until, end) - covered
+                        if span > 0:
+                            breakdown[cause] += span
+                            covered += span
+                breakdown['padding'] += end - covered
+                t = end
+                continue
+            if kind != 'trigger' and camera_busy > t + 1e-9 and kind in ('move_axis', 'cassette', 'illumination'):
+                hazards.append(f"{kind} issued {camera_busy - t:.3f} s before the exposure finished")
+            if kind == 'move_axis':
+                axis, target, speed = action[1], action[2], action[3]
+                distance = abs(target - state[axis])
+                state[axis] = target
+                if distance > 0:
+                    travel += distance
+                    # Axes move one after the other; the settle time follows the last move
+                    move = distance / stage_speed(speed or timing['stage_reference_speed'], timing)
+                    if ready['stage'] > t:
+                        ready['stage'] += move
+                    else:
+                        ready['stage'] = t + move + timing['stage_settle_s']
+            elif kind == 'pfs':
+                ready['pfs'] = max(t, ready['stage']) + timing['pfs_settle_s']
+            elif kind == 'cassette':
+                if action[1] != state['cassette']:
+                    switches += 1
+                    ready['cassette'] = t + timing['cassette_switch_s']
+                    state['cassette'] = action[1]
+            elif kind == 'illumination':
+                ready['illumination'] = t + timing['illumination_s']
+            elif kind == 'camera':
+                if action[1] == 'ExposureTime':
+                    state['exposure_s'] = action[2] / 1e6
+                ready['camera config'] = t + timing['camera_config_s']
+            elif kind == 'trigger':
+                triggers += 1
+                for cause, until in ready.items():
+                    if until > t + 1e-9:
+                        hazards.append(f"trigger {triggers} fired {until - t:.3f} s before {cause} settled")
+                if camera_busy > t + 1e-9:
+                    hazards.append(f"trigger {triggers} fired while the previous exposure was still running")
+                camera_busy = t + state['exposure_s'] + timing['readout_s']
+        # Return move at the end of the body runs into the interval sleep
+        tail = max(ready['stage'], camera_busy) - t
+        if tail > 0:
+            breakdown['stage'] += tail
+            t += tail
+
+    required = t - breakdown['padding']
+    return {
+        'cycle_s': t,
+        'required_s': required,
+        'breakdown': dict(breakdown),
+        'hazards': hazards,
+        'triggers': triggers,
+        'cassette_switches': switches,
+        'stage_travel': travel,
+    }
+
+
+def validate(source, timing=None, min_slack_fraction=0.05):
+    """
+    Simulate a script and decide whether it holds its cadence.
+
+    A plan fails if a repetition (plus a safety margin of min_slack_fraction of the
+    interval) does not fit in the <sleep timestamp> interval, or if any trigger fires
+    before the hardware has settled.
+
+    Returns:
+        dict: the simulate() result plus repetitions, interval_s, slack_s, ok and problems
+    """
+    script = parse_script(source)
+    result = simulate(script['actions'], timing)
+    interval = script['interval_s']
+    problems = []
+    slack = None
+    if interval is not None:
+        slack = interval - result['cycle_s']
+        if slack < min_slack_fraction * interval:
+            problems.append(f"repetition takes {result['cycle_s']:.1f} s, leaving {slack:.1f} s of the "
+                            f"{interval:.0f} s interval (margin {min_slack_fraction:.0%})")
+    if result['hazards']:
+        problems.append(f"{len(result['hazards'])} timing hazards")
+    return {**result, 'repetitions': script['repetitions'], 'interval_s': interval, 'slack_s': slack,
+            'ok': not problems, 'problems': problems}
+
+
+def format_report(name, report):
+    lines = [f"{name}: {'OK' if report['ok'] else 'FAIL'}"]
+    interval = report['interval_s']
+    lines.append(f"  repetition {report['cycle_s']:.1f} s"
+                 + (f" of {interval:.0f} s interval, slack {report['slack_s']:.1f} s" if interval else '')
+                 + f"; {report['triggers']} images, {report['cassette_switches']} cassette switches, "
+                   f"stage travel {report['stage_travel']:.0f}")
+    lines.append(f"  without padding the repetition would take {report['required_s']:.1f} s")
+    lines.append("  critical path:")
+    for cause, seconds in sorted(report['breakdown'].items(), key=lambda kv: -kv[1]):
+        lines.append(f"    {cause:18s} {seconds:8.1f} s  ({seconds / report['cycle_s']:.0%})")
+    for problem in report['problems']:
+        lines.append(f"  ! {problem}")
+    for hazard in report['hazards'][:10]:
+        lines.append(f"    - {hazard}")
+    if len(report['hazards']) > 10:
+        lines.append(f"    ... {len(report['hazards']) - 10} more")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Estimate Temika script timing and check its cadence')
+    parser.add_argument('scripts', nargs='+', help='Temika XML files')
+    parser.add_argument('--timing', nargs='+', default=[], metavar='KEY=VALUE',
+                        help=f"Timing model overrides; keys: {', '.join(DEFAULT_TIMING)}")
+    parser.add_argument('--margin', type=float, default=0.05,
+                        help='Required slack as a fraction of the interval (default: 0.05)')
+    args = parser.parse_args()
+
+    timing = {}
+    for item in args.timing:
+        key, value = item.split('=')
+        if key not in DEFAULT_TIMING:
+            parser.error(f"unknown timing key '{key}'")
+        timing[key] = float(value)
+
+    all_ok = True
+    for script in args.scripts:
+        report = validate(script, timing, args.margin)
+        all_ok &= report['ok']
+        print(format_report(script, report))
+    sys.exit(0 if all_ok else 1)
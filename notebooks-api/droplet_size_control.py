@@ -0,0 +1,494 @@
+"""
+Closed-loop droplet size control: camera measurements -> PI controller -> syringe pump flow.
+
+Every iteration takes the newest frame from the camera, measures the droplet diameters
+with the sizing pipeline of data-acquisition-analysis/droplet_segmentation.py and
+adjusts the dispersed/continuous flow ratio through SyringePumpController. The
+controller works on log(ratio) and log(diameter), since droplet size in flow focusing
+follows a power law of the flow ratio; its output is clamped and rate-limited so the
+pumps are never asked for large steps.
+
+The segmentation under-reads diameters by about 2 µm (the erosion of the droplet mask
+and the Feret of a pixelated contour), so measurements are corrected with a linear
+calibration, true = scale * measured + offset, before they reach the controller.
+calibrate_sizing() fits it on synthetic frames with known droplets at the camera pixel
+size; a calibration measured on the instrument (beads, benchmark_pipeline.py on real
+frames) can be passed instead.
+
+Each iteration is logged with its latency: frame age when processing starts, the time
+spent measuring, the time of the serial command and the total from frame capture to
+command sent.
+
+The camera and pump are backends with a small interface, so the loop runs unchanged
+against the hardware (ApiCamera + SyringePumpController) or against a simulated chip
+(SimulatedCamera + SimulatedPump).
+
+Usage:
+    python droplet_size_control.py --simulate --target 30 --duration 30 --log control_log.csv
+    python droplet_size_control.py --check
+    python droplet_size_control.py --pi-ip 192.168.137.3 --pump-port COM5 --target 25 --pixel-size 0.5
+"""
+import sys
+import io
+import time
+import argparse
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'data-acquisition-analysis'))
+from droplet_segmentation import segment, measure_droplets
+from synthetic_droplets import generate_frame
+
+
+# ─────────────────────────────────────────────
+# Controller
+# ─────────────────────────────────────────────
+class PIController:
+    """
+    Rate-limited PI controller on log(flow ratio).
+
+    Args:
+        setpoint (float): Target droplet diameter in µm
+        kp (float): Proportional gain (change of log ratio per unit log error)
+        ki (float): Integral gain (1/s)
+        ratio_limits (tuple): Allowed (min, max) dispersed/continuous flow ratio
+        max_rate (float): Largest relative change of the ratio per second (0.2 = 20%/s)
+    """
+
+    def __init__(self, setpoint, kp=1.5, ki=0.7, ratio_limits=(0.02, 2.0), max_rate=0.2):
+        self.setpoint = setpoint
+        self.kp = kp
+        self.ki = ki
+        self.log_limits = np.log(ratio_limits)
+        self.max_step = np.log1p(max_rate)
+        self.integral = 0.0
+        self.output = None
+
+    def reset(self, ratio):
+        """Start from the given flow ratio without a bump."""
+        self.output = float(np.clip(np.log(ratio), *self.log_limits))
+        self.integral = self.output
+
+    def update(self, diameter, dt):
+        """
+        New flow ratio for a measured diameter.
+
+        Args:
+            diameter (float): Measured droplet diameter in µm
+            dt (float): Seconds since the previous update
+
+        Returns:
+            float: Dispersed/continuous flow ratio to apply
+        """
+        error = np.log(self.setpoint / diameter)
+        candidate = self.integral + self.ki * error * dt
+        wanted = candidate + self.kp * error
+        low, high = self.log_limits
+        # Conditional integration: no wind-up while the output is saturated
+        if low < wanted < high or (wanted >= high and error < 0) or (wanted <= low and error > 0):
+            self.integral = candidate
+        wanted = np.clip(self.integral + self.kp * error, low, high)
+        step = self.max_step * dt
+        self.output = float(np.clip(wanted, self.output - step, self.output + step))
+        return float(np.exp(self.output))
+
+
+# ─────────────────────────────────────────────
+# Camera and pump backends
+# ─────────────────────────────────────────────
+class ApiCamera:
+    """Newest frames of /api/camera/stream through a MicroscopeClient, as grayscale arrays."""
+
+    def __init__(self, client):
+        self.stream = client.stream()
+        self._last = 0
+
+    def read(self, timeout=1.0):
+        """Return (sequence, capture timestamp, image) of a frame newer than the last one read."""
+        from PIL import Image
+
+        sequence, timestamp, jpeg = self.stream.wait_next(self._last, timeout=timeout)
+        if jpeg is None or sequence == self._last:
+            return None
+        self._last = sequence
+        return sequence, timestamp, np.asarray(Image.open(io.BytesIO(jpeg)).convert('L'))
+
+
+class SimulatedChip:
+    """
+    Flow-focusing chip: D = d_ref * (ratio / ratio_ref) ** exponent, reached with a
+    dead time (transport to the imaging region) and a first-order lag.
+    """
+
+    def __init__(self, d_ref=25.0, ratio_ref=0.25, exponent=0.4, tau=2.0, dead_time=0.5, cv=0.03):
+        self.d_ref = d_ref
+        self.ratio_ref = ratio_ref
+        self.exponent = exponent
+        self.tau = tau
+        self.dead_time = dead_time
+        self.cv = cv
+        self.flows = {}
+        self._history = [(-np.inf, ratio_ref)]
+        self._log_d = np.log(d_ref)
+        self._t = time.time()
+        self._lock = threading.Lock()
+
+    def set_flow(self, pump, value, dispersed, continuous):
+        with self._lock:
+            self.flows[pump] = value
+            if self.flows.get(continuous):
+                self._history.append((time.time(), self.flows.get(dispersed, 0.0) / self.flows[continuous]))
+
+    def steady_diameter(self, ratio):
+        return self.d_ref * (max(ratio, 1e-6) / self.ratio_ref) ** self.exponent
+
+    def diameter(self, now=None):
+        """Mean droplet diameter at the imaging region at time `now`."""
+        now = time.time() if now is None else now
+        with self._lock:
+            effective = [r for t, r in self._history if t <= now - self.dead_time][-1]
+            decay = np.exp(-max(now - self._t, 0.0) / self.tau)
+            self._log_d = np.log(self.steady_diameter(effective)) + (self._log_d - np.log(self.steady_diameter(effective))) * decay
+            self._t = now
+            return float(np.exp(self._log_d))
+
+
+class SimulatedCamera:
+    """Synthetic bright-field frames of the chip at a fixed frame rate."""
+
+    def __init__(self, chip, shape=(384, 512), pixel_size=0.5, fps=20, noise=0.02, seed=0):
+        self.chip = chip
+        self.shape = shape
+        self.pixel_size = pixel_size
+        self.period = 1.0 / fps
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.sequence = 0
+
+    def read(self, timeout=1.0):
+        # Like the live stream: the newest frame is the one captured at the last frame tick
+        now = time.time()
+        timestamp = now - now % self.period
+        bf, _, _ = generate_frame(shape=self.shape, pixel_size=self.pixel_size,
+                                  diameter_um=self.chip.diameter(timestamp), cv=self.chip.cv,
+                                  noise=self.noise, occupancy=0, seed=int(self.rng.integers(2 ** 31)))
+        self.sequence += 1
+        return self.sequence, timestamp, bf
+
+
+class SimulatedPump:
+    """Stand-in for SyringePumpController that drives a SimulatedChip."""
+
+    def __init__(self, chip, dispersed='A', continuous='B', latency=0.01):
+        self.chip = chip
+        self.dispersed = dispersed
+        self.continuous = continuous
+        self.latency = latency  # serial round trip
+
+    def set_flow(self, pump, val):
+        time.sleep(self.latency)
+        self.chip.set_flow(pump, float(val), self.dispersed, self.continuous)
+        return f"OK PUMP={pump} FLOW={val}"
+
+    def get_flow(self, pump):
+        return self.chip.flows.get(pump, 0.0)
+
+    def set_state(self, pump, val):
+        return f"OK PUMP={pump} STATE={val}"
+
+    def close(self):
+        pass
+
+
+# ─────────────────────────────────────────────
+# Measurement and loop
+# ─────────────────────────────────────────────
+def measure_diameter(img, pixel_size, min_area=50, calibration=(1.0, 0.0)):
+    """
+    Median droplet diameter (Feret, µm) in a frame.
+
+    Args:
+        img (np.ndarray): Bright-field frame
+        pixel_size (float): µm per pixel of the camera
+        min_area (float): Smallest droplet area in µm²
+        calibration (tuple): (scale, offset) so that true = scale * measured + offset
+
+    Returns:
+        tuple: (median diameter or NaN, number of droplets)
+    """
+    droplets = measure_droplets(segment(img), pixel_size=pixel_size, min_area=min_area)
+    if droplets.empty:
+        return float('nan'), 0
+    scale, offset = calibration
+    return scale * float(droplets['Feret'].median()) + offset, len(droplets)
+
+
+def calibrate_sizing(pixel_size=0.5, diameters=(15, 20, 25, 30, 35, 40), frames=3, shape=(384, 512),
+                     cv=0.03, noise=0.02, seed=0):
+    """
+    Fit the sizing calibration on synthetic frames with known droplet diameters.
+
+    Args:
+        pixel_size (float): µm per pixel of the camera
+        diameters (tuple): Mean droplet diameters to render, in µm
+        frames (int): Frames per diameter
+        shape (tuple): Frame size
+        cv (float): Polydispersity of the rendered droplets
+        noise (float): Noise of the rendered frames
+        seed (int): Random seed
+
+    Returns:
+        tuple: (scale, offset) for measure_diameter()
+    """
+    measured, true = [], []
+    for i, diameter in enumerate(diameters):
+        for j in range(frames):
+            bf, _, truth = generate_frame(shape=shape, pixel_size=pixel_size, diameter_um=diameter, cv=cv,
+                                          noise=noise, occupancy=0, seed=seed + i * frames + j)
+            value, n = measure_diameter(bf, pixel_size)
+            if n:
+                measured.append(value)
+                true.append(float(truth['Diameter'].median()))
+    if len(measured) < 2:
+        raise ValueError('Too few droplets measured to calibrate')
+    scale, offset = np.polyfit(measured, true, 1)
+    return float(scale), float(offset)
+
+
+class DropletSizeLoop:
+    """
+    Control loop holding the droplet diameter at the controller setpoint.
+
+    Args:
+        camera: Backend with read() -> (sequence, timestamp, image) or None
+        pump: SyringePumpController or SimulatedPump
+        controller (PIController): Controller with the target diameter
+        dispersed (str): Pump of the dispersed (aqueous) phase
+        continuous (str): Pump of the continuous (oil) phase
+        continuous_flow (float): Fixed continuous-phase flow, in the pump units
+        initial_ratio (float): Dispersed/continuous ratio to start from
+        rate_hz (float): Iterations per second
+        pixel_size (float): µm per pixel of the camera
+        min_droplets (int): Frames with fewer droplets are logged but not used
+        calibration (tuple): (scale, offset) of the measured diameter, see calibrate_sizing()
+    """
+
+    def __init__(self, camera, pump, controller, dispersed='A', continuous='B', continuous_flow=1000.0,
+                 initial_ratio=0.25, rate_hz=5.0, pixel_size=0.5, min_droplets=3, calibration=(1.0, 0.0)):
+        self.camera = camera
+        self.pump = pump
+        self.controller = controller
+        self.dispersed = dispersed
+        self.continuous = continuous
+        self.continuous_flow = continuous_flow
+        self.initial_ratio = initial_ratio
+        self.period = 1.0 / rate_hz
+        self.pixel_size = pixel_size
+        self.min_droplets = min_droplets
+        self.calibration = calibration
+        self.log = []
+        self.ratio = None
+        self._last_update = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _apply(self, ratio):
+        flow = round(ratio * self.continuous_flow, 1)
+        self.pump.set_flow(self.dispersed, flow)
+        return flow
+
+    def prime(self):
+        """Set both flows to the initial ratio and reset the controller to it."""
+        self.pump.set_flow(self.continuous, self.continuous_flow)
+        self.ratio = self.initial_ratio
+        self._apply(self.ratio)
+        self.controller.reset(self.ratio)
+        self._last_update = None
+
+    def step(self):
+        """Run one iteration and return its log row (None if no new frame arrived)."""
+        frame = self.camera.read()
+        if frame is None:
+            return None
+        sequence, captured, img = frame
+        started = time.time()
+        diameter, n = measure_diameter(img, self.pixel_size, calibration=self.calibration)
+        measured = time.time()
+
+        flow = None
+        if n >= self.min_droplets:
+            dt = self.period if self._last_update is None else captured - self._last_update
+            self._last_update = captured
+            self.ratio = self.controller.update(diameter, max(dt, 1e-3))
+            flow = self._apply(self.ratio)
+        commanded = time.time()
+
+        row = {
+            'Iteration': len(self.log),
+            'Frame': sequence,
+            'Timestamp': captured,
+            'Diameter': diameter,
+            'Droplets': n,
+            'Setpoint': self.controller.setpoint,
+            'Ratio': self.ratio,
+            'DispersedFlow': flow,
+            'FrameAgeMs': (started - captured) * 1e3,
+            'MeasureMs': (measured - started) * 1e3,
+            'CommandMs': (commanded - measured) * 1e3,
+            'LatencyMs': (commanded - captured) * 1e3,
+        }
+        self.log.append(row)
+        return row
+
+    def run(self, duration=None, iterations=None):
+        """Run at rate_hz until stop(), `duration` seconds or `iterations` iterations."""
+        if self.ratio is None:
+            self.prime()
+        start = time.monotonic()
+        deadline = start
+        count = 0
+        while not self._stop.is_set():
+            if duration is not None and time.monotonic() - start >= duration:
+                break
+            if iterations is not None and count >= iterations:
+                break
+            self.step()
+            count += 1
+            # Fixed-rate schedule; an overrun starts the next iteration at once instead of queueing
+            deadline = max(deadline + self.period, time.monotonic())
+            self._stop.wait(deadline - time.monotonic())
+
+    def start(self, **kwargs):
+        """Run in a background thread (for notebooks)."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, kwargs=kwargs, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def log_frame(self):
+        return pd.DataFrame(self.log)
+
+    def latency_summary(self):
+        """Median, 95th percentile and maximum of each latency column, in ms."""
+        log = self.log_frame()
+        columns = ['FrameAgeMs', 'MeasureMs', 'CommandMs', 'LatencyMs']
+        return log[columns].quantile([0.5, 0.95, 1.0]).rename(index={0.5: 'p50', 0.95: 'p95', 1.0: 'max'})
+
+
+def simulate(target=30.0, duration=20.0, rate_hz=5.0, start_diameter=25.0, calibration=None,
+             **controller_kwargs):
+    """
+    Run the loop end to end against a simulated chip, camera and pump.
+
+    Args:
+        calibration (tuple, optional): Sizing calibration; fitted with calibrate_sizing()
+            at the simulated pixel size when not given
+
+    Returns:
+        tuple: (DropletSizeLoop with its log, SimulatedChip)
+    """
+    chip = SimulatedChip(d_ref=start_diameter)
+    camera = SimulatedCamera(chip)
+    pump = SimulatedPump(chip)
+    if calibration is None:
+        calibration = calibrate_sizing(camera.pixel_size, shape=camera.shape)
+    loop = DropletSizeLoop(camera, pump, PIController(target, **controller_kwargs), rate_hz=rate_hz,
+                           initial_ratio=chip.ratio_ref, pixel_size=camera.pixel_size, calibration=calibration)
+    loop.run(duration=duration)
+    return loop, chip
+
+
+def check_tracking(targets=(30.0, 25.0), settle_s=15.0, tolerance_um=0.5):
+    """
+    End-to-end check on the simulator: the true droplet diameter (not the measured
+    one) must end within tolerance_um of each setpoint in turn.
+
+    Returns:
+        list: (setpoint, true diameter) after each step
+
+    Raises:
+        AssertionError: If a step misses its setpoint
+    """
+    loop, chip = simulate(targets[0], settle_s)
+    results = [(targets[0], chip.diameter())]
+    for target in targets[1:]:
+        loop.controller.setpoint = target
+        loop.run(duration=settle_s)
+        results.append((target, chip.diameter()))
+    for target, true in results:
+        assert abs(true - target) <= tolerance_um, \
+            f"true diameter {true:.2f} µm after settling at setpoint {target} µm (tolerance {tolerance_um} µm)"
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Closed-loop droplet size control')
+    parser.add_argument('--target', type=float, help='Target droplet diameter in µm')
+    parser.add_argument('--simulate', action='store_true', help='Run against a simulated chip, camera and pump')
+    parser.add_argument('--check', action='store_true',
+                        help='Check on the simulator that the true diameter reaches 30 then 25 µm')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run (default: 30)')
+    parser.add_argument('--rate', type=float, default=5.0, help='Iterations per second (default: 5)')
+    parser.add_argument('--pi-ip', help='IP of the Pi running microscope_api.py')
+    parser.add_argument('--pump-port', help='Serial port of the syringe pump controller')
+    parser.add_argument('--dispersed', default='A', help='Dispersed-phase pump (default: A)')
+    parser.add_argument('--continuous', default='B', help='Continuous-phase pump (default: B)')
+    parser.add_argument('--continuous-flow', type=float, default=1000.0, help='Continuous-phase flow (pump units)')
+    parser.add_argument('--ratio', type=float, default=0.25, help='Initial dispersed/continuous ratio')
+    parser.add_argument('--pixel-size', type=float, default=0.5, help='µm per pixel of the stream')
+    parser.add_argument('--calibration', type=float, nargs=2, metavar=('SCALE', 'OFFSET'),
+                        help='Sizing calibration true = SCALE * measured + OFFSET '
+                             '(default: fitted on synthetic frames at --pixel-size)')
+    parser.add_argument('--log', help='Path to save the iteration log (CSV)')
+    args = parser.parse_args()
+
+    if args.check:
+        for target, true in check_tracking():
+            print(f"setpoint {target:.1f} µm: true diameter {true:.2f} µm")
+        print("OK")
+        sys.exit(0)
+    if args.target is None:
+        parser.error('--target is required')
+
+    calibration = tuple(args.calibration) if args.calibration else calibrate_sizing(args.pixel_size)
+    print(f"Sizing calibration: true = {calibration[0]:.3f} * measured {calibration[1]:+.2f} µm")
+    if args.simulate:
+        loop, chip = simulate(args.target, args.duration, args.rate, calibration=calibration)
+        true = chip.diameter()
+        print(f"True diameter at the end: {true:.2f} µm")
+        if abs(true - args.target) > 0.05 * args.target:
+            print(f"! true diameter is {true - args.target:+.2f} µm off the target; check the calibration")
+    else:
+        if not (args.pi_ip and args.pump_port):
+            parser.error('--pi-ip and --pump-port are required without --simulate')
+        from microscope_client import MicroscopeClient
+        from syringe_pump_api import SyringePumpController
+
+        client = MicroscopeClient(args.pi_ip)
+        pump = SyringePumpController(args.pump_port)
+        loop = DropletSizeLoop(ApiCamera(client), pump, PIController(args.target), args.dispersed,
+                               args.continuous, args.continuous_flow, args.ratio, args.rate, args.pixel_size,
+                               calibration=calibration)
+        try:
+            loop.run(duration=args.duration)
+        finally:
+            client.close()
+            pump.close()
+
+    log = loop.log_frame()
+    tail = log[log['Timestamp'] >= log['Timestamp'].iloc[-1] - 5]
+    print(f"{len(log)} iterations, last 5 s: diameter {tail['Diameter'].mean():.2f} ± {tail['Diameter'].std():.2f} µm "
+          f"(target {args.target}), ratio {log['Ratio'].iloc[-1]:.3f}")
+    print("Latency (ms):")
+    print(loop.latency_summary().round(1))
+    if args.log:
+        log.to_csv(args.log, index=False)
+        print(f"Log saved to {args.log}")
@@ -0,0 +1,360 @@
+"""
+Shared-memory ring of raw camera frames for local analysis processes.
+
+microscope_api.py can publish every camera frame, decoded once, into a ring of
+`slots` frames in multiprocessing.shared_memory. Processes on the same host attach
+by name and read the frames as NumPy views without copies, sockets or JPEG decoding.
+
+Memory layout (little endian):
+
+    header   magic, slots, height, width, channels, latest sequence, closed flag
+    slots    one record per slot: seq, timestamp, exposure_us, period_ns, wait_ns, fps
+    data     slots x height x width x channels uint8 frames
+
+There is no lock. Each slot is guarded by its seq field (a seqlock): the writer sets
+it to 2n-1 while frame n is being written and to 2n once it is complete, then updates
+the latest sequence. A reader accepts frame n only if the slot reads 2n, and a zero-copy
+reader checks valid(n) again after using the view, since the writer overwrites a slot
+`slots` frames later.
+
+A ring is replaced, never resized: on a resolution change (or when a server restarts
+over a ring left behind) the old ring is marked closed and unlinked and a new one is
+created under the same name. Readers see the closed flag and, with reattach=True,
+attach to the new ring.
+
+Usage:
+    python frame_ring.py info
+    python frame_ring.py segment --pixel-size 0.5
+    python frame_ring.py record frames.npy --frames 500
+    python frame_ring.py demo --seconds 5
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+DEFAULT_NAME = 'microscope_frames'
+MAGIC = b'FRMRING1'
+
+HEADER = np.dtype([('magic', 'S8'), ('slots', '<u4'), ('height', '<u4'), ('width', '<u4'),
+                   ('channels', '<u4'), ('latest', '<u8'), ('closed', '<u4')], align=True)
+SLOT = np.dtype([('seq', '<u8'), ('timestamp', '<f8'), ('exposure_us', '<f8'), ('period_ns', '<i8'),
+                 ('wait_ns', '<i8'), ('fps', '<f8')])
+_ALIGN = 64
+
+
+def _layout(slots, shape):
+    slots_offset = -(-HEADER.itemsize // _ALIGN) * _ALIGN
+    data_offset = -(-(slots_offset + slots * SLOT.itemsize) // _ALIGN) * _ALIGN
+    return slots_offset, data_offset, data_offset + slots * int(np.prod(shape))
+
+
+class _Ring:
+    """Views of the header, slot records and frames of a mapped ring."""
+
+    def _map(self, slots, shape):
+        slots_offset, data_offset, _ = _layout(slots, shape)
+        buf = self.shm.buf
+        self.header = np.ndarray((), HEADER, buf, 0)
+        self.records = np.ndarray((slots,), SLOT, buf, slots_offset)
+        self.data = np.ndarray((slots, *shape), np.uint8, buf, data_offset)
+        self.slots = slots
+        self.shape = shape
+
+    @property
+    def latest(self):
+        return int(self.header['latest'])
+
+    def close(self):
+        # Views must be released before the mapping can be closed
+        self.header = self.records = self.data = None
+        self.shm.close()
+
+
+class FrameRingWriter(_Ring):
+    """
+    Create a ring and publish frames into it (one writer per ring).
+
+    Args:
+        shape (tuple): Frame shape, (height, width) or (height, width, channels)
+        slots (int): Number of frames kept
+        name (str): Shared memory name consumers attach to
+    """
+
+    def __init__(self, shape, slots=32, name=DEFAULT_NAME):
+        shape = tuple(shape) if len(shape) == 3 else (*shape, 1)
+        try:
+            # A ring left behind by a crashed server: close it for readers still attached
+            stale = shared_memory.SharedMemory(name)
+            header = np.ndarray((), HEADER, stale.buf, 0) if stale.size >= HEADER.itemsize else None
+            if header is not None and header['magic'] == MAGIC:
+                header['closed'] = 1
+            del header
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(name, create=True, size=_layout(slots, shape)[2])
+        self.name = name
+        self._map(slots, shape)
+        self.records[:] = 0
+        self.header[()] = (MAGIC, slots, shape[0], shape[1], shape[2], 0, 0)
+
+    def write(self, frame, timestamp=None, exposure_us=0.0, period_ns=0, wait_ns=0, fps=0.0):
+        """Publish a frame and its acquisition settings; returns its sequence number."""
+        n = self.latest + 1
+        slot = n % self.slots
+        record = self.records[slot:slot + 1]
+        record['seq'] = 2 * n - 1
+        self.data[slot] = np.asarray(frame, dtype=np.uint8).reshape(self.shape)
+        record['timestamp'] = time.time() if timestamp is None else timestamp
+        record['exposure_us'] = exposure_us or 0.0
+        record['period_ns'] = period_ns or 0
+        record['wait_ns'] = wait_ns or 0
+        record['fps'] = fps or 0.0
+        record['seq'] = 2 * n
+        self.header['latest'] = n
+        return n
+
+    def unlink(self):
+        """Mark the ring closed for readers and remove it."""
+        self.header['closed'] = 1
+        self.close()
+        self.shm.unlink()
+
+
+class FrameRingReader(_Ring):
+    """
+    Attach to a ring published by FrameRingWriter.
+
+    Args:
+        name (str): Shared memory name
+        poll_s (float): Sleep between checks while waiting for a new frame
+    """
+
+    def __init__(self, name=DEFAULT_NAME, poll_s=0.001):
+        self.name = name
+        self.poll_s = poll_s
+        self.dropped = 0
+        if not self._attach():
+            raise ValueError(f"'{name}' is not an open frame ring")
+
+    def _attach(self):
+        """Map the ring currently published under self.name; False if it is not an open ring."""
+        shm = shared_memory.SharedMemory(self.name)
+        # Attaching must not make this process remove the ring when it exits (Python < 3.13)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        header = np.ndarray((), HEADER, shm.buf, 0) if shm.size >= HEADER.itemsize else None
+        if header is None or header['magic'] != MAGIC or header['closed']:
+            del header
+            shm.close()
+            return False
+        slots, shape = int(header['slots']), (int(header['height']), int(header['width']), int(header['channels']))
+        del header
+        self.shm = shm
+        self._map(slots, shape)
+        return True
+
+    def reattach(self, timeout=None):
+        """
+        Attach to the ring that replaced this closed one (same name, possibly a new shape).
+
+        Args:
+            timeout (float, optional): Give up after this many seconds
+
+        Returns:
+            bool: True once attached to an open ring
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.close()
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                if self._attach():
+                    return True
+            except FileNotFoundError:
+                pass
+            time.sleep(max(self.poll_s, 0.01))
+        return False
+
+    @property
+    def closed(self):
+        return bool(self.header['closed'])
+
+    def valid(self, n):
+        """True while frame n is still in its slot (not being or already overwritten)."""
+        return int(self.records['seq'][n % self.slots]) == 2 * n
+
+    def read(self, n, copy=False):
+        """
+        Frame n and its settings, or None if it is not (or no longer) in the ring.
+
+        With copy=False the frame is a view into shared memory: check valid(n) after
+        using it if the reader may fall `slots` frames behind.
+        """
+        if n < 1 or not self.valid(n):
+            return None
+        slot = n % self.slots
+        meta = {name: self.records[name][slot].item() for name in SLOT.names[1:]}
+        frame = self.data[slot].squeeze(axis=2) if self.shape[2] == 1 else self.data[slot]
+        if copy:
+            frame = frame.copy()
+        if not self.valid(n):
+            return None
+        return n, meta, frame
+
+    def latest_frame(self, copy=False):
+        return self.read(self.latest, copy)
+
+    def frames(self, copy=False, newest_only=False, timeout=None, reattach=False):
+        """
+        Yield (sequence, settings, frame) as frames are published.
+
+        Args:
+            copy (bool): Yield copies instead of shared-memory views
+            newest_only (bool): Skip to the newest frame each time (for consumers slower
+                than the camera), instead of following every frame
+            timeout (float, optional): Stop after this many seconds without a new frame
+            reattach (bool): When the ring is replaced (resolution change, server
+                restart), continue on the new ring instead of stopping; check
+                self.shape, which may have changed
+        """
+        n = self.latest
+        waited = 0.0
+        while True:
+            if self.closed:
+                if not (reattach and self.reattach(timeout)):
+                    return
+                n = self.latest
+                waited = 0.0
+                continue
+            latest = self.latest
+            if latest <= n:
+                if timeout is not None and waited >= timeout:
+                    return
+                time.sleep(self.poll_s)
+                waited += self.poll_s
+                continue
+            waited = 0.0
+            target = latest if newest_only else n + 1
+            if latest - target >= self.slots - 1:
+                # Too far behind: the slot is about to be overwritten
+                target = latest
+            if not newest_only:
+                self.dropped += target - n - 1
+            n = target
+            item = self.read(n, copy)
+            if item is None:
+                self.dropped += 1
+                continue
+            yield item
+
+
+# ─────────────────────────────────────────────
+# Consumers
+# ─────────────────────────────────────────────
+def segment_worker(name=DEFAULT_NAME, pixel_size=0.5, report_every=2.0):
+    """Measure droplets in the newest frame, as fast as segmentation allows."""
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'data-acquisition-analysis'))
+    from droplet_segmentation import segment, measure_droplets
+
+    reader = FrameRingReader(name)
+    count, start = 0, time.perf_counter()
+    for n, meta, frame in reader.frames(newest_only=True, reattach=True):
+        droplets = measure_droplets(segment(frame), pixel_size=pixel_size, min_area=50)
+        if not reader.valid(n):
+            # Overwritten while it was being segmented: the result may mix two frames
+            reader.dropped += 1
+            continue
+        count += 1
+        if time.perf_counter() - start >= report_every:
+            median = droplets['Feret'].median() if len(droplets) else float('nan')
+            print(f"frame {n}: {len(droplets)} droplets, median {median:.2f} µm, "
+                  f"{count / (time.perf_counter() - start):.1f} frames/s analysed, "
+                  f"age {(time.time() - meta['timestamp']) * 1e3:.0f} ms")
+            count, start = 0, time.perf_counter()
+
+
+def record_worker(path, n_frames, name=DEFAULT_NAME):
+    """Record every frame into a .npy file, with the per-frame settings in a CSV next to it."""
+    import pandas as pd
+
+    reader = FrameRingReader(name)
+    shape = reader.shape if reader.shape[2] > 1 else reader.shape[:2]
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(n_frames, *shape))
+    rows = []
+    for n, meta, frame in reader.frames(timeout=5.0):
+        out[len(rows)] = frame
+        if not reader.valid(n):
+            # Overwritten during the copy; the slot is reused by the next frame
+            reader.dropped += 1
+            continue
+        rows.append({'Sequence': n, **meta})
+        if len(rows) == n_frames:
+            break
+    out.flush()
+    pd.DataFrame(rows).to_csv(Path(path).with_suffix('.csv'), index=False)
+    print(f"Recorded {len(rows)} frames to {path} ({reader.dropped} dropped)")
+
+
+def _demo_writer(name, shape, seconds):
+    writer = FrameRingWriter(shape, name=name)
+    frames = np.random.default_rng(0).integers(0, 256, (8, *shape), dtype=np.uint8)
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        n = writer.write(frames[writer.latest % 8], fps=0)
+    time.sleep(0.2)
+    print(f"writer: {n / seconds:.0f} frames/s published")
+    writer.unlink()
+
+
+def demo(seconds=3.0, shape=(768, 1024), name='frame_ring_demo'):
+    """Throughput of a writer process and a zero-copy reader that touches every frame."""
+    from multiprocessing import Process
+
+    writer = Process(target=_demo_writer, args=(name, shape, seconds))
+    writer.start()
+    for _ in range(100):
+        try:
+            reader = FrameRingReader(name)
+            break
+        except FileNotFoundError:
+            time.sleep(0.05)
+    count, checksum, start = 0, 0, time.perf_counter()
+    for n, meta, frame in reader.frames(timeout=0.1):
+        checksum += int(frame[0, 0])  # touch the frame
+        count += 1
+    elapsed = time.perf_counter() - start
+    print(f"reader: {count / elapsed:.0f} frames/s read zero-copy, {reader.dropped} dropped")
+    reader.close()
+    writer.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Consumers of the microscope shared-memory frame ring')
+    parser.add_argument('--name', default=DEFAULT_NAME, help=f'Ring name (default: {DEFAULT_NAME})')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('info', help='Show the ring layout and latest frame')
+    seg = sub.add_parser('segment', help='Measure droplets in the live frames')
+    seg.add_argument('--pixel-size', type=float, default=0.5, help='µm per pixel')
+    rec = sub.add_parser('record', help='Record frames to a .npy file')
+    rec.add_argument('path', help='Output .npy file')
+    rec.add_argument('--frames', type=int, default=100, help='Number of frames (default: 100)')
+    dem = sub.add_parser('demo', help='Measure ring throughput with a synthetic writer')
+    dem.add_argument('--seconds', type=float, default=3.0, help='Duration (default: 3)')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        reader = FrameRingReader(args.name)
+        item = reader.latest_frame(copy=True)
+        print(f"{args.name}: {reader.slots} slots of {reader.shape}, latest frame {reader.latest}")
+        if item is not None:
+            print(item[1])
+    elif args.command == 'segment':
+        segment_worker(args.name, args.pixel_size)
+    elif args.command == 'record':
+        record_worker(args.path, args.frames, args.name)
+    else:
+        demo(args.seconds)
@@ -12,6 +12,7 @@ import RPi.GPIO as GPIO
 import glob
 from datetime import datetime
 from threading import Event
+from frame_ring import FrameRingWriter, DEFAULT_NAME as FRAME_RING_NAME
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -243,8 +244,10 @@ def stream_frames():
         except Exception as e:
             print(f"Stream error: {e}")
         finally:
-            # Clean up camera resources when stream ends
-            cleanup()
+            # Clean up camera resources when stream ends, unless the frame ring still
+            # publishes from the camera (it is stopped at process exit, see shutdown())
+            if not frame_ring_running():
+                cleanup()
     
     return Response(
         generate(),
@@ -334,6 +337,92 @@ def handle_strobe_settings():
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# Shared-memory frame ring for local analysis processes (see frame_ring.py)
+frame_ring = {'writer': None, 'thread': None, 'stop': Event(), 'slots': 32, 'error': None}
+
+def publish_frames():
+    """Decode each new camera frame once and publish it to the shared-memory ring"""
+    import io
+    import numpy as np
+    from PIL import Image
+
+    last = None
+    stop = frame_ring['stop']
+    try:
+        while not stop.is_set():
+            if camera is None:
+                stop.wait(0.05)
+                continue
+            frame = camera.get_frame()
+            if frame is None or frame is last:
+                stop.wait(0.002)
+                continue
+            last = frame
+            timestamp = time.time()
+            pixels = np.asarray(Image.open(io.BytesIO(frame)).convert('L'))
+
+            writer = frame_ring['writer']
+            if writer is None or writer.shape[:2] != pixels.shape:
+                # New resolution: readers see the old ring closed and re-attach
+                if writer is not None:
+                    writer.unlink()
+                writer = frame_ring['writer'] = FrameRingWriter(pixels.shape, frame_ring['slots'], FRAME_RING_NAME)
+
+            writer.write(pixels, timestamp,
+                         exposure_us=getattr(getattr(camera, 'camera', None), 'shutter_speed', 0),
+                         period_ns=camera.strobe_data.get('period_ns', 0),
+                         wait_ns=camera.strobe_data.get('wait_ns', 0),
+                         fps=current_settings['fps'])
+    except Exception as e:
+        frame_ring['error'] = str(e)
+        print(f"Frame ring error: {e}")
+
+def start_frame_ring(slots=32):
+    init_camera()
+    if frame_ring['thread'] is None or not frame_ring['thread'].is_alive():
+        frame_ring['slots'] = slots
+        frame_ring['stop'].clear()
+        frame_ring['error'] = None
+        frame_ring['thread'] = threading.Thread(target=publish_frames, daemon=True)
+        frame_ring['thread'].start()
+
+def stop_frame_ring():
+    frame_ring['stop'].set()
+    if frame_ring['thread'] is not None:
+        frame_ring['thread'].join(timeout=2)
+        frame_ring['thread'] = None
+    if frame_ring['writer'] is not None:
+        frame_ring['writer'].unlink()
+        frame_ring['writer'] = None
+
+def frame_ring_running():
+    return frame_ring['thread'] is not None and frame_ring['thread'].is_alive()
+
+def frame_ring_info():
+    writer = frame_ring['writer']
+    return {
+        'enabled': frame_ring_running(),
+        'name': FRAME_RING_NAME,
+        'slots': frame_ring['slots'],
+        'shape': list(writer.shape) if writer is not None else None,
+        'latest': writer.latest if writer is not None else 0,
+        'error': frame_ring['error']
+    }
+
+@app.route('/api/camera/ring', methods=['GET', 'POST'])
+def handle_frame_ring():
+    """Get the state of the shared-memory frame ring, or enable/disable it"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json()
+            if data.get('enable'):
+                start_frame_ring(int(data.get('slots', frame_ring['slots'])))
+            else:
+                stop_frame_ring()
+        return jsonify({'status': 'success', 'ring': frame_ring_info()})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 # Cleanup function
 def cleanup():
     global camera
@@ -360,14 +449,26 @@ def cleanup():
         picommon.spi_close()
         exit_event.set()
 
-# Register cleanup to run on exit
-atexit.register(cleanup)
+# Process exit: stop publishing to the frame ring, then release the camera
+def shutdown():
+    try:
+        stop_frame_ring()
+    except Exception as e:
+        print(f"Error stopping frame ring: {e}")
+    cleanup()
+
+# Register shutdown to run on exit
+atexit.register(shutdown)
 
 # Start the server
 if __name__ == '__main__':
     try:
         # Initialize camera and flow controller on startup
         init_camera()
+
+        # Optionally publish raw frames for local analysis processes (FRAME_RING=1)
+        if os.environ.get('FRAME_RING', '0') == '1':
+            start_frame_ring(int(os.environ.get('FRAME_RING_SLOTS', 32)))
         
         # Start the Flask server with debug=False to prevent auto-reloader issues
         app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -376,4 +477,4 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"Error: {e}")
     finally:
-        cleanup()
\ No newline at end of file
+        shutdown()
\ No newline at end of file
@@ -0,0 +1,247 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class MJPEGParser:
+    """
+    Incremental parser for a multipart/x-mixed-replace JPEG stream.
+
+    Bytes are fed as they arrive; only the newest complete frame is kept, so a slow
+    consumer never builds up a backlog of stale frames.
+    """
+
+    def __init__(self, boundary=b'frame'):
+        self.boundary = b'--' + boundary
+        self._buf = bytearray()
+        self.frames_parsed = 0
+
+    def feed(self, chunk):
+        """Add received bytes; return the newest complete JPEG frame in them (or None)."""
+        self._buf += chunk
+        latest = None
+        while True:
+            start = self._buf.find(self.boundary)
+            if start < 0:
+                # Keep a tail in case a boundary is split across chunks
+                del self._buf[:max(0, len(self._buf) - len(self.boundary))]
+                return latest
+            headers_end = self._buf.find(b'\r\n\r\n', start)
+            if headers_end < 0:
+                del self._buf[:start]
+                return latest
+            body_start = headers_end + 4
+            end = self._buf.find(self.boundary, body_start)
+            if end < 0:
+                # The server sends no Content-Length: a part that already ends with the
+                # JPEG end-of-image marker is complete, no need to wait for the next boundary
+                if self._buf.endswith(b'\xff\xd9\r\n') and len(self._buf) > body_start + 4:
+                    latest = bytes(self._buf[body_start:-2])
+                    self.frames_parsed += 1
+                    self._buf.clear()
+                else:
+                    del self._buf[:start]
+                return latest
+            body = bytes(self._buf[body_start:end])
+            if body.endswith(b'\r\n'):
+                body = body[:-2]
+            latest = body
+            self.frames_parsed += 1
+            del self._buf[:end]
+
+
+class FrameStream:
+    """
+    Background reader of /api/camera/stream with latest-frame-only semantics.
+
+    A daemon thread keeps the HTTP stream drained and stores only the newest frame,
+    so callers (widget callbacks, analysis loops) read it without touching the network.
+    """
+
+    def __init__(self, session, url, chunk_size=64 * 1024, timeout=5):
+        self.session = session
+        self.url = url
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.frame = None
+        self.sequence = 0
+        self.timestamp = None
+        self.error = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.session.get(self.url, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    content_type = response.headers.get('Content-Type', '')
+                    boundary = content_type.split('boundary=')[-1].strip() if 'boundary=' in content_type else 'frame'
+                    parser = MJPEGParser(boundary.encode())
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        if self._stop.is_set():
+                            break
+                        frame = parser.feed(chunk)
+                        if frame is not None:
+                            with self._cond:
+                                self.frame = frame
+                                self.sequence += 1
+                                self.timestamp = time.time()
+                                self._cond.notify_all()
+                self.error = None
+            except requests.RequestException as e:
+                self.error = e
+                self._stop.wait(1.0)  # retry after a short pause
+
+    def latest(self):
+        """Return (sequence, timestamp, jpeg bytes) of the newest frame; jpeg is None before the first."""
+        with self._cond:
+            return self.sequence, self.timestamp, self.frame
+
+    def wait_next(self, after_sequence=None, timeout=None):
+        """Block until a frame newer than after_sequence (default: the current one) arrives."""
+        with self._cond:
+            after = self.sequence if after_sequence is None else after_sequence
+            self._cond.wait_for(lambda: self.sequence > after, timeout=timeout)
+            return self.sequence, self.timestamp, self.frame
+
+
+class MicroscopeClient:
+    """
+    Client for microscope_api.py using one pooled keep-alive session.
+
+    Blocking calls are also available through submit() so notebook callbacks can
+    return immediately while the request runs on a worker thread.
+    """
+
+    def __init__(self, pi_ip, port=5000, pool_size=4, timeout=5):
+        self.base_url = f'http://{pi_ip}:{port}/api'
+        self.timeout = timeout
+        self.session = requests.Session()
+        # One connection per worker plus the one the frame stream holds open
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size + 1)
+        self.session.mount('http://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='microscope')
+        self._stream = None
+        self._widget_threads = {}
+
+    # ─────────────────────────────────────────────
+    # REST endpoints
+    # ─────────────────────────────────────────────
+    def _get(self, path, **kwargs):
+        response = self.session.get(f'{self.base_url}{path}', timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _post(self, path, data=None):
+        response = self.session.post(f'{self.base_url}{path}', json=data, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def init_camera(self):               return self._post('/camera/init')
+    def get_camera_settings(self):       return self._get('/camera/settings').json()['settings']
+    def set_camera_settings(self, **kw): return self._post('/camera/settings', kw)['settings']
+    def get_exposure(self):              return self._get('/camera/exposure').json()['exposure_time_us']
+    def get_strobe_settings(self):       return self._get('/strobe/settings').json()['settings']
+    def set_strobe(self, **kw):          return self._post('/strobe/settings', kw)['settings']
+    def get_frame_ring(self):            return self._get('/camera/ring').json()['ring']
+    def set_frame_ring(self, **kw):      return self._post('/camera/ring', kw)['ring']
+
+    def capture(self):
+        """Capture a still frame and return its JPEG bytes."""
+        return self._get('/camera/capture').content
+
+    def submit(self, func, *args, callback=None, on_error=None, **kwargs):
+        """
+        Run a client call on a worker thread and return its Future.
+
+        Exceptions stay in the Future unless on_error is given (or .result() is called),
+        so fire-and-forget callers should pass on_error to see failed requests.
+
+        Example:
+            client.submit(client.set_strobe, period_ns=50000, enable=True, on_error=print)
+            client.submit(client.capture, callback=lambda jpeg: image.set_trait('value', jpeg))
+        """
+        future = self._executor.submit(func, *args, **kwargs)
+
+        def done(f):
+            error = f.exception()
+            if error is not None:
+                if on_error is not None:
+                    on_error(error)
+            elif callback is not None:
+                callback(f.result())
+
+        if callback is not None or on_error is not None:
+            future.add_done_callback(done)
+        return future
+
+    # ─────────────────────────────────────────────
+    # Streaming
+    # ─────────────────────────────────────────────
+    def stream(self):
+        """Start (or return the running) background frame stream."""
+        if self._stream is None:
+            self._stream = FrameStream(self.session, f'{self.base_url}/camera/stream', timeout=self.timeout)
+        return self._stream.start()
+
+    def latest_frame(self):
+        """JPEG bytes of the newest streamed frame (None before the first)."""
+        return self.stream().latest()[2]
+
+    def attach_widget(self, image_widget, max_fps=15):
+        """
+        Push streamed frames into an ipywidgets.Image (format='jpeg') from a background thread.
+
+        The JPEG bytes are assigned as-is, without decoding or base64 encoding on the host.
+        Frames arriving faster than max_fps are skipped.
+        """
+        self.detach_widget(image_widget)
+        stream = self.stream()
+        stop = threading.Event()
+
+        def push():
+            sequence = 0
+            while not stop.is_set():
+                sequence, _, frame = stream.wait_next(sequence, timeout=1.0)
+                if frame is not None and not stop.is_set():
+                    image_widget.value = frame
+                stop.wait(1.0 / max_fps)
+
+        thread = threading.Thread(target=push, daemon=True)
+        self._widget_threads[id(image_widget)] = (thread, stop)
+        thread.start()
+
+    def detach_widget(self, image_widget):
+        entry = self._widget_threads.pop(id(image_widget), None)
+        if entry is not None:
+            entry[1].set()
+
+    def stop_stream(self):
+        for key in list(self._widget_threads):
+            self._widget_threads.pop(key)[1].set()
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream = None
+
+    def close(self):
+        self.stop_stream()
+        self._executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,522 @@
+"""
+Droplet generation frequency estimator and strobe auto-lock.
+
+The frequency and phase of droplet generation are estimated from a signal sampled at
+a fixed rate: a line profile across the channel recorded over time (a kymograph,
+time x position) or the intensity of a small ROI over a burst of frames. All
+positions are processed at once with FFTs:
+
+- the summed power spectrum gives the dominant frequency (parabolic interpolation
+  between bins)
+- the peak can be a harmonic of the droplet frequency, or, above a quarter of the
+  sample rate, a harmonic folded back below Nyquist (2f shows up at fs - 2f). Every
+  droplet frequency that would put a harmonic at the peak, (k * fs ± peak) / m, is
+  checked by folding the samples at its period (epoch folding): the fraction of the
+  signal variance explained by the mean profile per phase bin measures how periodic
+  the signal is at that frequency, and the lowest harmonic order that explains the
+  signal about as well as the best candidate wins
+- a single-frequency DFT at the refined frequency gives the phase, i.e. when a
+  droplet passes the line relative to the first sample
+
+The strobe is then locked by setting period_ns to a whole number of droplet periods,
+so every flash sees a droplet at the same place. wait_ns is only set when the source
+also gives the time of a frame/flash trigger within the signal (a third item returned
+by the acquire callable): the droplet arrival is then taken relative to that trigger.
+Host timestamps of streamed JPEG frames are far too coarse for that, so with the
+camera stream only the period is locked. StrobeLock repeats this periodically and
+only sends new settings when the estimate has moved, to follow drifts of the flow
+conditions.
+
+The signal has to come from a source sampled fast enough for the droplet frequency.
+Above Nyquist the estimate is the droplet frequency. Below it the aliased frequency
+is unfolded with the frequency expected from the dispersed-phase flow and the droplet
+size (expected_frequency()), which only works while the sample rate is large compared
+with the uncertainty of that expectation; check_sampling() rejects slower sources up
+front. Droplets are usually produced at kHz rates, so the ~49 fps camera stream
+(stream_burst) is only usable for slow generation; kHz droplets need a fast line
+profile (line-scan camera, photodiode, cropped high-speed camera mode).
+
+Usage:
+    python strobe_lock.py --demo --frequency 850 --sample-rate 5000
+    python strobe_lock.py --demo --frequency 850 --sample-rate 700 --flow 25 --diameter 25
+    python strobe_lock.py --check
+"""
+import sys
+import time
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Strobe period range of the UI slider (1 µs .. 10 ms)
+PERIOD_RANGE_NS = (1_000, 10_000_000)
+
+# Harmonic orders checked, phase bins of the epoch folding, and how far below the best
+# folding score a lower harmonic order still wins
+MAX_HARMONIC = 4
+FOLD_BINS = 16
+FOLD_TOLERANCE = 0.05
+
+
+def expected_frequency(flow_ul_h, diameter_um):
+    """Droplets per second produced by a dispersed-phase flow (µL/h) at a droplet diameter (µm)."""
+    volume_um3 = np.pi * diameter_um ** 3 / 6
+    return flow_ul_h * 1e9 / 3600 / volume_um3
+
+
+def _refine_peak(values, k):
+    """Sub-bin position of a peak at index k by parabolic interpolation (on log values)."""
+    if k <= 0 or k >= len(values) - 1:
+        return float(k)
+    a, b, c = np.log(np.maximum(values[k - 1:k + 2], 1e-300))
+    denominator = a - 2 * b + c
+    return k + (0.5 * (a - c) / denominator if denominator < 0 else 0.0)
+
+
+def _fold_score(x, sample_rate, frequency, bins=FOLD_BINS):
+    """Fraction of the variance of x (time x positions, zero mean) explained by its mean per phase bin."""
+    phase_bin = (np.arange(x.shape[0]) * (frequency / sample_rate) % 1 * bins).astype(np.int64)
+    one_hot = (phase_bin[None, :] == np.arange(bins)[:, None]).astype(np.float64)
+    counts = one_hot.sum(axis=1)
+    sums = one_hot @ x
+    return float((sums ** 2 / np.maximum(counts, 1)[:, None]).sum() / max((x ** 2).sum(), 1e-300))
+
+
+def estimate_frequency(signal, sample_rate, band=None, dark=False, harmonics=True):
+    """
+    Dominant frequency and phase of a periodic signal.
+
+    Args:
+        signal (np.ndarray): Samples over time (1D), or time x positions (2D, e.g. a
+            line profile across the channel per time step)
+        sample_rate (float): Samples per second
+        band (tuple, optional): (min, max) frequency in Hz to search
+        dark (bool): Droplets appear darker than the background at the line, so their
+            arrival is at the signal minimum
+        harmonics (bool): Check that the peak is not a (folded) harmonic. Off for
+            aliased signals, which go through unalias() instead
+
+    Returns:
+        dict: frequency (Hz), arrival_s (time of the first droplet passage after the
+            first sample, within one period), snr (peak over median spectral power)
+            and periodicity (fraction of the signal variance explained by the mean
+            profile over one period, 1 = perfectly periodic)
+    """
+    x = np.asarray(signal, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, None]
+    n = x.shape[0]
+    x = x - x.mean(axis=0)
+    nfft = 1 << int(np.ceil(np.log2(2 * n)))  # zero-padded: finer bins, no circular wrap
+
+    power = (np.abs(np.fft.rfft(x * np.hanning(n)[:, None], nfft, axis=0)) ** 2).sum(axis=1)
+    freqs = np.fft.rfftfreq(nfft, 1 / sample_rate)
+    low, high = band if band is not None else (0.0, sample_rate / 2)
+    valid = (freqs >= max(low, 2 * sample_rate / n)) & (freqs <= high)
+    if not valid.any():
+        raise ValueError('No frequency bins in the search band')
+    candidates = np.flatnonzero(valid)
+    k = candidates[np.argmax(power[candidates])]
+    peak = _refine_peak(power, k) * sample_rate / nfft
+
+    # Droplet frequencies with a (folded) harmonic at the peak, as (order, frequency)
+    candidates = [(1, peak)]
+    for m in range(2, MAX_HARMONIC + 1) if harmonics else ():
+        for j in range(m // 2 + 1):
+            for f in ((j * sample_rate + peak) / m, (j * sample_rate - peak) / m):
+                if max(low, 2 * sample_rate / n) <= f <= min(high, sample_rate / 2):
+                    candidates.append((m, f))
+    scores = np.array([_fold_score(x, sample_rate, f) for _, f in candidates])
+    # A signal periodic at f is also periodic at f / 2, f / 3, ... and at commensurate
+    # rates (fs / f whole) some higher candidates fold the samples the same way, so the
+    # lowest order close to the best score is the fundamental
+    i = min(np.flatnonzero(scores >= scores.max() - FOLD_TOLERANCE), key=lambda i: (candidates[i][0], -scores[i]))
+    frequency, periodicity = candidates[i][1], scores[i]
+
+    # Phase at the refined frequency with a single-frequency DFT over all positions
+    t = np.arange(n) / sample_rate
+    weights = np.hanning(n) * np.exp(-2j * np.pi * frequency * t)
+    phase = np.angle((weights @ x).sum())
+    period = 1 / frequency
+    arrival = ((np.pi if dark else 0.0) - phase) / (2 * np.pi * frequency) % period
+
+    noise = np.median(power[valid])
+    return {
+        'frequency': float(frequency),
+        'arrival_s': float(arrival),
+        'snr': float(power[k] / noise) if noise > 0 else float('inf'),
+        'periodicity': float(periodicity),
+    }
+
+
+def check_sampling(sample_rate, expected=None, tolerance=0.2):
+    """
+    Decide whether a signal sampled at sample_rate can give the droplet frequency.
+
+    Without an expected frequency the source is taken to be above Nyquist. With one,
+    the candidates k * sample_rate ± f lie at most sample_rate apart, so when
+    sample_rate is below the width of the expected band (2 * tolerance * expected)
+    several of them always fall inside it and the estimate can never be unfolded.
+
+    Args:
+        sample_rate (float): Samples per second
+        expected (float, optional): Expected droplet frequency in Hz
+        tolerance (float): Relative uncertainty of `expected`
+
+    Returns:
+        bool: True if the signal is aliased and has to go through unalias()
+
+    Raises:
+        ValueError: If the sample rate is too low to resolve the droplet frequency
+    """
+    if expected is None or sample_rate > 2 * expected * (1 + tolerance):
+        return False
+    if sample_rate <= 2 * tolerance * expected:
+        raise ValueError(f'{sample_rate:g} Hz sampling cannot resolve droplets at about {expected:.0f} Hz '
+                         f'(± {tolerance:.0%}): use a source faster than {2 * tolerance * expected:.0f} Hz, '
+                         f'ideally above {2 * expected * (1 + tolerance):.0f} Hz')
+    return True
+
+
+def unalias(estimate, sample_rate, expected, tolerance=0.2):
+    """
+    Unfold a frequency measured below Nyquist to the true droplet frequency.
+
+    The candidates are k * sample_rate ± f; the one closest to `expected` is taken.
+    For a folded candidate (k * fs - f) time runs backwards in the samples, so the
+    arrival time is mirrored.
+
+    Args:
+        estimate (dict): Result of estimate_frequency()
+        sample_rate (float): Samples per second
+        expected (float): Expected droplet frequency in Hz (expected_frequency())
+        tolerance (float): Relative uncertainty of `expected`
+
+    Returns:
+        dict: The estimate with the true frequency, its arrival_s, the alias order and
+            `ambiguous` set when another candidate also falls within the tolerance
+    """
+    f = estimate['frequency']
+    k = np.arange(max(int(expected / sample_rate) - 2, 0), int(expected / sample_rate) + 3)
+    candidates = np.concatenate([k * sample_rate + f, k * sample_rate - f])
+    signs = np.concatenate([np.ones(k.size), -np.ones(k.size)])
+    keep = candidates > 0
+    candidates, signs = candidates[keep], signs[keep]
+    i = int(np.argmin(np.abs(candidates - expected)))
+    within = np.abs(candidates - expected) <= tolerance * expected
+    frequency = float(candidates[i])
+    # Arrival time modulo the true period, from the phase seen at the aliased frequency
+    phase = 2 * np.pi * f * estimate['arrival_s']
+    arrival = (signs[i] * phase) / (2 * np.pi * frequency) % (1 / frequency)
+    return {**estimate, 'frequency': frequency, 'arrival_s': float(arrival),
+            'alias_order': int(round(frequency / sample_rate)), 'ambiguous': int(within.sum()) > 1}
+
+
+def strobe_timing(frequency, arrival_s=None, phase=0.0, period_range_ns=PERIOD_RANGE_NS):
+    """
+    Strobe settings that freeze droplets of the given frequency.
+
+    Args:
+        frequency (float): Droplet frequency in Hz
+        arrival_s (float, optional): Droplet passage time after the frame/flash trigger;
+            without it only the period is returned
+        phase (float): Fraction of a droplet period to add to the flash delay, to
+            choose where the frozen droplets sit
+        period_range_ns (tuple): Allowed strobe period range
+
+    Returns:
+        dict: period_ns (a whole number of droplet periods), the multiple used and,
+            with arrival_s, wait_ns
+
+    Raises:
+        ValueError: If no whole number of droplet periods fits the strobe range
+    """
+    droplet_ns = 1e9 / frequency
+    multiple = max(1, int(np.ceil(period_range_ns[0] / droplet_ns)))
+    if multiple * droplet_ns > period_range_ns[1]:
+        raise ValueError(f'Droplet period {droplet_ns:.0f} ns is outside the strobe range {period_range_ns}')
+    timing = {'period_ns': int(round(multiple * droplet_ns)), 'multiple': multiple}
+    if arrival_s is not None:
+        timing['wait_ns'] = int(round((arrival_s + phase / frequency) * 1e9 % droplet_ns))
+    return timing
+
+
+def kymograph(frames, line, axis=0, width=1):
+    """
+    Line profile across the channel per frame.
+
+    Args:
+        frames (iterable): 2D frames in time order
+        line (int): Row (axis=0) or column (axis=1) of the line
+        width (int): Number of neighbouring lines averaged
+
+    Returns:
+        np.ndarray: time x position
+    """
+    half = slice(line - width // 2, line - width // 2 + width)
+    return np.stack([np.asarray(f, dtype=np.float32)[half].mean(axis=0) if axis == 0
+                     else np.asarray(f, dtype=np.float32)[:, half].mean(axis=1) for f in frames])
+
+
+def stream_burst(client, n_frames, line, axis=0, width=3, fps=None, timeout=2.0):
+    """
+    Record a kymograph from the live stream of a MicroscopeClient.
+
+    The stream keeps only the newest frame, so frames can be skipped; the profiles are
+    resampled onto a uniform time grid at `fps` (default: the camera setting). At camera
+    rates this only resolves slow droplet generation (see check_sampling()), and the
+    host timestamps give no trigger reference, so only the strobe period can be locked.
+
+    Returns:
+        tuple: (time x position array, sample rate)
+    """
+    from PIL import Image
+    import io
+
+    fps = fps or client.get_camera_settings()['fps']
+    stream = client.stream()
+    sequence = stream.latest()[0]
+    times, profiles = [], []
+    while len(profiles) < n_frames:
+        sequence, timestamp, jpeg = stream.wait_next(sequence, timeout=timeout)
+        if jpeg is None:
+            raise TimeoutError('No frames from the camera stream')
+        times.append(timestamp)
+        profiles.append(kymograph([np.asarray(Image.open(io.BytesIO(jpeg)).convert('L'))], line, axis, width)[0])
+    times = np.asarray(times) - times[0]
+    profiles = np.asarray(profiles)
+    grid = np.arange(0, times[-1], 1 / fps)
+    resampled = np.stack([np.interp(grid, times, profiles[:, j]) for j in range(profiles.shape[1])], axis=1)
+    return resampled, fps
+
+
+class StrobeLock:
+    """
+    Keep the strobe locked on the droplet generation frequency.
+
+    Args:
+        client: MicroscopeClient (anything with set_strobe(**settings))
+        acquire (callable): Returns (signal, sample_rate) or (signal, sample_rate,
+            trigger_s), trigger_s being the time of a frame/flash trigger after the first
+            sample; e.g. a partial of stream_burst
+        interval_s (float): Seconds between re-checks
+        expected (callable, optional): Returns the expected droplet frequency in Hz (for
+            aliased signals), e.g. from the current pump flow and target diameter
+        phase (float): Fraction of a period added to the flash delay
+        tolerance (float): Relative frequency change that triggers an update
+        expected_tolerance (float): Relative uncertainty of the expected frequency
+        min_periodicity (float): Estimates with a lower autocorrelation are not applied
+        dark (bool): Droplets are darker than the background at the line
+    """
+
+    def __init__(self, client, acquire, interval_s=10.0, expected=None, phase=0.0, tolerance=0.01,
+                 expected_tolerance=0.2, min_periodicity=0.3, dark=False):
+        self.client = client
+        self.acquire = acquire
+        self.interval_s = interval_s
+        self.expected = expected
+        self.phase = phase
+        self.tolerance = tolerance
+        self.expected_tolerance = expected_tolerance
+        self.min_periodicity = min_periodicity
+        self.dark = dark
+        self.settings = None
+        self.log = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """
+        Estimate once and update the strobe if needed; returns the log row.
+
+        Raises:
+            ValueError: If the source is too slow for the expected frequency, or the
+                droplet period does not fit the strobe range
+        """
+        acquired = self.acquire()
+        signal, sample_rate = acquired[:2]
+        trigger_s = acquired[2] if len(acquired) > 2 else None
+        expected = self.expected() if self.expected is not None else None
+        aliased = check_sampling(sample_rate, expected, self.expected_tolerance)
+        start = time.perf_counter()
+        estimate = estimate_frequency(signal, sample_rate, dark=self.dark, harmonics=not aliased)
+        if aliased:
+            estimate = unalias(estimate, sample_rate, expected, self.expected_tolerance)
+        elapsed = time.perf_counter() - start
+
+        row = {'Timestamp': time.time(), **estimate, 'EstimateMs': elapsed * 1e3, 'applied': False}
+        usable = estimate['periodicity'] >= self.min_periodicity and not estimate.get('ambiguous', False)
+        if usable:
+            arrival = None if trigger_s is None else estimate['arrival_s'] - trigger_s
+            timing = strobe_timing(estimate['frequency'], arrival, self.phase)
+            row.update(timing)
+            droplet_ns = timing['period_ns'] / timing['multiple']
+            previous = self.settings
+            moved = (previous is None
+                     or abs(droplet_ns - previous['period_ns'] / previous['multiple']) > self.tolerance * droplet_ns)
+            if not moved and 'wait_ns' in timing:
+                # Circular difference: a delay wrapping around the period has not moved
+                shift = (timing['wait_ns'] - previous.get('wait_ns', 0) + droplet_ns / 2) % droplet_ns - droplet_ns / 2
+                moved = abs(shift) > self.tolerance * droplet_ns
+            if moved:
+                settings = {key: timing[key] for key in ('period_ns', 'wait_ns') if key in timing}
+                self.client.set_strobe(enable=True, **settings)
+                self.settings = timing
+                row['applied'] = True
+        self.log.append(row)
+        return row
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except (ValueError, TimeoutError) as e:
+                self.log.append({'Timestamp': time.time(), 'error': str(e), 'applied': False})
+            self._stop.wait(self.interval_s)
+
+    def start(self):
+        """Re-check in a background thread every interval_s seconds."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def log_frame(self):
+        return pd.DataFrame(self.log)
+
+
+def check_estimates(cases=((850, 5000), (1300, 5000), (1800, 5000), (2100, 5000), (2450, 5000), (20, 49),
+                           (850, 700, 850)), tolerance=0.005, n_samples=1024):
+    """
+    Check the estimator on synthetic kymographs.
+
+    Above a quarter of the sample rate a folded harmonic can be the strongest peak
+    (1300, 1800 and 2100 Hz at 5 kHz), below Nyquist the estimate is unfolded with the
+    expected frequency.
+
+    Args:
+        cases (tuple): (droplet frequency, sample rate) pairs, with the expected
+            frequency as a third item for sources below Nyquist
+
+    Returns:
+        list: (frequency, sample rate, estimated frequency)
+
+    Raises:
+        AssertionError: If an estimate is more than `tolerance` (relative) off
+    """
+    results = []
+    for frequency, sample_rate, *expected in cases:
+        expected = expected[0] if expected else None
+        aliased = check_sampling(sample_rate, expected)
+        signal = synthetic_kymograph(frequency, sample_rate, n_samples, arrival_s=0.3 / frequency, seed=0)
+        estimate = estimate_frequency(signal, sample_rate, harmonics=not aliased)
+        if aliased:
+            estimate = unalias(estimate, sample_rate, expected)
+        results.append((frequency, sample_rate, estimate['frequency']))
+    for frequency, sample_rate, estimated in results:
+        assert abs(estimated - frequency) <= tolerance * frequency, \
+            f"{frequency} Hz sampled at {sample_rate} Hz estimated as {estimated:.2f} Hz"
+    return results
+
+
+def synthetic_kymograph(frequency, sample_rate, n_samples=1024, positions=64, diameter_px=20,
+                        arrival_s=0.0, jitter=0.02, noise=0.1, seed=None):
+    """
+    Line profile across a channel over time with droplets passing at `frequency`.
+
+    Each passage is a dark rim around a brighter core; each droplet arrives up to about
+    `jitter` (fraction of a period) early or late.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_samples) / sample_rate
+    period = 1 / frequency
+    n_drops = int(t[-1] * frequency) + 3
+    passages = arrival_s + period * (np.arange(-1, n_drops - 1) + jitter * rng.standard_normal(n_drops))
+    # Distance (in droplet periods) from the nearest passage, per sample
+    nearest = np.abs(t[:, None] - passages[None, :]).min(axis=1) / period
+    profile = np.exp(-(np.linspace(-1, 1, positions) / 0.8) ** 8)[None, :]  # channel walls
+    core = np.exp(-(nearest / 0.15) ** 2)[:, None]
+    rim = np.exp(-((nearest - 0.2) / 0.05) ** 2)[:, None]
+    return (core - 0.6 * rim) * profile + noise * rng.standard_normal((n_samples, positions))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Estimate droplet frequency and lock the strobe on it')
+    parser.add_argument('--demo', action='store_true', help='Run on a synthetic kymograph')
+    parser.add_argument('--check', action='store_true',
+                        help='Check the estimator on synthetic kymographs (incl. 1300, 1800, 2100 Hz at 5 kHz)')
+    parser.add_argument('--frequency', type=float, default=850.0, help='Demo droplet frequency in Hz')
+    parser.add_argument('--sample-rate', type=float, default=5000.0, help='Demo samples (frames) per second')
+    parser.add_argument('--samples', type=int, default=1024, help='Samples per burst (default: 1024)')
+    parser.add_argument('--flow', type=float, help='Dispersed-phase flow in µL/h, to unfold aliased signals')
+    parser.add_argument('--diameter', type=float, help='Droplet diameter in µm, to unfold aliased signals')
+    parser.add_argument('--expected-tolerance', type=float, default=0.2,
+                        help='Relative uncertainty of the frequency expected from --flow/--diameter')
+    parser.add_argument('--pi-ip', help='Lock the strobe of this microscope using its live stream')
+    parser.add_argument('--line', type=int, default=384, help='Stream row crossing the channel (default: 384)')
+    parser.add_argument('--interval', type=float, default=10.0, help='Seconds between re-checks')
+    args = parser.parse_args()
+
+    expected = expected_frequency(args.flow, args.diameter) if args.flow and args.diameter else None
+
+    if args.check:
+        for frequency, sample_rate, estimated in check_estimates():
+            print(f"{frequency:7.1f} Hz at {sample_rate:6.0f} Hz sampling: estimated {estimated:.2f} Hz")
+        print("OK")
+        sys.exit(0)
+    if args.demo:
+        try:
+            aliased = check_sampling(args.sample_rate, expected, args.expected_tolerance)
+        except ValueError as e:
+            parser.error(str(e))
+        truth_arrival = 0.3 / args.frequency
+        signal = synthetic_kymograph(args.frequency, args.sample_rate, args.samples, arrival_s=truth_arrival, seed=0)
+        start = time.perf_counter()
+        estimate = estimate_frequency(signal, args.sample_rate, harmonics=not aliased)
+        if aliased:
+            estimate = unalias(estimate, args.sample_rate, expected, args.expected_tolerance)
+        elapsed = time.perf_counter() - start
+        print(f"Estimated {estimate['frequency']:.2f} Hz (true {args.frequency:.2f}), arrival "
+              f"{estimate['arrival_s'] * 1e6:.1f} µs (true {truth_arrival * 1e6:.1f}), "
+              f"periodicity {estimate['periodicity']:.2f}, SNR {estimate['snr']:.0f}, in {elapsed * 1e3:.1f} ms")
+        if estimate.get('ambiguous'):
+            print("! ambiguous: several aliases match the expected frequency")
+        else:
+            try:
+                # The synthetic signal starts at the frame trigger
+                print(strobe_timing(estimate['frequency'], estimate['arrival_s']))
+            except ValueError as e:
+                print(f"! {e}; without --flow/--diameter the sample rate must exceed twice the droplet frequency")
+    elif args.pi_ip:
+        from microscope_client import MicroscopeClient
+
+        client = MicroscopeClient(args.pi_ip)
+        try:
+            # Reject a stream too slow for the expected droplet rate before locking on noise
+            check_sampling(client.get_camera_settings()['fps'], expected, args.expected_tolerance)
+        except ValueError as e:
+            client.close()
+            parser.error(str(e))
+        lock = StrobeLock(client, lambda: stream_burst(client, args.samples, args.line), args.interval,
+                          expected=(lambda: expected) if expected else None,
+                          expected_tolerance=args.expected_tolerance)
+        try:
+            while True:
+                try:
+                    lock.check()
+                    print(lock.log[-1])
+                except (ValueError, TimeoutError) as e:
+                    print(f"! {e}")
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            client.close()
+    else:
+        parser.error('use --demo or --pi-ip')
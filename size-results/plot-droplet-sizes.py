@@ -1,99 +1,203 @@
-import pandas as pd
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+import sys
+import glob
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'data-acquisition-analysis'))
+from results_store import ResultsStore
+from streaming_stats import RunningStats, QuantileSketch, iter_column_chunks
 
 # Set style for better-looking plots
 plt.style.use('seaborn-v0_8-whitegrid')
 
-def plot_droplet_size_distribution(csv_path, size_category, x_range=None, y_range=None):
-    # Read the CSV file
-    df = pd.read_csv(csv_path)
-    
+EXPERIMENT = 'single_bac'
+N_BINS = 30
+CHUNK_SIZE = 1_000_000
+AXIS_MARGIN = 0.05  # same padding matplotlib adds around autoscaled data
+
+def store_source(csv_path, store=None):
+    """
+    Return a chunk factory for the Feret column of one condition in the results store.
+
+    The CSV is imported into the store the first time it is used and again whenever it changes.
+    """
+    store = store or ResultsStore()
+    condition = Path(csv_path).stem.replace('Results_', '')
+    if not store.has('droplets', source=csv_path, experiment=EXPERIMENT, condition=condition):
+        store.ingest_imagej_results(csv_path, 'droplets', EXPERIMENT, condition)
+    filters = [('experiment', '==', EXPERIMENT), ('condition', '==', condition)]
+
+    def chunks():
+        for batch in store.iter_batches('droplets', ['Feret'], filters, CHUNK_SIZE):
+            yield batch.column(0).to_numpy(zero_copy_only=False)
+    return chunks
+
+def file_source(paths, column='Feret'):
+    """Return a chunk factory over a column of many CSV/Parquet files (e.g. all runs of a condition)."""
+    def chunks():
+        for path in paths:
+            yield from iter_column_chunks(path, column, CHUNK_SIZE)
+    return chunks
+
+def compute_size_statistics(chunks, n_bins=N_BINS):
+    """
+    Compute Feret statistics and histogram counts for one condition without loading it whole.
+
+    The first pass feeds a Welford accumulator and a quantile sketch; the second pass
+    counts the histogram over bins spanning the observed min..max.
+
+    Args:
+        chunks (callable): Returns an iterator of NumPy arrays of Feret diameters
+        n_bins (int): Number of histogram bins
+
+    Returns:
+        dict: n, mean, median, std, cv, min, max, edges and counts
+    """
+    stats = RunningStats()
+    sketch = QuantileSketch()
+    for values in chunks():
+        stats.update(values)
+        sketch.update(values)
+    if stats.count == 0:
+        return None
+
+    edges = np.histogram_bin_edges([stats.min, stats.max], bins=n_bins)
+    counts = np.zeros(n_bins, dtype=np.int64)
+    for values in chunks():
+        counts += np.histogram(values[np.isfinite(values)], bins=edges)[0]
+
+    return {
+        'n': stats.count,
+        'mean': stats.mean,
+        'median': sketch.quantile(0.5),
+        'std': stats.std,
+        'cv': stats.cv,
+        'min': stats.min,
+        'max': stats.max,
+        'edges': edges,
+        'counts': counts,
+    }
+
+def shared_axis_ranges(all_stats):
+    """Common x/y limits for all conditions, computed from the histogram bins and counts."""
+    x_min = min(s['edges'][0] for s in all_stats)
+    x_max = max(s['edges'][-1] for s in all_stats)
+    y_max = max(s['counts'].max() for s in all_stats)
+    pad = (x_max - x_min) * AXIS_MARGIN
+    return [x_min - pad, x_max + pad], [0, y_max * (1 + AXIS_MARGIN)]
+
+def plot_droplet_size_distribution(stats, size_category, x_range=None, y_range=None):
     # Create figure and axis
     fig, ax = plt.subplots(figsize=(8, 6))
-    
-    # Calculate statistics
-    feret = df['Feret']
-    mean_size = feret.mean()
-    std_dev = feret.std()
-    cv = (std_dev / mean_size) * 100  # Coefficient of variation in percentage
-    
-    # Plot histogram
-    n, bins, patches = ax.hist(feret, bins=30, color='#1f77b4', edgecolor='black', alpha=0.7, density=False)
-    
+
+    mean_size = stats['mean']
+
+    # Plot histogram from the precomputed bins
+    edges = stats['edges']
+    ax.bar(edges[:-1], stats['counts'], width=np.diff(edges), align='edge',
+           color='#1f77b4', edgecolor='black', alpha=0.7)
+
     # Add a vertical line at the mean
-    ax.axvline(mean_size, color='#d62728', linestyle='--', linewidth=2, 
+    ax.axvline(mean_size, color='#d62728', linestyle='--', linewidth=2,
                label=f'Mean: {mean_size:.2f} µm')
-    
+
     # Set axis ranges if provided
     if x_range:
         ax.set_xlim(x_range)
     if y_range:
         ax.set_ylim(y_range)
-    
+
     # Add labels and title
     ax.tick_params(axis='both', which='major', labelsize=10)
     ax.set_xlabel('Droplet Size (µm)', fontsize=12)
     ax.set_ylabel('Count', fontsize=12)
-    ax.set_title(f'Droplet Size Distribution - Target Size: {size_category} (n = {len(df)})', 
+    ax.set_title(f'Droplet Size Distribution - Target Size: {size_category} (n = {stats["n"]})',
                 fontsize=14, pad=15)
 
     # Add grid and legend
     ax.grid(True, linestyle='--', alpha=0.5)
-    
+
     # Add text with statistics
     stats_text = (f'Mean: {mean_size:.2f} µm\n'
-                 f'Median: {feret.median():.2f} µm\n'
-                 f'Std Dev: {std_dev:.2f} µm\n'
-                 f'CV: {cv:.1f}%\n'
-                 f'Min: {feret.min():.2f} µm\n'
-                 f'Max: {feret.max():.2f} µm')
-    
-    ax.text(0.98, 0.98, stats_text, transform=ax.transAxes, 
+                 f'Median: {stats["median"]:.2f} µm\n'
+                 f'Std Dev: {stats["std"]:.2f} µm\n'
+                 f'CV: {stats["cv"]:.1f}%\n'
+                 f'Min: {stats["min"]:.2f} µm\n'
+                 f'Max: {stats["max"]:.2f} µm')
+
+    ax.text(0.98, 0.98, stats_text, transform=ax.transAxes,
             bbox=dict(facecolor='white', alpha=0.8, edgecolor='gray',
                 boxstyle='round,pad=0.5'), fontsize=10,
                 verticalalignment='top', horizontalalignment='right')
-    
+
     # Adjust layout
     plt.tight_layout()
-    
+
     # Save in multiple formats
     base_filename = f'droplet_distribution_{size_category}'
     for ext in ['.png', '.pdf']:
         output_file = base_filename + ext
         plt.savefig(output_file, dpi=300, bbox_inches='tight', pad_inches=0.1)
-    
-    plt.close()
-
-    return f'{base_filename}.png', f'{base_filename}.pdf', ax.get_xlim(), ax.get_ylim()
-
-# Process both CSV files
-csv_files = {
-    '25 µm': 'Results_25um.csv',
-    '30 µm': 'Results_30um.csv'
-}
-
-output_files = []
-x_range = None
-y_range = None
-
-# First pass to get the maximum ranges
-for size, filename in csv_files.items():
-    if os.path.exists(filename):
-        _, _, current_xlim, current_ylim = plot_droplet_size_distribution(filename, size)
-        if x_range is None:
-            x_range = list(current_xlim)
-            y_range = list(current_ylim)
-        else:
-            x_range[0] = min(x_range[0], current_xlim[0])
-            x_range[1] = max(x_range[1], current_xlim[1])
-            y_range[1] = max(y_range[1], current_ylim[1])
-
-# Second pass to create final plots with consistent ranges
-for size, filename in csv_files.items():
-    if os.path.exists(filename):
-        png_file, pdf_file, _, _ = plot_droplet_size_distribution(filename, size, x_range, y_range)
+
+    plt.close(fig)
+
+    return f'{base_filename}.png', f'{base_filename}.pdf'
+
+def _render(args):
+    matplotlib.use('Agg')
+    return plot_droplet_size_distribution(*args)
+
+def plot_all(sources, workers=None):
+    """
+    Compute statistics for every condition, then render each figure once in parallel.
+
+    Args:
+        sources (dict): Condition label -> chunk factory (see store_source / file_source)
+        workers (int, optional): Number of rendering processes (default: one per CPU)
+    """
+    all_stats = {}
+    for size, chunks in sources.items():
+        stats = compute_size_statistics(chunks)
+        if stats is None:
+            print(f"Warning: no droplets for {size}")
+            continue
+        all_stats[size] = stats
+    if not all_stats:
+        return []
+
+    x_range, y_range = shared_axis_ranges(list(all_stats.values()))
+    jobs = [(stats, size, x_range, y_range) for size, stats in all_stats.items()]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        outputs = list(pool.map(_render, jobs))
+    for png_file, pdf_file in outputs:
         print(f"Created {png_file} and {pdf_file}")
+    return outputs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plot droplet size distributions with shared axes')
+    parser.add_argument('--source', nargs=2, action='append', metavar=('LABEL', 'PATTERN'),
+                        help='Condition label and glob of CSV/Parquet files (all runs of that condition)')
+    parser.add_argument('--workers', type=int, help='Number of rendering processes')
+    args = parser.parse_args()
+
+    if args.source:
+        sources = {label: file_source(sorted(glob.glob(pattern))) for label, pattern in args.source}
     else:
-        print(f"Warning: {filename} not found")
\ No newline at end of file
+        # Process both CSV files
+        csv_files = {
+            '25 µm': 'Results_25um.csv',
+            '30 µm': 'Results_30um.csv'
+        }
+        sources = {}
+        for size, filename in csv_files.items():
+            if os.path.exists(filename):
+                sources[size] = store_source(filename)
+            else:
+                print(f"Warning: {filename} not found")
+
+    plot_all(sources, workers=args.workers)